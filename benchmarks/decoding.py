@@ -0,0 +1,245 @@
+#! /usr/bin/env python
+#
+# Copyright 2014 Google Inc.  All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Microbenchmarks of the payload's object decoding, without gdb.
+
+Usage:
+  python2.7 benchmarks/decoding.py --output=after.json --compare=before.json
+  python2.7 benchmarks/decoding.py --only=dict_iteritems --profile=dict.prof
+
+The payload runs against the fake gdb module in benchmarks/fakegdb, which
+serves memory reads from a synthetic image of CPython objects. That takes gdb
+and the inferior out of the picture, so changes to libpython.py and
+gdb_service.py can be measured (and profiled) in isolation.
+"""
+
+import argparse
+import cProfile
+import itertools
+import json
+import os
+import platform
+import pstats
+import sys
+import tempfile
+import time
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(_HERE, 'fakegdb'),
+                os.path.join(_HERE, os.pardir, 'pyringe', 'payload')]
+# pylint: disable=g-import-not-at-top
+import cpython_image
+import gdb
+import gdb_service
+import libpython
+
+
+CONTAINER_SIZE = 1000
+STACK_DEPTH = 100
+LNOTAB_ENTRIES = 500
+
+_SOURCE = ''.join('line_%d = %d\n' % (i, i) for i in range(LNOTAB_ENTRIES * 2))
+
+
+class Fixtures(object):
+  """The objects the benchmarks decode, built once into the fake memory."""
+
+  def __init__(self):
+    image = cpython_image.Image()
+    self.image = image
+    gdb_service.GdbCache.DICT = gdb.lookup_type('PyDictObject').pointer()
+    gdb_service.GdbCache.TYPE = gdb.lookup_type('PyTypeObject').pointer()
+    # libpython.py caps its loops at 1000 iterations, so this is the largest
+    # dict it decodes completely (its table has 1024 slots).
+    self.dict = image.Object(dict(('key_%d' % i, i) for i in range(
+        CONTAINER_SIZE * 2 // 3)))
+    self.values = {
+        'int': image.Int(1337),
+        'long': image.Long(1 << 200),
+        'str': image.Str('x' * 100),
+        'unicode': image.Unicode(u'\u00e4' * 100),
+        'list': image.Object(range(CONTAINER_SIZE)),
+        'tuple': image.Object(tuple(range(CONTAINER_SIZE))),
+        'dict': self.dict,
+        'set': image.Object(set(range(CONTAINER_SIZE // 2))),
+        'nested': image.Object([{'a': [1, (2, u'3')], 'b': None}] * 50),
+    }
+    old_class = image.OldClass('OldStyle', {'class_attr': 1})
+    new_class = image.Class('NewStyle', dict(
+        ('method_%d' % i, 'doc') for i in range(50)))
+    self.instances = {
+        'old_instance': image.OldInstance(old_class, {'attr': 'value'}),
+        'new_instance': image.Instance(new_class, {'attr': 'value'}),
+    }
+    self.values.update(self.instances)
+
+    source = tempfile.NamedTemporaryFile(prefix='pyringe-bench', suffix='.py',
+                                         delete=False)
+    source.write(_SOURCE)
+    source.close()
+    self.source_path = source.name
+    # Every bytecode offset advances the line by two.
+    lnotab = '\x02\x02' * LNOTAB_ENTRIES
+    self.code = image.Code('Function', self.source_path, 1, ['a', 'b'], lnotab)
+    global_dict = image.Object({'__file__': self.source_path})
+    builtin_dict = image.Object({})
+    frame = None
+    for depth in range(STACK_DEPTH):
+      frame = image.Frame(self.code, [image.Int(depth), 0], global_dict,
+                          builtin_dict, back=frame, lasti=2 * depth)
+    self.frame = frame.cast(gdb.lookup_type('PyFrameObject').pointer())
+    gdb_service.GdbCache.INTERP_HEAD = image.Interpreter(
+        image.ThreadState(frame, 1), builtin_dict)
+
+  def Close(self):
+    os.unlink(self.source_path)
+
+
+def _Proxyval(pointer):
+  return lambda: libpython.PyObjectPtr.from_pyobject_ptr(pointer).proxyval(
+      set())
+
+
+def _DictIteritems(pointer):
+  pyop = libpython.PyObjectPtr.from_pyobject_ptr(pointer)
+  return lambda: list(pyop.iteritems())
+
+
+def _Addr2line(code):
+  pyop = libpython.PyCodeObjectPtr(
+      code.cast(gdb.lookup_type('PyCodeObject').pointer()))
+  return lambda: pyop.addr2line(2 * LNOTAB_ENTRIES - 1)
+
+
+def _Fallback(service, pointer):
+  pyop = libpython.PyObjectPtr.from_pyobject_ptr(pointer)
+  return lambda: service._UnserializableObjectFallback(pyop)  # pylint: disable=protected-access
+
+
+def _Backtrace(service, frame):
+  return lambda: service._BacktraceFromFramePtr(frame)  # pylint: disable=protected-access
+
+
+def _HeapCensus(service, contents):
+  return lambda: service.HeapCensus([None, None, None], contents, None, 'bytes')
+
+
+def _RetainedSizes(service):
+  # A new stop epoch every time, so the heap graph is built every time.
+  epochs = itertools.count()
+  return lambda: service.RetainedSizes([None, None, None], next(epochs), 20)
+
+
+def Benchmarks(fixtures):
+  """Returns a dict of benchmark names to the functions they time."""
+  service = gdb_service.GdbService()
+  benchmarks = {
+      'dict_iteritems': _DictIteritems(fixtures.dict),
+      'addr2line': _Addr2line(fixtures.code),
+      'backtrace': _Backtrace(service, fixtures.frame),
+      'heap_census': _HeapCensus(service, False),
+      'heap_census_contents': _HeapCensus(service, True),
+      'retained_sizes': _RetainedSizes(service),
+  }
+  for name, pointer in fixtures.values.iteritems():
+    benchmarks['proxyval_' + name] = _Proxyval(pointer)
+  for name, pointer in fixtures.instances.iteritems():
+    benchmarks['fallback_' + name] = _Fallback(service, pointer)
+  return benchmarks
+
+
+def Time(func, repeat, number):
+  """Returns the per-call time of `func`, for each of `repeat` batches."""
+  timings = []
+  for _ in range(repeat):
+    start = time.time()
+    for _ in range(number):
+      func()
+    timings.append((time.time() - start) / number)
+  return timings
+
+
+def _Median(values):
+  values = sorted(values)
+  return values[len(values) // 2] if values else None
+
+
+def Summary(report, baseline=None):
+  """Returns a table of median timings, relative to `baseline` if given."""
+  lines = ['%-24s %12s %12s %8s' % ('benchmark', 'before', 'after', 'ratio')]
+  for name in sorted(report['benchmarks']):
+    new = _Median(report['benchmarks'][name])
+    old = None
+    if baseline:
+      old = _Median(baseline['benchmarks'].get(name, []))
+    if old is None:
+      lines.append('%-24s %12s %10.1fus' % (name, '', 1e6 * new))
+    else:
+      lines.append('%-24s %10.1fus %10.1fus %7.2fx' % (
+          name, 1e6 * old, 1e6 * new, new / old if old else 0))
+  return '\n'.join(lines)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--only', help='Comma-separated benchmarks to run.')
+  parser.add_argument('--repeat', type=int, default=5,
+                      help='How many batches to time.')
+  parser.add_argument('--number', type=int, default=10,
+                      help='How many calls make up a batch.')
+  parser.add_argument('--profile',
+                      help='Write cProfile stats of the benchmarks here.')
+  parser.add_argument('--output', help='Where to write the JSON report.')
+  parser.add_argument('--compare', help='A previous report to compare with.')
+  args = parser.parse_args()
+
+  fixtures = Fixtures()
+  try:
+    benchmarks = Benchmarks(fixtures)
+    names = sorted(benchmarks)
+    if args.only:
+      names = args.only.split(',')
+    profiler = cProfile.Profile() if args.profile else None
+    report = {'host': platform.node(),
+              'platform': platform.platform(),
+              'time': time.time(),
+              'repeat': args.repeat,
+              'number': args.number,
+              'benchmarks': {}}
+    for name in names:
+      if profiler:
+        profiler.enable()
+      report['benchmarks'][name] = Time(benchmarks[name], args.repeat,
+                                        args.number)
+      if profiler:
+        profiler.disable()
+  finally:
+    fixtures.Close()
+
+  if profiler:
+    profiler.dump_stats(args.profile)
+    pstats.Stats(args.profile).sort_stats('cumulative').print_stats(20)
+  if args.output:
+    with open(args.output, 'w') as report_file:
+      json.dump(report, report_file, indent=1, sort_keys=True)
+  baseline = None
+  if args.compare:
+    with open(args.compare) as baseline_file:
+      baseline = json.load(baseline_file)
+  print Summary(report, baseline)
+
+
+if __name__ == '__main__':
+  main()
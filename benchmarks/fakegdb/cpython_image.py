@@ -0,0 +1,544 @@
+#! /usr/bin/env python
+#
+# Copyright 2014 Google Inc.  All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Synthetic memory images of CPython 2.7 objects for the fake gdb module.
+
+Image lays out objects the way a 64-bit, UCS4 CPython 2.7 build does, so
+libpython.py decodes them exactly like it decodes a real inferior:
+
+  image = cpython_image.Image()
+  pointer = image.Object({'key': [1, 2L, u'three']})
+  libpython.PyObjectPtr.from_pyobject_ptr(pointer).proxyval(set())
+"""
+
+import struct
+
+import gdb
+
+
+Py_TPFLAGS_HEAPTYPE = 1 << 9
+Py_TPFLAGS_HAVE_GC = 1 << 14
+Py_TPFLAGS_INT_SUBCLASS = 1 << 23
+Py_TPFLAGS_LONG_SUBCLASS = 1 << 24
+Py_TPFLAGS_LIST_SUBCLASS = 1 << 25
+Py_TPFLAGS_TUPLE_SUBCLASS = 1 << 26
+Py_TPFLAGS_STRING_SUBCLASS = 1 << 27
+Py_TPFLAGS_UNICODE_SUBCLASS = 1 << 28
+Py_TPFLAGS_DICT_SUBCLASS = 1 << 29
+Py_TPFLAGS_BASE_EXC_SUBCLASS = 1 << 30
+Py_TPFLAGS_TYPE_SUBCLASS = 1 << 31
+
+PyLong_SHIFT = 30
+PyDict_MINSIZE = 8
+PySet_MINSIZE = 8
+
+NUM_GENERATIONS = 3
+GC_HEAD_SIZE = 32
+GC_GENERATION_SIZE = 48
+_PyGC_REFS_UNTRACKED = -2
+_PyGC_REFS_REACHABLE = -3
+
+_OBJECT_HEAD = [('ob_refcnt', 'Py_ssize_t', 0),
+                ('ob_type', 'PyTypeObject *', 8)]
+_VAR_HEAD = _OBJECT_HEAD + [('ob_size', 'Py_ssize_t', 16)]
+
+_TYPE_FIELDS = [
+    'tp_name', 'tp_basicsize', 'tp_itemsize', 'tp_dealloc', 'tp_print',
+    'tp_getattr', 'tp_setattr', 'tp_compare', 'tp_repr', 'tp_as_number',
+    'tp_as_sequence', 'tp_as_mapping', 'tp_hash', 'tp_call', 'tp_str',
+    'tp_getattro', 'tp_setattro', 'tp_as_buffer', 'tp_flags', 'tp_doc',
+    'tp_traverse', 'tp_clear', 'tp_richcompare', 'tp_weaklistoffset',
+    'tp_iter', 'tp_iternext', 'tp_methods', 'tp_members', 'tp_getset',
+    'tp_base', 'tp_dict', 'tp_descr_get', 'tp_descr_set', 'tp_dictoffset',
+    'tp_init', 'tp_alloc', 'tp_new', 'tp_free', 'tp_is_gc', 'tp_bases',
+    'tp_mro', 'tp_cache', 'tp_subclasses', 'tp_weaklist', 'tp_del']
+_TYPE_FIELD_TYPES = {
+    'tp_name': 'char *', 'tp_basicsize': 'Py_ssize_t',
+    'tp_itemsize': 'Py_ssize_t', 'tp_flags': 'long',
+    'tp_weaklistoffset': 'Py_ssize_t', 'tp_dictoffset': 'Py_ssize_t',
+    'tp_base': 'PyTypeObject *', 'tp_dict': 'PyObject *',
+    'tp_bases': 'PyObject *', 'tp_mro': 'PyObject *',
+    'tp_cache': 'PyObject *', 'tp_subclasses': 'PyObject *',
+    'tp_weaklist': 'PyObject *'}
+
+
+def DefineTypes():
+  """Registers the CPython structs with the fake gdb."""
+  gdb.DefineType('digit', gdb.TYPE_CODE_INT, 4, signed=False)
+  gdb.DefineType('Py_UNICODE', gdb.TYPE_CODE_INT, 4, signed=False)
+  gdb.Struct('PyObject', 16, _OBJECT_HEAD)
+  gdb.Struct('PyVarObject', 24, _VAR_HEAD)
+  type_fields = [(name, _TYPE_FIELD_TYPES.get(name, 'void *'), 24 + 8 * i)
+                 for i, name in enumerate(_TYPE_FIELDS)]
+  type_fields.append(('tp_version_tag', 'unsigned int', 384))
+  gdb.Struct('PyTypeObject', 392, _VAR_HEAD + type_fields)
+  gdb.Struct('PyIntObject', 24, _OBJECT_HEAD + [('ob_ival', 'long', 16)])
+  gdb.Struct('PyBoolObject', 24, _OBJECT_HEAD + [('ob_ival', 'long', 16)])
+  gdb.Struct('PyLongObject', 32, _VAR_HEAD + [('ob_digit', 'digit [1]', 24)])
+  gdb.Struct('PyStringObject', 40, _VAR_HEAD + [
+      ('ob_shash', 'long', 24), ('ob_sstate', 'int', 32),
+      ('ob_sval', 'char [1]', 36)])
+  gdb.Struct('PyUnicodeObject', 48, _OBJECT_HEAD + [
+      ('length', 'Py_ssize_t', 16), ('str', 'Py_UNICODE *', 24),
+      ('hash', 'long', 32), ('defenc', 'PyObject *', 40)])
+  gdb.Struct('PyListObject', 40, _VAR_HEAD + [
+      ('ob_item', 'PyObject * *', 24), ('allocated', 'Py_ssize_t', 32)])
+  gdb.Struct('PyTupleObject', 32, _VAR_HEAD + [
+      ('ob_item', 'PyObject * [1]', 24)])
+  gdb.Struct('PyDictEntry', 24, [
+      ('me_hash', 'Py_ssize_t', 0), ('me_key', 'PyObject *', 8),
+      ('me_value', 'PyObject *', 16)])
+  gdb.Struct('PyDictObject', 248, _OBJECT_HEAD + [
+      ('ma_fill', 'Py_ssize_t', 16), ('ma_used', 'Py_ssize_t', 24),
+      ('ma_mask', 'Py_ssize_t', 32), ('ma_table', 'PyDictEntry *', 40),
+      ('ma_lookup', 'void *', 48),
+      ('ma_smalltable', 'PyDictEntry [%d]' % PyDict_MINSIZE, 56)])
+  gdb.Struct('setentry', 16, [('hash', 'long', 0), ('key', 'PyObject *', 8)])
+  gdb.Struct('PySetObject', 200, _OBJECT_HEAD + [
+      ('fill', 'Py_ssize_t', 16), ('used', 'Py_ssize_t', 24),
+      ('mask', 'Py_ssize_t', 32), ('table', 'setentry *', 40),
+      ('lookup', 'void *', 48),
+      ('smalltable', 'setentry [%d]' % PySet_MINSIZE, 56),
+      ('hash', 'long', 184), ('weakreflist', 'PyObject *', 192)])
+  gdb.Struct('PyCodeObject', 128, _OBJECT_HEAD + [
+      ('co_argcount', 'int', 16), ('co_nlocals', 'int', 20),
+      ('co_stacksize', 'int', 24), ('co_flags', 'int', 28),
+      ('co_code', 'PyObject *', 32), ('co_consts', 'PyObject *', 40),
+      ('co_names', 'PyObject *', 48), ('co_varnames', 'PyObject *', 56),
+      ('co_freevars', 'PyObject *', 64), ('co_cellvars', 'PyObject *', 72),
+      ('co_filename', 'PyObject *', 80), ('co_name', 'PyObject *', 88),
+      ('co_firstlineno', 'int', 96), ('co_lnotab', 'PyObject *', 104),
+      ('co_zombieframe', 'void *', 112),
+      ('co_weakreflist', 'PyObject *', 120)])
+  gdb.Struct('PyFrameObject', 384, _VAR_HEAD + [
+      ('f_back', 'PyFrameObject *', 24), ('f_code', 'PyCodeObject *', 32),
+      ('f_builtins', 'PyObject *', 40), ('f_globals', 'PyObject *', 48),
+      ('f_locals', 'PyObject *', 56), ('f_valuestack', 'PyObject * *', 64),
+      ('f_stacktop', 'PyObject * *', 72), ('f_trace', 'PyObject *', 80),
+      ('f_exc_type', 'PyObject *', 88), ('f_exc_value', 'PyObject *', 96),
+      ('f_exc_traceback', 'PyObject *', 104),
+      ('f_tstate', 'PyThreadState *', 112), ('f_lasti', 'int', 120),
+      ('f_lineno', 'int', 124), ('f_iblock', 'int', 128),
+      ('f_localsplus', 'PyObject * [1]', 376)])
+  gdb.Struct('PyClassObject', 64, _OBJECT_HEAD + [
+      ('cl_bases', 'PyObject *', 16), ('cl_dict', 'PyObject *', 24),
+      ('cl_name', 'PyObject *', 32), ('cl_getattr', 'PyObject *', 40),
+      ('cl_setattr', 'PyObject *', 48), ('cl_delattr', 'PyObject *', 56)])
+  gdb.Struct('PyInstanceObject', 40, _OBJECT_HEAD + [
+      ('in_class', 'PyClassObject *', 16), ('in_dict', 'PyObject *', 24),
+      ('in_weakreflist', 'PyObject *', 32)])
+  gdb.Struct('PyMethodDef', 32, [
+      ('ml_name', 'char *', 0), ('ml_meth', 'void *', 8),
+      ('ml_flags', 'int', 16), ('ml_doc', 'char *', 24)])
+  gdb.Struct('PyCFunctionObject', 40, _OBJECT_HEAD + [
+      ('m_ml', 'PyMethodDef *', 16), ('m_self', 'PyObject *', 24),
+      ('m_module', 'PyObject *', 32)])
+  gdb.Struct('PyBaseExceptionObject', 40, _OBJECT_HEAD + [
+      ('dict', 'PyObject *', 16), ('args', 'PyObject *', 24),
+      ('message', 'PyObject *', 32)])
+  gdb.Struct('PyThreadState', 168, [
+      ('next', 'PyThreadState *', 0), ('interp', 'PyInterpreterState *', 8),
+      ('frame', 'PyFrameObject *', 16), ('recursion_depth', 'int', 24),
+      ('dict', 'PyObject *', 120), ('thread_id', 'long', 144)])
+  gdb.Struct('PyInterpreterState', 80, [
+      ('next', 'PyInterpreterState *', 0),
+      ('tstate_head', 'PyThreadState *', 8), ('modules', 'PyObject *', 16),
+      ('sysdict', 'PyObject *', 24), ('builtins', 'PyObject *', 32)])
+  # Really a union padded to the alignment of a long double.
+  gdb.Struct('PyGC_Head', GC_HEAD_SIZE, [
+      ('gc_next', 'PyGC_Head *', 0), ('gc_prev', 'PyGC_Head *', 8),
+      ('gc_refs', 'Py_ssize_t', 16)])
+  gdb.Struct('struct gc_generation', GC_GENERATION_SIZE, [
+      ('head', 'PyGC_Head', 0), ('threshold', 'int', 32),
+      ('count', 'int', 36)])
+
+
+DefineTypes()
+
+
+def _Hash(value):
+  """The hash CPython 2.7 would store for `value`, as a signed long."""
+  return hash(value)
+
+
+class Image(object):
+  """Builds CPython objects in gdb.MEMORY.
+
+  Every method creating an object returns a gdb.Value of type PyObject*.
+  Objects of types supporting gc are preceded by a PyGC_Head and tracked in
+  the youngest generation, which _PyGC_generation0 points to.
+
+  Attributes:
+    types: Maps type names to their PyTypeObject* values.
+    none: The PyObject* of None.
+    generations: The address of the gc generations.
+  """
+
+  def __init__(self):
+    self.memory = gdb.MEMORY
+    self._pointer = gdb.lookup_type('PyObject').pointer()
+    self._strings = {}
+    self._gc_types = set()
+    self.generations = self.memory.Alloc(GC_GENERATION_SIZE * NUM_GENERATIONS)
+    for generation in range(NUM_GENERATIONS):
+      head = self.generations + GC_GENERATION_SIZE * generation
+      self._Set(head, 'PyGC_Head', 'gc_next', head)
+      self._Set(head, 'PyGC_Head', 'gc_prev', head)
+    gdb.DefineSymbol('_PyGC_generation0', gdb.Value(
+        self.generations, gdb.lookup_type('PyGC_Head').pointer()))
+    self.types = {}
+    type_type = self._NewType('type', 392, 40, Py_TPFLAGS_TYPE_SUBCLASS)
+    # type's type is type.
+    self._Set(type_type, 'PyObject', 'ob_type', type_type)
+    self.types['type'] = type_type
+    for name, basicsize, itemsize, flags in [
+        ('object', 16, 0, 0),
+        ('int', 24, 0, Py_TPFLAGS_INT_SUBCLASS),
+        ('bool', 24, 0, Py_TPFLAGS_INT_SUBCLASS),
+        ('long', 24, 4, Py_TPFLAGS_LONG_SUBCLASS),
+        ('str', 37, 1, Py_TPFLAGS_STRING_SUBCLASS),
+        ('unicode', 48, 0, Py_TPFLAGS_UNICODE_SUBCLASS),
+        ('list', 40, 0, Py_TPFLAGS_LIST_SUBCLASS | Py_TPFLAGS_HAVE_GC),
+        ('tuple', 24, 8, Py_TPFLAGS_TUPLE_SUBCLASS | Py_TPFLAGS_HAVE_GC),
+        ('dict', 248, 0, Py_TPFLAGS_DICT_SUBCLASS | Py_TPFLAGS_HAVE_GC),
+        ('set', 200, 0, Py_TPFLAGS_HAVE_GC),
+        ('frozenset', 200, 0, Py_TPFLAGS_HAVE_GC),
+        ('NoneType', 16, 0, 0),
+        ('code', 128, 0, 0),
+        ('frame', 376, 8, Py_TPFLAGS_HAVE_GC),
+        ('classobj', 64, 0, Py_TPFLAGS_HAVE_GC),
+        ('instance', 40, 0, Py_TPFLAGS_HAVE_GC),
+        ('builtin_function_or_method', 40, 0, Py_TPFLAGS_HAVE_GC),
+        ('exceptions.Exception', 40, 0,
+         Py_TPFLAGS_BASE_EXC_SUBCLASS | Py_TPFLAGS_HAVE_GC),
+    ]:
+      self.types[name] = self._NewType(name, basicsize, itemsize, flags)
+    self.none = self._Alloc('NoneType', 16)
+    self.true = self._Alloc('bool', 24)
+    self._Set(self.true, 'PyIntObject', 'ob_ival', 1)
+    self.false = self._Alloc('bool', 24)
+
+  # ----- raw memory -----
+
+  def _Struct(self, address, struct_name):
+    return gdb.Value.At(long(address), gdb.lookup_type(struct_name))
+
+  def _Set(self, address, struct_name, field, value):
+    """Stores `value` in a field of the struct at `address`."""
+    field_info = gdb.lookup_type(struct_name).Field(field)
+    self.memory.Pack(field_info.type.format, long(address) + field_info.offset,
+                     long(value))
+
+  def _CString(self, string):
+    if string not in self._strings:
+      address = self.memory.Alloc(len(string) + 1, align=1)
+      self.memory.Write(address, string)
+      self._strings[string] = address
+    return self._strings[string]
+
+  def _PointerArray(self, pointers):
+    address = self.memory.Alloc(8 * max(len(pointers), 1))
+    for i, pointer in enumerate(pointers):
+      self.memory.Pack('<Q', address + 8 * i, long(pointer))
+    return address
+
+  def _Alloc(self, type_name, size):
+    return self._AllocOf(self.types[type_name], size)
+
+  def _AllocOf(self, type_pointer, size):
+    if long(type_pointer) in self._gc_types:
+      address = self.memory.Alloc(GC_HEAD_SIZE + size) + GC_HEAD_SIZE
+    else:
+      address = self.memory.Alloc(size)
+    self._Set(address, 'PyObject', 'ob_refcnt', 1)
+    self._Set(address, 'PyObject', 'ob_type', type_pointer)
+    pointer = gdb.Value(address, self._pointer)
+    if long(type_pointer) in self._gc_types:
+      self.Track(pointer)
+    return pointer
+
+  def Track(self, pointer, generation=0):
+    """Adds an object of a gc type to the end of a generation's list."""
+    gc_head = long(pointer) - GC_HEAD_SIZE
+    head = self.generations + GC_GENERATION_SIZE * generation
+    tail = self.memory.Unpack('<Q', head + 8, 8)
+    self._Set(gc_head, 'PyGC_Head', 'gc_next', head)
+    self._Set(gc_head, 'PyGC_Head', 'gc_prev', tail)
+    self._Set(gc_head, 'PyGC_Head', 'gc_refs', _PyGC_REFS_REACHABLE)
+    self._Set(tail, 'PyGC_Head', 'gc_next', gc_head)
+    self._Set(head, 'PyGC_Head', 'gc_prev', gc_head)
+
+  def Untrack(self, pointer):
+    """Removes an object from its generation, like PyObject_GC_UnTrack."""
+    gc_head = long(pointer) - GC_HEAD_SIZE
+    next_head = self.memory.Unpack('<Q', gc_head, 8)
+    prev_head = self.memory.Unpack('<Q', gc_head + 8, 8)
+    self._Set(prev_head, 'PyGC_Head', 'gc_next', next_head)
+    self._Set(next_head, 'PyGC_Head', 'gc_prev', prev_head)
+    self._Set(gc_head, 'PyGC_Head', 'gc_refs', _PyGC_REFS_UNTRACKED)
+
+  def _NewType(self, name, basicsize, itemsize, flags, base=None,
+               dictoffset=0, tp_dict=None):
+    address = self.memory.Alloc(392)
+    self._Set(address, 'PyObject', 'ob_refcnt', 1)
+    if 'type' in self.types:
+      self._Set(address, 'PyObject', 'ob_type', self.types['type'])
+    self._Set(address, 'PyTypeObject', 'tp_name', self._CString(name))
+    self._Set(address, 'PyTypeObject', 'tp_basicsize', basicsize)
+    self._Set(address, 'PyTypeObject', 'tp_itemsize', itemsize)
+    self._Set(address, 'PyTypeObject', 'tp_flags', flags)
+    self._Set(address, 'PyTypeObject', 'tp_dictoffset', dictoffset)
+    if base is not None:
+      self._Set(address, 'PyTypeObject', 'tp_base', base)
+    if tp_dict is not None:
+      self._Set(address, 'PyTypeObject', 'tp_dict', tp_dict)
+    if flags & Py_TPFLAGS_HAVE_GC:
+      self._gc_types.add(address)
+    return gdb.Value(address, self._pointer)
+
+  # ----- objects -----
+
+  def Int(self, value):
+    pointer = self._Alloc('int', 24)
+    self._Set(pointer, 'PyIntObject', 'ob_ival', value)
+    return pointer
+
+  def Bool(self, value):
+    return self.true if value else self.false
+
+  def Long(self, value):
+    digits = []
+    magnitude = abs(value)
+    while magnitude:
+      digits.append(magnitude & ((1 << PyLong_SHIFT) - 1))
+      magnitude >>= PyLong_SHIFT
+    pointer = self._Alloc('long', 24 + 4 * max(len(digits), 1))
+    size = len(digits) if value >= 0 else -len(digits)
+    self._Set(pointer, 'PyVarObject', 'ob_size', size)
+    for i, digit in enumerate(digits):
+      self.memory.Pack('<I', long(pointer) + 24 + 4 * i, digit)
+    return pointer
+
+  def Str(self, value, interned=False):
+    pointer = self._Alloc('str', 37 + len(value))
+    self._Set(pointer, 'PyVarObject', 'ob_size', len(value))
+    self._Set(pointer, 'PyStringObject', 'ob_shash', _Hash(value))
+    self._Set(pointer, 'PyStringObject', 'ob_sstate', 1 if interned else 0)
+    self.memory.Write(long(pointer) + 36, value + '\0')
+    return pointer
+
+  def Unicode(self, value):
+    pointer = self._Alloc('unicode', 48)
+    buf = self.memory.Alloc(4 * (len(value) + 1))
+    self.memory.Write(buf, struct.pack('<%dI' % len(value),
+                                       *[ord(char) for char in value]))
+    self._Set(pointer, 'PyUnicodeObject', 'length', len(value))
+    self._Set(pointer, 'PyUnicodeObject', 'str', buf)
+    self._Set(pointer, 'PyUnicodeObject', 'hash', -1)
+    return pointer
+
+  def List(self, items):
+    pointer = self._Alloc('list', 40)
+    self._Set(pointer, 'PyVarObject', 'ob_size', len(items))
+    self._Set(pointer, 'PyListObject', 'ob_item', self._PointerArray(items))
+    self._Set(pointer, 'PyListObject', 'allocated', len(items))
+    return pointer
+
+  def Tuple(self, items):
+    pointer = self._Alloc('tuple', 24 + 8 * max(len(items), 1))
+    self._Set(pointer, 'PyVarObject', 'ob_size', len(items))
+    for i, item in enumerate(items):
+      self.memory.Pack('<Q', long(pointer) + 24 + 8 * i, long(item))
+    return pointer
+
+  def _HashTable(self, entries, minsize, fill_ratio):
+    """Lays out (hash, key, value) entries like CPython's open addressing.
+
+    Returns:
+      (mask, slots), slots being a list of (hash, key, value) or None.
+    """
+    size = minsize
+    while len(entries) * fill_ratio[1] >= size * fill_ratio[0]:
+      size <<= 1
+    mask = size - 1
+    slots = [None] * size
+    for entry in entries:
+      entry_hash = entry[0]
+      perturb = entry_hash & 0xffffffffffffffff
+      i = perturb & mask
+      while slots[i & mask] is not None:
+        i = (i << 2) + i + perturb + 1
+        perturb >>= 5
+      slots[i & mask] = entry
+    return mask, slots
+
+  def Dict(self, items):
+    """Builds a dict from (key pointer, key hash, value pointer) triples."""
+    pointer = self._Alloc('dict', 248)
+    mask, slots = self._HashTable(items, PyDict_MINSIZE, (2, 3))
+    if mask + 1 == PyDict_MINSIZE:
+      table = long(pointer) + 56
+    else:
+      table = self.memory.Alloc(24 * (mask + 1))
+    for i, slot in enumerate(slots):
+      if slot:
+        entry_hash, key, value = slot
+        entry = table + 24 * i
+        self._Set(entry, 'PyDictEntry', 'me_hash', entry_hash)
+        self._Set(entry, 'PyDictEntry', 'me_key', key)
+        self._Set(entry, 'PyDictEntry', 'me_value', value)
+    self._Set(pointer, 'PyDictObject', 'ma_fill', len(items))
+    self._Set(pointer, 'PyDictObject', 'ma_used', len(items))
+    self._Set(pointer, 'PyDictObject', 'ma_mask', mask)
+    self._Set(pointer, 'PyDictObject', 'ma_table', table)
+    return pointer
+
+  def Set(self, items, frozen=False):
+    """Builds a set from (key pointer, key hash) pairs."""
+    pointer = self._Alloc('frozenset' if frozen else 'set', 200)
+    entries = [(entry_hash, key, None) for key, entry_hash in items]
+    mask, slots = self._HashTable(entries, PySet_MINSIZE, (3, 5))
+    if mask + 1 == PySet_MINSIZE:
+      table = long(pointer) + 56
+    else:
+      table = self.memory.Alloc(16 * (mask + 1))
+    for i, slot in enumerate(slots):
+      if slot:
+        self._Set(table + 16 * i, 'setentry', 'hash', slot[0])
+        self._Set(table + 16 * i, 'setentry', 'key', slot[1])
+    self._Set(pointer, 'PySetObject', 'fill', len(items))
+    self._Set(pointer, 'PySetObject', 'used', len(items))
+    self._Set(pointer, 'PySetObject', 'mask', mask)
+    self._Set(pointer, 'PySetObject', 'table', table)
+    self._Set(pointer, 'PySetObject', 'hash', -1)
+    return pointer
+
+  def Object(self, value):
+    """Recursively builds the CPython equivalent of a python value."""
+    if value is None:
+      return self.none
+    if isinstance(value, bool):
+      return self.Bool(value)
+    if isinstance(value, int):
+      return self.Int(value)
+    if isinstance(value, long):
+      return self.Long(value)
+    if isinstance(value, str):
+      return self.Str(value)
+    if isinstance(value, unicode):
+      return self.Unicode(value)
+    if isinstance(value, list):
+      return self.List([self.Object(item) for item in value])
+    if isinstance(value, tuple):
+      return self.Tuple([self.Object(item) for item in value])
+    if isinstance(value, dict):
+      return self.Dict([(_Hash(key), self.Object(key), self.Object(item))
+                        for key, item in value.iteritems()])
+    if isinstance(value, (set, frozenset)):
+      return self.Set([(self.Object(item), _Hash(item)) for item in value],
+                      frozen=isinstance(value, frozenset))
+    raise TypeError('Cannot build %r in the image.' % (value,))
+
+  def Class(self, name, class_dict):
+    """Builds a new-style class whose instances have a __dict__."""
+    return self._NewType(name, 32, 0, Py_TPFLAGS_HEAPTYPE | Py_TPFLAGS_HAVE_GC,
+                         base=self.types['object'], dictoffset=16,
+                         tp_dict=self.Object(class_dict))
+
+  def Instance(self, cls, attributes):
+    """Builds an instance of a class made by Class."""
+    attr_dict = self.Object(attributes)
+    pointer = self._AllocOf(cls, 32)
+    self.memory.Pack('<Q', long(pointer) + 16, long(attr_dict))
+    return pointer
+
+  def OldClass(self, name, class_dict):
+    pointer = self._Alloc('classobj', 64)
+    self._Set(pointer, 'PyClassObject', 'cl_bases', self.Tuple([]))
+    self._Set(pointer, 'PyClassObject', 'cl_dict', self.Object(class_dict))
+    self._Set(pointer, 'PyClassObject', 'cl_name', self.Str(name))
+    return pointer
+
+  def OldInstance(self, cls, attributes):
+    pointer = self._Alloc('instance', 40)
+    self._Set(pointer, 'PyInstanceObject', 'in_class', cls)
+    self._Set(pointer, 'PyInstanceObject', 'in_dict', self.Object(attributes))
+    return pointer
+
+  def Builtin(self, name, self_object=None):
+    method_def = self.memory.Alloc(32)
+    self._Set(method_def, 'PyMethodDef', 'ml_name', self._CString(name))
+    pointer = self._Alloc('builtin_function_or_method', 40)
+    self._Set(pointer, 'PyCFunctionObject', 'm_ml', method_def)
+    self._Set(pointer, 'PyCFunctionObject', 'm_self', self_object or 0)
+    return pointer
+
+  def Exception(self, args):
+    pointer = self._Alloc('exceptions.Exception', 40)
+    self._Set(pointer, 'PyBaseExceptionObject', 'args', self.Object(args))
+    return pointer
+
+  def Code(self, name, filename, firstlineno, varnames, lnotab=''):
+    """Builds a code object. lnotab is a string as in Objects/lnotab_notes."""
+    pointer = self._Alloc('code', 128)
+    self._Set(pointer, 'PyCodeObject', 'co_nlocals', len(varnames))
+    self._Set(pointer, 'PyCodeObject', 'co_varnames',
+              self.Object(tuple(varnames)))
+    self._Set(pointer, 'PyCodeObject', 'co_filename', self.Str(filename))
+    self._Set(pointer, 'PyCodeObject', 'co_name', self.Str(name))
+    self._Set(pointer, 'PyCodeObject', 'co_firstlineno', firstlineno)
+    self._Set(pointer, 'PyCodeObject', 'co_lnotab', self.Str(lnotab))
+    return pointer
+
+  def Frame(self, code, local_values, global_dict, builtin_dict, back=None,
+            lasti=0, lineno=1):
+    """Builds a frame object.
+
+    Args:
+      code: The frame's code object.
+      local_values: PyObject* values for the code's varnames, 0 for unbound.
+      global_dict: The PyObject* of the globals dict.
+      builtin_dict: The PyObject* of the builtins dict.
+      back: The calling frame, if any.
+      lasti: The index of the last bytecode instruction executed.
+      lineno: The line number used when tracing.
+    Returns:
+      The PyObject* of the frame.
+    """
+    pointer = self._Alloc('frame', 376 + 8 * max(len(local_values), 1))
+    self._Set(pointer, 'PyVarObject', 'ob_size', len(local_values))
+    self._Set(pointer, 'PyFrameObject', 'f_back', back or 0)
+    self._Set(pointer, 'PyFrameObject', 'f_code', code)
+    self._Set(pointer, 'PyFrameObject', 'f_builtins', builtin_dict)
+    self._Set(pointer, 'PyFrameObject', 'f_globals', global_dict)
+    self._Set(pointer, 'PyFrameObject', 'f_lasti', lasti)
+    self._Set(pointer, 'PyFrameObject', 'f_lineno', lineno)
+    for i, value in enumerate(local_values):
+      self.memory.Pack('<Q', long(pointer) + 376 + 8 * i, long(value))
+    return pointer
+
+  def ThreadState(self, frame, thread_id, interp=0, next_tstate=0):
+    address = self.memory.Alloc(168)
+    self._Set(address, 'PyThreadState', 'frame', frame)
+    self._Set(address, 'PyThreadState', 'thread_id', thread_id)
+    self._Set(address, 'PyThreadState', 'interp', interp)
+    self._Set(address, 'PyThreadState', 'next', next_tstate)
+    return gdb.Value(address, gdb.lookup_type('PyThreadState').pointer())
+
+  def Interpreter(self, tstate_head=0, builtin_dict=0):
+    address = self.memory.Alloc(80)
+    self._Set(address, 'PyInterpreterState', 'tstate_head', tstate_head)
+    self._Set(address, 'PyInterpreterState', 'builtins', builtin_dict)
+    return gdb.Value(address, gdb.lookup_type('PyInterpreterState').pointer())
@@ -0,0 +1,465 @@
+#! /usr/bin/env python
+#
+# Copyright 2014 Google Inc.  All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""In-process stand-in for gdb's python API.
+
+Just enough of the gdb module for libpython.py and gdb_service.py to decode
+python objects: types with fields, values that are read from a memory image
+on demand, symbols and read_memory. The memory image is filled in by
+cpython_image.py. Put this directory in front of sys.path to use it.
+"""
+
+import os
+import struct
+
+
+TYPE_CODE_PTR = 1
+TYPE_CODE_ARRAY = 2
+TYPE_CODE_STRUCT = 3
+TYPE_CODE_ENUM = 5
+TYPE_CODE_FUNC = 7
+TYPE_CODE_INT = 8
+TYPE_CODE_VOID = 9
+
+NORMAL_FRAME = 0
+INLINE_FRAME = 1
+
+COMMAND_DATA = 1
+COMMAND_STACK = 2
+COMMAND_FILES = 3
+COMPLETE_NONE = 0
+PARAM_BOOLEAN = 0
+
+pretty_printers = []
+
+
+class error(RuntimeError):  # pylint: disable=invalid-name
+  pass
+
+
+class MemoryError(error):  # pylint: disable=redefined-builtin
+  pass
+
+
+class GdbError(Exception):
+  pass
+
+
+class Memory(object):
+  """A flat, growable memory image starting at `base`."""
+
+  def __init__(self, base=0x100000):
+    self.base = base
+    self.data = bytearray()
+
+  def Alloc(self, size, align=16):
+    """Reserves `size` zeroed bytes and returns their address."""
+    padding = -(self.base + len(self.data)) % align
+    self.data.extend('\0' * (padding + size))
+    return self.base + len(self.data) - size
+
+  def Offset(self, address, length):
+    offset = address - self.base
+    if address < self.base or offset + length > len(self.data):
+      raise MemoryError('Cannot access memory at address 0x%x' % address)
+    return offset
+
+  def Read(self, address, length):
+    offset = self.Offset(address, length)
+    return str(self.data[offset:offset + length])
+
+  def Write(self, address, string):
+    offset = self.Offset(address, len(string))
+    self.data[offset:offset + len(string)] = string
+
+  def Unpack(self, fmt, address, size):
+    return struct.unpack_from(fmt, self.data, self.Offset(address, size))[0]
+
+  def Pack(self, fmt, address, value):
+    struct.pack_into(fmt, self.data, self.Offset(address, struct.calcsize(fmt)),
+                     value)
+
+
+MEMORY = Memory()
+
+
+class Field(object):
+
+  def __init__(self, name, field_type, offset):
+    self.name = name
+    self.type = field_type
+    self.offset = offset
+    self.bitpos = offset * 8
+
+
+class Type(object):
+  """A C type. Structs are laid out explicitly, see Struct."""
+
+  _FORMATS = {(1, True): '<b', (1, False): '<B', (2, True): '<h',
+              (2, False): '<H', (4, True): '<i', (4, False): '<I',
+              (8, True): '<q', (8, False): '<Q'}
+
+  def __init__(self, name, code, sizeof, target_type=None, signed=True):
+    self.name = name
+    self.code = code
+    self.sizeof = sizeof
+    self._target = target_type
+    self._fields = []
+    self._field_map = {}
+    self._pointer = None
+    self.format = None
+    if code in (TYPE_CODE_INT, TYPE_CODE_ENUM):
+      self.format = self._FORMATS[(sizeof, signed)]
+    elif code == TYPE_CODE_PTR:
+      self.format = '<Q'
+
+  def AddField(self, name, field_type, offset):
+    field = Field(name, field_type, offset)
+    self._fields.append(field)
+    self._field_map[name] = field
+
+  def Field(self, name):
+    try:
+      return self._field_map[name]
+    except KeyError:
+      raise error('There is no member named %s.' % name)
+
+  def fields(self):  # pylint: disable=invalid-name
+    return list(self._fields)
+
+  def pointer(self):  # pylint: disable=invalid-name
+    if not self._pointer:
+      self._pointer = Type(self.name + ' *', TYPE_CODE_PTR, 8, self)
+    return self._pointer
+
+  def array(self, upper_bound):  # pylint: disable=invalid-name
+    return Type('%s [%d]' % (self.name, upper_bound + 1), TYPE_CODE_ARRAY,
+                self.sizeof * (upper_bound + 1), self)
+
+  def target(self):  # pylint: disable=invalid-name
+    if self._target is None:
+      raise error('Type does not have a target.')
+    return self._target
+
+  def unqualified(self):  # pylint: disable=invalid-name
+    return self
+
+  def strip_typedefs(self):  # pylint: disable=invalid-name
+    return self
+
+  def __str__(self):
+    return self.name
+
+
+_TYPES = {}
+
+
+def DefineType(name, code, sizeof, target_type=None, signed=True):
+  _TYPES[name] = Type(name, code, sizeof, target_type, signed)
+  return _TYPES[name]
+
+
+def Struct(name, sizeof, fields):
+  """Defines a struct type.
+
+  Args:
+    name: The struct's name, e.g. 'PyObject'.
+    sizeof: Its size in bytes.
+    fields: A list of (name, type or type name, offset) tuples. Type names
+      ending in '*' are turned into pointer types.
+  Returns:
+    The new type.
+  """
+  struct_type = _TYPES.get(name) or DefineType(name, TYPE_CODE_STRUCT, sizeof)
+  struct_type.sizeof = sizeof
+  for field_name, field_type, offset in fields:
+    struct_type.AddField(field_name, ParseType(field_type), offset)
+  return struct_type
+
+
+def ParseType(type_name):
+  """Returns the Type for a C type name such as 'PyObject **' or 'char [1]'."""
+  if isinstance(type_name, Type):
+    return type_name
+  type_name = type_name.strip()
+  if type_name.endswith('*'):
+    return ParseType(type_name[:-1]).pointer()
+  if type_name.endswith(']'):
+    element, length = type_name[:-1].rsplit('[', 1)
+    return ParseType(element).array(int(length) - 1)
+  if type_name not in _TYPES:
+    # Forward declaration of a struct, filled in by Struct later.
+    DefineType(type_name, TYPE_CODE_STRUCT, 0)
+  return _TYPES[type_name]
+
+
+for _name, _size, _signed in [('char', 1, True), ('unsigned char', 1, False),
+                              ('short', 2, True), ('int', 4, True),
+                              ('unsigned int', 4, False), ('long', 8, True),
+                              ('unsigned long', 8, False),
+                              ('size_t', 8, False), ('Py_ssize_t', 8, True)]:
+  DefineType(_name, TYPE_CODE_INT, _size, signed=_signed)
+DefineType('void', TYPE_CODE_VOID, 1)
+_LONG = _TYPES['long']
+
+
+def lookup_type(name):  # pylint: disable=invalid-name
+  if name not in _TYPES or not _TYPES[name].sizeof:
+    raise error('No type named %s.' % name)
+  return _TYPES[name]
+
+
+class Value(object):
+  """A typed value, either computed or located in MEMORY.
+
+  Located values (those with an address) are only read when their contents
+  are needed, like gdb's lazy values.
+  """
+
+  __slots__ = ('type', '_address', '_scalar')
+
+  def __init__(self, val, value_type=None):
+    if isinstance(val, Value):
+      val = val.Scalar()
+    self.type = value_type or _LONG
+    self._address = None
+    self._scalar = long(val)
+
+  @classmethod
+  def At(cls, address, value_type):
+    value = cls.__new__(cls)
+    value.type = value_type
+    value._address = address  # pylint: disable=protected-access
+    value._scalar = None  # pylint: disable=protected-access
+    return value
+
+  def Scalar(self):
+    if self._scalar is None:
+      if not self.type.format:
+        raise error('Value of type %s is not a scalar.' % self.type)
+      self._scalar = MEMORY.Unpack(self.type.format, self._address,
+                                   self.type.sizeof)
+    return self._scalar
+
+  @property
+  def address(self):
+    if self._address is None:
+      return None
+    return Value(self._address, self.type.pointer())
+
+  @property
+  def is_optimized_out(self):
+    return False
+
+  @property
+  def dynamic_type(self):
+    return self.type
+
+  def cast(self, value_type):  # pylint: disable=invalid-name
+    if value_type.code == TYPE_CODE_STRUCT and self._address is not None:
+      return Value.At(self._address, value_type)
+    return Value(self.Scalar(), value_type)
+
+  def dereference(self):  # pylint: disable=invalid-name
+    if self.type.code != TYPE_CODE_PTR:
+      raise error('Attempt to take contents of a non-pointer value.')
+    address = self.Scalar()
+    if not address:
+      raise MemoryError('Cannot access memory at address 0x0')
+    return Value.At(address, self.type.target())
+
+  def __getitem__(self, key):
+    if isinstance(key, basestring):
+      value = self
+      if value.type.code == TYPE_CODE_PTR:
+        value = value.dereference()
+      if value.type.code != TYPE_CODE_STRUCT:
+        raise error('Attempt to extract a component of a value that is not '
+                    'a structure.')
+      field = value.type.Field(key)
+      return Value.At(value._address + field.offset, field.type)  # pylint: disable=protected-access
+    key = int(key)
+    if self.type.code == TYPE_CODE_PTR:
+      base = self.Scalar()
+    elif self.type.code == TYPE_CODE_ARRAY:
+      base = self._address
+    else:
+      raise error('Cannot subscript requested type.')
+    target_type = self.type.target()
+    return Value.At(base + key * target_type.sizeof, target_type)
+
+  def string(self, encoding=None, errors=None, length=-1):  # pylint: disable=invalid-name,unused-argument
+    if self.type.code == TYPE_CODE_PTR:
+      address = self.Scalar()
+    else:
+      address = self._address
+    if length >= 0:
+      return MEMORY.Read(address, length)
+    offset = MEMORY.Offset(address, 1)
+    end = MEMORY.data.index('\0', offset)
+    return str(MEMORY.data[offset:end])
+
+  def _Arithmetic(self, other, operation):
+    if isinstance(other, Value):
+      other = other.Scalar()
+    if self.type.code == TYPE_CODE_PTR:
+      return Value(operation(self.Scalar(), other * self.type.target().sizeof),
+                   self.type)
+    return Value(operation(self.Scalar(), other), self.type)
+
+  def __add__(self, other):
+    return self._Arithmetic(other, lambda a, b: a + b)
+
+  __radd__ = __add__
+
+  def __sub__(self, other):
+    return self._Arithmetic(other, lambda a, b: a - b)
+
+  def __mul__(self, other):
+    return self._Arithmetic(other, lambda a, b: a * b)
+
+  __rmul__ = __mul__
+
+  def __and__(self, other):
+    return self._Arithmetic(other, lambda a, b: a & b)
+
+  __rand__ = __and__
+
+  def __mod__(self, other):
+    return self._Arithmetic(other, lambda a, b: a % b)
+
+  def __neg__(self):
+    return Value(-self.Scalar(), self.type)
+
+  def __int__(self):
+    return int(self.Scalar())
+
+  def __long__(self):
+    return long(self.Scalar())
+
+  __index__ = __int__
+
+  def __nonzero__(self):
+    return bool(self.Scalar())
+
+  def __hash__(self):
+    return hash(self.Scalar())
+
+  def __cmp__(self, other):
+    if isinstance(other, Value):
+      other = other.Scalar()
+    return cmp(self.Scalar(), other)
+
+  def __str__(self):
+    if self.type.code == TYPE_CODE_PTR:
+      return '0x%x' % self.Scalar()
+    if self.type.code == TYPE_CODE_ARRAY:
+      return repr(self.string())
+    if self.type.code == TYPE_CODE_STRUCT:
+      return '{...}'
+    return str(self.Scalar())
+
+  def __repr__(self):
+    return '<gdb.Value %s of type %s>' % (self, self.type)
+
+
+_SYMBOLS = {}
+
+
+def DefineSymbol(name, value):
+  _SYMBOLS[name] = value
+
+
+def parse_and_eval(expression):  # pylint: disable=invalid-name
+  expression = expression.strip()
+  if expression in _SYMBOLS:
+    return _SYMBOLS[expression]
+  raise error('No symbol "%s" in current context.' % expression)
+
+
+def lookup_symbol(name, block=None, domain=None):  # pylint: disable=invalid-name,unused-argument
+  return None, False
+
+
+def lookup_global_symbol(name, domain=None):  # pylint: disable=invalid-name,unused-argument
+  return None
+
+
+def execute(command, from_tty=False, to_string=False):  # pylint: disable=invalid-name,unused-argument
+  raise error('Commands are not supported by the fake gdb: %s' % command)
+
+
+class Inferior(object):
+  """The fake process: this one, with its memory replaced by MEMORY."""
+
+  num = 1
+
+  @property
+  def pid(self):
+    return os.getpid()
+
+  def read_memory(self, address, length):  # pylint: disable=invalid-name
+    address = long(address)
+    length = long(length)
+    return buffer(MEMORY.Read(address, length))
+
+  def threads(self):  # pylint: disable=invalid-name
+    return ()
+
+  def is_valid(self):  # pylint: disable=invalid-name
+    return True
+
+
+_INFERIOR = Inferior()
+
+
+def selected_inferior():  # pylint: disable=invalid-name
+  return _INFERIOR
+
+
+def inferiors():  # pylint: disable=invalid-name
+  return (_INFERIOR,)
+
+
+def selected_frame():  # pylint: disable=invalid-name
+  raise error('No frame is currently selected.')
+
+
+def selected_thread():  # pylint: disable=invalid-name
+  return None
+
+
+def breakpoints():  # pylint: disable=invalid-name
+  return None
+
+
+def current_objfile():  # pylint: disable=invalid-name
+  return None
+
+
+class Frame(object):
+  pass
+
+
+class Command(object):
+
+  def __init__(self, name, command_class, completer_class=None, prefix=False):
+    self.name = name
+
+
+class Breakpoint(object):
+
+  def __init__(self, spec, *args, **kwargs):
+    self.location = spec
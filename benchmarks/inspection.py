@@ -0,0 +1,203 @@
+#! /usr/bin/env python
+#
+# Copyright 2014 Google Inc.  All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""End-to-end latency of inspecting the synthetic inferiors in targets.py.
+
+Usage:
+  python2.7 benchmarks/inspection.py --output=after.json --compare=before.json
+
+For every scenario a fresh target process is started and each operation is
+timed --repeat times against it. The JSON report holds the individual
+timings (in seconds) plus the RPC statistics gathered along the way, and can
+be compared against an earlier report.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+# pylint: disable=g-import-not-at-top
+from pyringe import inferior
+import targets
+
+
+TARGETS_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'targets.py')
+OPERATIONS = ('attach', 'threads', 'bt', 'all_stacks', 'inflocals',
+              'infglobals', 'p', 'inject')
+
+
+def _Time(func):
+  start = time.time()
+  func()
+  return time.time() - start
+
+
+def _AllStacks(target):
+  for tid in target.threads:
+    target.SelectThread(tid)
+    target.Backtrace()
+
+
+def _Inject(target):
+  target.gdb.InjectString(target.position, 'pass', wait_for_completion=True)
+
+
+class Benchmark(object):
+  """Times all OPERATIONS against one scenario.
+
+  Attributes:
+    scenario: The name of the scenario in targets.SCENARIOS.
+    python: The interpreter running the target.
+  """
+
+  def __init__(self, scenario, python):
+    self.scenario = scenario
+    self.python = python
+    self._process = None
+    self._main_thread = None
+
+  def _StartTarget(self):
+    self._process = subprocess.Popen(
+        [self.python, TARGETS_SCRIPT, self.scenario], stdout=subprocess.PIPE)
+    status = self._process.stdout.readline().split()
+    if not status or status[0] != 'ready':
+      raise RuntimeError('Target %s did not start.' % self.scenario)
+    self._main_thread = int(status[1])
+
+  def _StopTarget(self):
+    # Not kill(), targets may have files to clean up.
+    self._process.terminate()
+    self._process.wait()
+
+  def Run(self, repeat):
+    """Runs all operations `repeat` times.
+
+    Args:
+      repeat: The number of times every operation is timed.
+    Returns:
+      A dict with the timings of each operation and the RPC statistics.
+    """
+    timings = dict((operation, []) for operation in OPERATIONS)
+    self._StartTarget()
+    try:
+      target = None
+      for _ in range(repeat):
+        if target:
+          target.ShutDownGdb()
+        start = time.time()
+        target = inferior.Inferior(self._process.pid)
+        timings['attach'].append(time.time() - start)
+      name = targets.LOOKUP_NAMES[self.scenario]
+      operations = [
+          ('threads', lambda: target.threads),
+          ('bt', target.Backtrace),
+          ('all_stacks', lambda: _AllStacks(target)),
+          ('inflocals', target.InferiorLocals),
+          ('infglobals', target.InferiorGlobals),
+          ('p', lambda: target.Lookup(name)),
+          ('inject', lambda: _Inject(target)),
+      ]
+      for operation, func in operations:
+        for _ in range(repeat):
+          # Every timing starts from the main thread's innermost frame.
+          target.SelectThread(self._main_thread)
+          timings[operation].append(_Time(func))
+      stats = target.rpc_stats.AsDict()
+      target.ShutDownGdb()
+    finally:
+      self._StopTarget()
+    return {'timings': timings, 'rpc_stats': stats}
+
+
+def _Median(values):
+  values = sorted(values)
+  return values[len(values) // 2] if values else None
+
+
+def Summary(report):
+  """Returns a table of median timings."""
+  lines = ['%-12s %-12s %10s' % ('scenario', 'operation', 'median')]
+  for scenario in sorted(report['scenarios']):
+    timings = report['scenarios'][scenario]['timings']
+    for operation in OPERATIONS:
+      median = _Median(timings.get(operation, []))
+      if median is not None:
+        lines.append('%-12s %-12s %8.1fms' % (scenario, operation,
+                                              1000 * median))
+  return '\n'.join(lines)
+
+
+def Compare(report, baseline):
+  """Returns a table of median timings, relative to `baseline`."""
+  lines = ['%-12s %-12s %10s %10s %8s' % ('scenario', 'operation', 'before',
+                                          'after', 'ratio')]
+  for scenario in sorted(report['scenarios']):
+    if scenario not in baseline['scenarios']:
+      continue
+    after = report['scenarios'][scenario]['timings']
+    before = baseline['scenarios'][scenario]['timings']
+    for operation in OPERATIONS:
+      new = _Median(after.get(operation, []))
+      old = _Median(before.get(operation, []))
+      if new is None or old is None:
+        continue
+      lines.append('%-12s %-12s %8.1fms %8.1fms %7.2fx' % (
+          scenario, operation, 1000 * old, 1000 * new, new / old if old else 0))
+  return '\n'.join(lines)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--python', default=sys.executable,
+                      help='Interpreter to run the targets with.')
+  parser.add_argument('--scenarios',
+                      default=','.join(sorted(targets.SCENARIOS)),
+                      help='Comma-separated list of scenarios to run.')
+  parser.add_argument('--repeat', type=int, default=5,
+                      help='How often to time each operation.')
+  parser.add_argument('--output', help='Where to write the JSON report.')
+  parser.add_argument('--compare', help='A previous report to compare with.')
+  args = parser.parse_args()
+
+  report = {'host': platform.node(),
+            'platform': platform.platform(),
+            'python': args.python,
+            'gdb_version': inferior.GdbProxy.Version(),
+            'time': time.time(),
+            'repeat': args.repeat,
+            'scenarios': {}}
+  for scenario in args.scenarios.split(','):
+    print 'Running %s...' % scenario
+    report['scenarios'][scenario] = Benchmark(scenario, args.python).Run(
+        args.repeat)
+
+  if args.output:
+    with open(args.output, 'w') as report_file:
+      json.dump(report, report_file, indent=1, sort_keys=True)
+  if args.compare:
+    with open(args.compare) as baseline_file:
+      print Compare(report, json.load(baseline_file))
+  else:
+    print Summary(report)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,147 @@
+#! /usr/bin/env python
+#
+# Copyright 2014 Google Inc.  All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Synthetic inferiors for benchmarking pyringe.
+
+Run as `python2.7 targets.py <scenario>`. Every scenario builds the same state
+on every run, prints 'ready <main thread ident>' on a line of its own and then
+idles in a frame whose locals are worth looking at, until terminated.
+
+Scenarios:
+  threads:     THREAD_COUNT threads, each a few frames deep.
+  recursion:   A RECURSION_DEPTH frames deep call stack.
+  globals:     GLOBAL_COUNT module globals.
+  containers:  A large list, dict and unicode string in the idling frame.
+  zipimport:   Idling in a function of a module imported from a zip file.
+"""
+
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+
+THREAD_COUNT = 100
+RECURSION_DEPTH = 1000
+GLOBAL_COUNT = 100000
+CONTAINER_SIZE = 100000
+UNICODE_LENGTH = 1 << 20
+
+IDLE_SECONDS = 0.05
+
+# A name visible from the idling frame each scenario wants looked up.
+LOOKUP_NAMES = {
+    'threads': 'THREAD_COUNT',
+    'recursion': 'RECURSION_DEPTH',
+    'globals': 'global_050000',
+    'containers': 'big_dict',
+    'zipimport': 'payload',
+}
+
+_ZIPPED_MODULE = '''
+import time
+
+def Idle(ready, seconds):
+  payload = dict((str(i), [i] * 3) for i in range(1000))
+  ready()
+  while True:
+    time.sleep(seconds)
+'''
+
+
+def Ready():
+  sys.stdout.write('ready %d\n' % threading.current_thread().ident)
+  sys.stdout.flush()
+
+
+def Idle(ready=Ready):
+  ready()
+  while True:
+    # Short sleeps, so injected code gets to run soon.
+    time.sleep(IDLE_SECONDS)
+
+
+def Nest(depth, func):
+  if depth <= 1:
+    return func()
+  return Nest(depth - 1, func)
+
+
+def Threads():
+  started = threading.Semaphore(0)
+  for _ in range(THREAD_COUNT):
+    thread = threading.Thread(target=Nest,
+                              args=(5, lambda: Idle(started.release)))
+    thread.daemon = True
+    thread.start()
+  for _ in range(THREAD_COUNT):
+    started.acquire()
+  Nest(5, Idle)
+
+
+def Recursion():
+  # Leave some headroom for the frames of Idle and the injected code.
+  sys.setrecursionlimit(RECURSION_DEPTH + 100)
+  Nest(RECURSION_DEPTH, Idle)
+
+
+def Globals():
+  module_globals = globals()
+  for i in range(GLOBAL_COUNT):
+    module_globals['global_%06d' % i] = i
+  Idle()
+
+
+def Containers():
+  big_list = range(CONTAINER_SIZE)
+  big_dict = dict(('key_%d' % i, i) for i in range(CONTAINER_SIZE))
+  big_unicode = u'\u00e4' * UNICODE_LENGTH
+  Ready()
+  while True:
+    time.sleep(IDLE_SECONDS)
+
+
+def ZipImport():
+  zip_dir = tempfile.mkdtemp(prefix='pyringe-bench')
+  # Unwind on SIGTERM, so the zip file gets removed again.
+  signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+  try:
+    zip_path = os.path.join(zip_dir, 'zipped.zip')
+    with zipfile.ZipFile(zip_path, 'w') as archive:
+      archive.writestr('zipped_module.py', _ZIPPED_MODULE)
+    sys.path.insert(0, zip_path)
+    import zipped_module  # pylint: disable=g-import-not-at-top
+    zipped_module.Idle(Ready, IDLE_SECONDS)
+  finally:
+    shutil.rmtree(zip_dir)
+
+
+SCENARIOS = {
+    'threads': Threads,
+    'recursion': Recursion,
+    'globals': Globals,
+    'containers': Containers,
+    'zipimport': ZipImport,
+}
+
+
+if __name__ == '__main__':
+  if len(sys.argv) != 2 or sys.argv[1] not in SCENARIOS:
+    sys.exit('usage: %s {%s}' % (sys.argv[0], ','.join(sorted(SCENARIOS))))
+  SCENARIOS[sys.argv[1]]()
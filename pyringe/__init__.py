@@ -14,9 +14,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import graph
+import handles
+import heap
 import inferior
 import plugins
+import replay
 import repl
+import rpcstats
+import scheduler
 from repl import DebuggingConsole
 
 
@@ -32,6 +38,12 @@ __all__ = ['DebuggingConsole',
            'repl',
            '__version__',
            'interact',
+           'graph',
+           'handles',
+           'heap',
            'inferior',
            'plugins',
+           'replay',
+           'rpcstats',
+           'scheduler',
           ]
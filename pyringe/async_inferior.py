@@ -0,0 +1,672 @@
+#! /usr/bin/env python
+#
+# Copyright 2014 Google Inc.  All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""asyncio front end for the gdb service.
+
+AsyncInferior offers the same commands as inferior.Inferior, but instead of
+blocking until gdb answers, every command immediately returns an asyncio
+future. Replies are read from non-blocking pipes by the event loop, so a single
+loop can drive any number of debugging sessions at once:
+
+  inferiors = [async_inferior.AsyncInferior(pid) for pid in pids]
+  loop.run_until_complete(asyncio.gather(*[inf.Attach() for inf in inferiors]))
+  traces = loop.run_until_complete(
+      asyncio.gather(*[inf.Backtrace() for inf in inferiors]))
+
+Every RPC takes an optional `timeout` keyword argument. When an RPC times out
+or its future is cancelled, the gdb service is asked to stop working on it and
+its reply is thrown away; gdb itself keeps running, so the session stays
+usable.
+
+This needs asyncio, which on python 2 means its backport trollius.
+"""
+
+import collections
+import errno
+import fcntl
+import functools
+import itertools
+import json
+import logging
+import os
+import signal
+import subprocess
+import time
+
+try:
+  import asyncio  # pylint: disable=g-import-not-at-top
+except ImportError:
+  import trollius as asyncio  # pylint: disable=g-import-not-at-top
+
+import inferior
+import rpcstats
+
+# Seconds to wait for the rest of a non-JSON error (usually a traceback from
+# before the service installed its exception handling), as GdbProxy._Recv does.
+TRACEBACK_WAIT = 0.5
+
+
+def _Transfer(source, destination):
+  """Copies the outcome of future `source` to future `destination`."""
+  if destination.done():
+    return
+  if source.cancelled():
+    destination.cancel()
+  elif source.exception() is not None:
+    destination.set_exception(source.exception())
+  else:
+    destination.set_result(source.result())
+
+
+def _Then(source, func, loop):
+  """Returns a future resolving to func(<result of source>).
+
+  If func returns a future itself, the returned future resolves to that
+  future's result. Cancelling the returned future cancels `source`.
+  Args:
+    source: The future to wait for.
+    func: Callable taking the result of `source`.
+    loop: The event loop to create the future in.
+  Returns:
+    A new future.
+  """
+  result = asyncio.Future(loop=loop)
+
+  def SourceDone(fut):
+    if result.done():
+      return
+    if fut.cancelled():
+      result.cancel()
+      return
+    if fut.exception() is not None:
+      result.set_exception(fut.exception())
+      return
+    try:
+      value = func(fut.result())
+    except Exception as err:  # pylint: disable=broad-except
+      result.set_exception(err)
+      return
+    if isinstance(value, asyncio.Future):
+      value.add_done_callback(lambda inner: _Transfer(inner, result))
+      result.add_done_callback(
+          lambda res: value.cancel() if res.cancelled() else None)
+    else:
+      result.set_result(value)
+
+  def ResultDone(res):
+    if res.cancelled():
+      source.cancel()
+
+  source.add_done_callback(SourceDone)
+  result.add_done_callback(ResultDone)
+  return result
+
+
+def _Failed(exc, loop):
+  result = asyncio.Future(loop=loop)
+  result.set_exception(exc)
+  return result
+
+
+def _Resolved(value, loop):
+  result = asyncio.Future(loop=loop)
+  result.set_result(value)
+  return result
+
+
+def _WithBudget(timeout, budget):
+  """Extends `timeout` by the time the service may spend on the request."""
+  if budget is None or timeout is inferior.TIMEOUT_FOREVER:
+    return timeout
+  return timeout + budget
+
+
+def _SetNonBlocking(fileobj):
+  flags = fcntl.fcntl(fileobj.fileno(), fcntl.F_GETFL)
+  fcntl.fcntl(fileobj.fileno(), fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+class AsyncGdbProxy(inferior.GdbProxy):
+  """GdbProxy variant whose RPCs return futures instead of blocking.
+
+  The gdb service is spoken to over non-blocking pipes watched by the event
+  loop. Replies are matched to requests by their id; abandoned (timed out or
+  cancelled) requests are cancelled in the service as well.
+  """
+
+  def __init__(self, args=None, arch=None, loop=None, stats=None):
+    # Not calling GdbProxy.__init__, which sets up the blocking transport.
+    # pylint: disable=super-init-not-called
+    self._lock = None
+    self.stop_epoch = 0
+    self._loop = loop or asyncio.get_event_loop()
+    self._ids = itertools.count(1)
+    # Maps request ids to (funcname, future), in the order they were sent.
+    self._outstanding = collections.OrderedDict()
+    # Progress callbacks by RPC id, for requests that asked for reports.
+    self._progress = {}
+    self.stats = stats or rpcstats.RpcStats()
+    self._InitClassTable()
+    # When each outstanding request was sent, by RPC id.
+    self._sent = {}
+    self._outbuf = b''
+    self._errbuf = b''
+    # Pending call to _OnRawStderr, if a non-JSON error is being collected.
+    self._raw_stderr = None
+    self._writebuf = b''
+
+    arglist = inferior.GdbProxy.CommandLine(args, arch)
+    logging.debug('Starting new gdb process...')
+    self._process = subprocess.Popen(
+        bufsize=0,
+        args=arglist,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        close_fds=True,
+        preexec_fn=os.setpgrp,
+        )
+    for pipe in (self._process.stdin, self._process.stdout,
+                 self._process.stderr):
+      _SetNonBlocking(pipe)
+    self._loop.add_reader(self._process.stdout.fileno(), self._OnStdout)
+    self._loop.add_reader(self._process.stderr.fileno(), self._OnStderr)
+
+  def _Execute(self, funcname, *args, **kwargs):
+    """Sends an RPC request to the gdb-internal python.
+
+    Args:
+      funcname: the name of the function to call.
+      *args: the function's arguments.
+      **kwargs: 'timeout' gives the number of seconds after which the returned
+        future fails with inferior.TimeoutError, None meaning no timeout.
+        Defaults to inferior.TIMEOUT_DEFAULT, to the budget plus that if
+        'budget' is set, or to no timeout if 'wait_for_completion' is set.
+        'budget' and 'progress' work as for GdbProxy._Execute, except that
+        progress reports don't extend the timeout.
+    Returns:
+      A future for the result of the function call.
+    """
+    if 'timeout' in kwargs:
+      timeout = kwargs['timeout']
+    else:
+      timeout = self._Timeout(kwargs)
+
+    future = asyncio.Future(loop=self._loop)
+    if not self.is_running:
+      future.set_exception(inferior.ProxyError('Gdb is not running.'))
+      return future
+    rpc_id = next(self._ids)
+    self._outstanding[rpc_id] = (funcname, future)
+    self._sent[rpc_id] = time.time()
+    future.add_done_callback(lambda fut: self._Done(rpc_id, funcname, fut))
+    if kwargs.get('progress'):
+      self._progress[rpc_id] = kwargs['progress']
+      future.add_done_callback(lambda _: self._progress.pop(rpc_id, None))
+    self._Send(json.dumps(self._RequestDict(rpc_id, funcname, args, kwargs)))
+    if timeout is not inferior.TIMEOUT_FOREVER:
+      handle = self._loop.call_later(
+          timeout, self._TimeOut, future)
+      future.add_done_callback(lambda _: handle.cancel())
+    future.add_done_callback(lambda fut: self._Abandoned(rpc_id, fut))
+    return future
+
+  def _Done(self, rpc_id, funcname, future):
+    self._sent.pop(rpc_id, None)
+    if future.cancelled() or future.exception():
+      self.stats.RecordFailure(funcname)
+
+  def _Abandoned(self, rpc_id, future):
+    """Tells the service to stop working on requests nobody waits for."""
+    if rpc_id not in self._outstanding or not self.is_running:
+      return
+    if (future.cancelled()
+        or isinstance(future.exception(), inferior.TimeoutError)):
+      self._Send(json.dumps({'func': '__cancel__', 'args': [rpc_id, False]}))
+
+  @staticmethod
+  def _TimeOut(future):
+    if not future.done():
+      future.set_exception(inferior.TimeoutError())
+
+  def _Send(self, string):
+    self._writebuf += (string + '\n').encode('utf-8')
+    self._Flush()
+
+  def _Flush(self):
+    try:
+      written = os.write(self._process.stdin.fileno(), self._writebuf)
+    except OSError as err:
+      if err.errno != errno.EAGAIN:
+        raise
+      written = 0
+    self._writebuf = self._writebuf[written:]
+    if self._writebuf:
+      self._loop.add_writer(self._process.stdin.fileno(), self._Flush)
+    else:
+      self._loop.remove_writer(self._process.stdin.fileno())
+
+  def _ReadPipe(self, pipe):
+    try:
+      return os.read(pipe.fileno(), 65536)
+    except OSError as err:
+      if err.errno == errno.EAGAIN:
+        return None
+      raise
+
+  def _OnStdout(self):
+    data = self._ReadPipe(self._process.stdout)
+    if data is None:
+      return
+    if not data:
+      self._loop.remove_reader(self._process.stdout.fileno())
+      self._FailOutstanding(inferior.ProxyError('Gdb exited.'))
+      return
+    self._outbuf += data
+    while b'\n' in self._outbuf:
+      line, self._outbuf = self._outbuf.split(b'\n', 1)
+      self._OnReply(line.decode('utf-8'))
+
+  def _OnReply(self, line):
+    decode_start = time.time()
+    try:
+      reply = self._DecodeResult(line)
+    except ValueError as err:
+      logging.warning('Dropping undecodable reply from gdb: %s', err)
+      return
+    rpc_id = reply.get('id') if isinstance(reply, dict) else None
+    if rpc_id not in self._outstanding:
+      logging.debug('Dropping unsolicited reply from gdb: %s', line)
+      return
+    if 'progress' in reply:
+      callback = self._progress.get(rpc_id)
+      if callback:
+        callback(reply['progress'])
+      return
+    funcname, future = self._outstanding.pop(rpc_id)
+    if (funcname not in inferior.READ_ONLY_RPCS and
+        funcname not in inferior.FILE_WRITING_RPCS):
+      self.stop_epoch += 1
+    if future.done():
+      # Timed out or cancelled, nobody is interested in this anymore.
+      return
+    now = time.time()
+    if 'result' in reply:
+      self.stats.Record(funcname, now - self._sent[rpc_id], now - decode_start,
+                        reply.get('stats'))
+    try:
+      future.set_result(self._UnwrapReply(reply))
+    except inferior.CancelledError as err:
+      future.set_exception(err)
+    if self._unresolved_classes:
+      self._ResolveClasses()
+
+  def _ResolveClasses(self):
+    """Retrieves the class dicts that got lost along with earlier replies.
+
+    Unlike GdbProxy, this doesn't wait for them; the proxy objects of the
+    affected classes only get their class attributes once they arrive.
+    """
+    addresses = sorted(self._unresolved_classes)
+    self._unresolved_classes.clear()
+    self._Execute('ClassDicts', addresses).add_done_callback(
+        self._ClassDictsArrived)
+
+  def _ClassDictsArrived(self, future):
+    if not future.cancelled() and not future.exception():
+      self._FillClassDicts(future.result())
+
+  def _OnStderr(self):
+    data = self._ReadPipe(self._process.stderr)
+    if data is None:
+      return
+    if not data:
+      self._loop.remove_reader(self._process.stderr.fileno())
+      if self._raw_stderr:
+        self._raw_stderr.cancel()
+        self._raw_stderr = None
+      if self._errbuf:
+        # Whatever is left wasn't valid JSON, most likely a traceback from
+        # before the service installed its exception handling.
+        self._FailOutstanding(
+            self._ProxyErrorFromStderr(self._errbuf.decode('utf-8')))
+        self._errbuf = b''
+      return
+    self._errbuf += data
+    self._DrainStderr()
+
+  def _DrainStderr(self):
+    """Fails the oldest outstanding request for each JSON error on stderr."""
+    while b'\n' in self._errbuf:
+      line, rest = self._errbuf.split(b'\n', 1)
+      try:
+        json.loads(line.decode('utf-8'))
+      except ValueError:
+        # Give the rest of it a moment to arrive, see _OnRawStderr.
+        if not self._raw_stderr:
+          self._raw_stderr = self._loop.call_later(TRACEBACK_WAIT,
+                                                   self._OnRawStderr)
+        return
+      self._errbuf = rest
+      self._FailOldest(self._ProxyErrorFromStderr(line.decode('utf-8')))
+
+  def _OnRawStderr(self):
+    """Reports the non-JSON lines at the head of the stderr buffer.
+
+    They go to the oldest outstanding request as a single error, so that they
+    don't keep later errors from being handed out.
+    """
+    self._raw_stderr = None
+    lines = self._errbuf.split(b'\n')
+    raw = []
+    # The last element is an incomplete line, if anything.
+    while len(lines) > 1:
+      try:
+        json.loads(lines[0].decode('utf-8'))
+        break
+      except ValueError:
+        raw.append(lines.pop(0))
+    self._errbuf = b'\n'.join(lines)
+    if raw:
+      self._FailOldest(
+          self._ProxyErrorFromStderr(b'\n'.join(raw).decode('utf-8')))
+    self._DrainStderr()
+
+  def _FailOldest(self, error):
+    if self._outstanding:
+      _, (_, future) = self._outstanding.popitem(last=False)
+      if not future.done():
+        future.set_exception(error)
+    else:
+      logging.debug('Dropping unsolicited error from gdb: %s', error)
+
+  def _FailOutstanding(self, error):
+    while self._outstanding:
+      _, (_, future) = self._outstanding.popitem(last=False)
+      if not future.done():
+        future.set_exception(error)
+
+  def Cancel(self):
+    """Cancels all outstanding RPCs, leaving gdb running."""
+    for _, future in list(self._outstanding.values()):
+      future.cancel()
+
+  def Kill(self):
+    """Asks gdb to quit, killing it if it doesn't comply.
+
+    Returns:
+      A future that is resolved once gdb is gone.
+    """
+    done = asyncio.Future(loop=self._loop)
+
+    def Terminate(_=None):
+      if self.is_running:
+        logging.debug('Termination request not acknowledged, killing gdb.')
+        os.kill(self._process.pid, signal.SIGINT)
+        self._process.terminate()
+        self._process.wait()
+      for pipe in (self._process.stdout, self._process.stderr):
+        self._loop.remove_reader(pipe.fileno())
+      self._loop.remove_writer(self._process.stdin.fileno())
+      self._FailOutstanding(inferior.ProxyError('Gdb has been shut down.'))
+      if not done.done():
+        done.set_result(None)
+
+    def AfterKill(fut):
+      if not fut.cancelled() and fut.exception() is None:
+        # acknowledged, let's give it some time to die in peace
+        self._loop.call_later(0.1, Terminate)
+      else:
+        Terminate()
+
+    if not self.is_running:
+      Terminate()
+      return done
+    detached = self._Execute('Detach')
+    killed = _Then(detached, lambda _: self._Execute('__kill__'), self._loop)
+    killed.add_done_callback(AfterKill)
+    return done
+
+
+def needsattached(func):
+  """Decorator failing the returned future when not attached."""
+
+  @functools.wraps(func)
+  def wrap(self, *args, **kwargs):
+    if not self.attached:
+      return _Failed(inferior.PositionError('Not attached to any process.'),
+                     self.loop)
+    return func(self, *args, **kwargs)
+  return wrap
+
+
+class AsyncInferior(object):
+  """asyncio counterpart of inferior.Inferior.
+
+  All commands return futures. Unlike Inferior, gdb isn't started implicitly
+  when the object is created; call (and wait for) Attach first. Should gdb die
+  later on, it is restarted transparently by the next command.
+  """
+
+  _Position = inferior.Inferior._Position  # pylint: disable=protected-access,invalid-name
+
+  def __init__(self, pid, auto_symfile_loading=True,
+               architecture='i386:x86-64', loop=None):
+    self.loop = loop or asyncio.get_event_loop()
+    self.position = self._Position(pid=pid, tid=None, frame_depth=-1)
+    self.arch = architecture
+    self.auto_symfile_loading = auto_symfile_loading
+    self._symbol_file = None
+    self._gdb = None
+    self._starting = None
+    self.rpc_stats = rpcstats.RpcStats()
+
+  @property
+  def pid(self):
+    return self.position.pid
+
+  @property
+  def is_running(self):
+    if not self.position.pid:
+      return False
+    try:
+      os.kill(self.position.pid, 0)
+      return True
+    except OSError as err:
+      return err.errno == errno.EPERM
+
+  @property
+  def attached(self):
+    return bool(self.position.pid and self.is_running)
+
+  def Attach(self):
+    """Starts gdb and attaches it to the inferior.
+
+    Returns:
+      A future resolving once gdb is ready for commands.
+    """
+    return _Then(self._EnsureGdb(), lambda _: None, self.loop)
+
+  def _EnsureGdb(self):
+    """Returns a future resolving to a running, attached AsyncGdbProxy."""
+    if not self._gdb or not self._gdb.is_running:
+      if not self.attached:
+        return _Failed(inferior.PositionError('Not attached to any process.'),
+                       self.loop)
+      self._StartGdb()
+    # Hand out a separate future, so a caller cancelling theirs doesn't cancel
+    # the startup everybody else is waiting for.
+    result = asyncio.Future(loop=self.loop)
+    self._starting.add_done_callback(lambda fut: _Transfer(fut, result))
+    return result
+
+  def _StartGdb(self):
+    gdb = AsyncGdbProxy(arch=self.arch, loop=self.loop, stats=self.rpc_stats)
+    self._gdb = gdb
+    ready = _Then(gdb.Attach(self.position, timeout=None),
+                  lambda _: self._LoadSymbols(gdb), self.loop)
+    self._starting = _Then(ready, lambda _: gdb, self.loop)
+
+    def Started(fut):
+      if fut.cancelled() or fut.exception() is not None:
+        # Start from scratch the next time around.
+        if self._gdb is gdb:
+          self.ShutDownGdb()
+    self._starting.add_done_callback(Started)
+
+  def _LoadSymbols(self, gdb):
+    if not self.auto_symfile_loading:
+      return None
+    s_path = self._symbol_file or inferior._SymbolFilePath()  # pylint: disable=protected-access
+    logging.debug('Trying to load symbol file: %s', s_path)
+    loaded = gdb.LoadSymbolFile(self.position, s_path, timeout=None)
+    sane = _Then(loaded, lambda _: gdb.IsSymbolFileSane(self.position),
+                 self.loop)
+
+    def Check(is_sane):
+      if not is_sane:
+        logging.warning('Symbol file failed sanity check, '
+                        'proceed at your own risk')
+    return _Then(sane, Check, self.loop)
+
+  def _Rpc(self, funcname, *args, **kwargs):
+    return _Then(self._EnsureGdb(),
+                 lambda gdb: gdb._Execute(funcname, *args, **kwargs),  # pylint: disable=protected-access
+                 self.loop)
+
+  def ShutDownGdb(self):
+    """Shuts gdb down. Returns a future resolving once it is gone."""
+    gdb, self._gdb = self._gdb, None
+    self._starting = None
+    if gdb:
+      return gdb.Kill()
+    return _Resolved(None, self.loop)
+
+  def Cancel(self):
+    """Abandons all outstanding commands, keeping gdb alive."""
+    if self._gdb:
+      self._gdb.Cancel()
+
+  def LoadSymbolFile(self, path=None, timeout=inferior.TIMEOUT_FOREVER):
+    if path:
+      self._symbol_file = path
+    s_path = self._symbol_file or inferior._SymbolFilePath()  # pylint: disable=protected-access
+    return self._Rpc('LoadSymbolFile', self.position, s_path, timeout=timeout)
+
+  @needsattached
+  def Backtrace(self, timeout=inferior.TIMEOUT_DEFAULT):
+    return self._Rpc('BacktraceAt', self.position, timeout=timeout)
+
+  @needsattached
+  def StackDepth(self, timeout=inferior.TIMEOUT_DEFAULT):
+    return self._Rpc('StackDepth', self.position, timeout=timeout)
+
+  @needsattached
+  def Up(self, timeout=inferior.TIMEOUT_DEFAULT):
+    position = self.position
+
+    def Move(stack_depth):
+      depth = position.frame_depth
+      if depth < 0:
+        depth = stack_depth + depth
+      if not depth:
+        raise inferior.PositionError('Already at outermost stack frame')
+      self.position = self._Position(pid=position.pid, tid=position.tid,
+                                     frame_depth=depth-1)
+    return _Then(self._Rpc('StackDepth', position, timeout=timeout), Move,
+                 self.loop)
+
+  @needsattached
+  def Down(self, timeout=inferior.TIMEOUT_DEFAULT):
+    position = self.position
+
+    def Move(stack_depth):
+      if (position.frame_depth + 1 >= stack_depth
+          or position.frame_depth == -1):
+        raise inferior.PositionError('Already at innermost stack frame')
+      self.position = self._Position(pid=position.pid, tid=position.tid,
+                                     frame_depth=position.frame_depth + 1)
+    return _Then(self._Rpc('StackDepth', position, timeout=timeout), Move,
+                 self.loop)
+
+  @needsattached
+  def Lookup(self, var_name, timeout=inferior.TIMEOUT_DEFAULT, budget=None,
+             progress=None, limits=None):
+    return self._Rpc('LookupInFrame', self.position, var_name,
+                     timeout=_WithBudget(timeout, budget), budget=budget,
+                     progress=progress, limits=limits)
+
+  @needsattached
+  def InferiorLocals(self, timeout=inferior.TIMEOUT_DEFAULT, budget=None,
+                     progress=None, limits=None):
+    return self._Rpc('InferiorLocals', self.position,
+                     timeout=_WithBudget(timeout, budget), budget=budget,
+                     progress=progress, limits=limits)
+
+  @needsattached
+  def InferiorGlobals(self, timeout=inferior.TIMEOUT_DEFAULT, budget=None,
+                      progress=None, limits=None):
+    return self._Rpc('InferiorGlobals', self.position,
+                     timeout=_WithBudget(timeout, budget), budget=budget,
+                     progress=progress, limits=limits)
+
+  @needsattached
+  def InferiorBuiltins(self, timeout=inferior.TIMEOUT_DEFAULT, budget=None,
+                       progress=None, limits=None):
+    return self._Rpc('InferiorBuiltins', self.position,
+                     timeout=_WithBudget(timeout, budget), budget=budget,
+                     progress=progress, limits=limits)
+
+  @needsattached
+  def Threads(self, timeout=inferior.TIMEOUT_DEFAULT):
+    return self._Rpc('ThreadIds', self.position, timeout=timeout)
+
+  @property
+  def threads(self):
+    return self.Threads()
+
+  @property
+  def current_thread(self):
+    def Select(threads):
+      if not threads:
+        self.position = self._Position(pid=self.position.pid, tid=None,
+                                       frame_depth=-1)
+        return None
+      if not self.position.tid or self.position.tid not in threads:
+        self.position = self._Position(pid=self.position.pid, tid=threads[0],
+                                       frame_depth=-1)
+      return self.position.tid
+    return _Then(self.Threads(), Select, self.loop)
+
+  @needsattached
+  def SelectThread(self, tid, timeout=inferior.TIMEOUT_DEFAULT):
+    def Select(threads):
+      if tid not in threads:
+        raise inferior.PositionError('Thread %s does not exist' % tid)
+      self.position = self._Position(self.position.pid, tid, frame_depth=-1)
+    return _Then(self.Threads(timeout=timeout), Select, self.loop)
+
+  @needsattached
+  def Continue(self, timeout=inferior.TIMEOUT_FOREVER):
+    return self._Rpc('Continue', self.position, timeout=timeout)
+
+  @needsattached
+  def Interrupt(self, timeout=inferior.TIMEOUT_DEFAULT):
+    return self._Rpc('Interrupt', self.position, timeout=timeout)
+
+  @needsattached
+  def InjectString(self, codestring, timeout=inferior.TIMEOUT_FOREVER):
+    return self._Rpc('InjectString', self.position, codestring,
+                     timeout=timeout)
@@ -0,0 +1,122 @@
+#! /usr/bin/env python
+#
+# Copyright 2014 Google Inc.  All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Rebuilds object graphs serialized by the gdb service.
+
+The format is described along with the RPC protocol in inferior.py. Every
+remote object becomes exactly one local object, so objects shared in the
+inferior are shared in the copy as well, and cycles are rebuilt as cycles.
+"""
+
+# Node kinds whose objects can be created before their contents are known.
+_MUTABLE = ('list', 'dict', 'set', 'instance')
+
+
+class _Builder(object):
+  """Turns the nodes of one graph into python objects."""
+
+  def __init__(self, graph, make_instance, make_truncated):
+    self._roots = graph['roots']
+    self._nodes = graph['objects']
+    self._make_instance = make_instance
+    self._make_truncated = make_truncated
+    self._built = {}
+
+  def Build(self):
+    """Returns the rebuilt roots of the graph, by name."""
+    # Create all mutable objects up front, so immutable ones can be built
+    # right away, even if they are part of a cycle.
+    for object_id, node in self._nodes.iteritems():
+      if node and node[0] in _MUTABLE:
+        self._built[object_id] = self._Empty(object_id, node)
+    for object_id, node in self._nodes.iteritems():
+      if node and node[0] in _MUTABLE and node[0] != 'instance':
+        self._Fill(self._built[object_id], node)
+    # Instances copy their attribute dicts, which are complete by now.
+    for object_id, node in self._nodes.iteritems():
+      if node and node[0] == 'instance':
+        self._FillInstance(self._built[object_id], node)
+    return dict((name, self.Resolve(value))
+                for name, value in self._roots.iteritems())
+
+  def Resolve(self, value):
+    """Returns the object a value in the graph stands for."""
+    if not isinstance(value, dict):
+      return value
+    object_id = value['r']
+    if object_id in self._built:
+      return self._built[object_id]
+    node = self._nodes.get(object_id)
+    if not node:
+      # The service ran out of time before getting to it.
+      return '<0x%x (not retrieved)>' % long(object_id)
+    kind, contents = node[:2]
+    if kind == 'str':
+      result = str(contents) if isinstance(contents, basestring) else contents
+    elif kind == 'unicode':
+      result = unicode(contents)
+    elif kind == 'tuple':
+      result = tuple(self.Resolve(item) for item in contents)
+    elif kind == 'frozenset':
+      result = frozenset(self.Resolve(item) for item in contents)
+    else:
+      raise ValueError('Unknown node kind %r' % kind)
+    self._built[object_id] = result
+    return result
+
+  def _Empty(self, object_id, node):
+    if node[0] in ('list', 'dict') and len(node) > 2 and self._make_truncated:
+      return self._make_truncated(node[0], node[2])
+    if node[0] == 'list':
+      return []
+    if node[0] == 'dict':
+      return {}
+    if node[0] == 'set':
+      return set()
+    _, type_name, class_address, _ = node
+    return self._make_instance(type_name, long(object_id), class_address)
+
+  def _Fill(self, obj, node):
+    kind, contents = node[:2]
+    if kind == 'list':
+      obj.extend(self.Resolve(item) for item in contents)
+    elif kind == 'dict':
+      for key, value in contents:
+        obj[self.Resolve(key)] = self.Resolve(value)
+    else:
+      obj.update(self.Resolve(item) for item in contents)
+
+  def _FillInstance(self, obj, node):
+    attrs = self.Resolve(node[3]) if node[3] else {}
+    if isinstance(attrs, dict):
+      for name, value in attrs.iteritems():
+        obj.__dict__.setdefault(name, value)
+
+
+def Rebuild(graph, make_instance, make_truncated=None):
+  """Rebuilds the roots of a serialized object graph.
+
+  Args:
+    graph: The graph, as returned by the service.
+    make_instance: Called as make_instance(type_name, address, class_address)
+      to create the (empty) local counterpart of a class instance, whose
+      __dict__ then gets filled with the instance's attributes.
+    make_truncated: Optionally called as make_truncated(kind, omitted) to
+      create the (empty) local counterpart of a 'list' or 'dict' node the
+      service stopped reading early, omitted items short.
+  Returns:
+    A dict of the names of the graph's roots to the rebuilt objects.
+  """
+  return _Builder(graph, make_instance, make_truncated).Build()
@@ -0,0 +1,163 @@
+#! /usr/bin/env python
+#
+# Copyright 2014 Google Inc.  All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Lazily retrieved objects of the inferior."""
+
+# How many items iterating over a handle retrieves per RPC.
+ITER_CHUNK = 100
+
+_ERRORS = {
+    'AttributeError': AttributeError,
+    'IndexError': IndexError,
+    'KeyError': KeyError,
+    'NameError': NameError,
+    'TypeError': TypeError,
+}
+
+
+class HandleCache(object):
+  """Caches the results of handle RPCs while the inferior stays stopped.
+
+  The cache is emptied whenever gdb gets restarted, or an RPC that may have
+  changed the inferior's state is made (see GdbProxy.stop_epoch).
+  """
+
+  def __init__(self):
+    self._gdb = None
+    self._epoch = None
+    self._results = {}
+
+  def Call(self, gdb, funcname, *args):
+    """Makes an RPC, unless its result is cached.
+
+    Args:
+      gdb: The GdbProxy to make the RPC with.
+      funcname: The name of the RPC.
+      *args: Its (hashable) arguments.
+    Returns:
+      The result of the RPC.
+    """
+    if gdb is not self._gdb or gdb.stop_epoch != self._epoch:
+      self._gdb = gdb
+      self._epoch = gdb.stop_epoch
+      self._results = {}
+    key = (funcname,) + args
+    if key not in self._results:
+      self._results[key] = getattr(gdb, funcname)(*args)
+    return self._results[key]
+
+
+def RaiseError(result):
+  """Raises the error a gdb service RPC reported instead of a result, if any."""
+  if 'error' in result:
+    raise _ERRORS.get(result['error'], LookupError)(result['message'])
+
+
+def Wrap(inferior, description):
+  """Turns what the gdb service returns for a handle RPC into a python object.
+
+  Args:
+    inferior: The Inferior the object is in.
+    description: The result of the RPC.
+  Returns:
+    A RemoteHandle for containers and instances, the object itself for simple
+    values like numbers and strings.
+  Raises:
+    AttributeError, IndexError, KeyError, NameError, TypeError: as raised by
+      the equivalent operation on the remote object.
+  """
+  RaiseError(description)
+  if 'address' in description:
+    return RemoteHandle(inferior, description)
+  return description['value']
+
+
+class RemoteHandle(object):
+  """An object of the inferior, retrieved piece by piece on demand.
+
+  Attribute access, indexing, len() and iteration each retrieve only what they
+  need, returning further handles for everything that isn't a simple value.
+  Results are cached until the inferior's state changes. A handle refers to its
+  object by address, so it is only meaningful while the object is alive.
+
+  Remote attributes whose names clash with the ones below can be looked up
+  using the Attr method.
+
+  Attributes:
+    address: The address of the object in the inferior.
+    type_name: The name of the object's type.
+  """
+
+  def __init__(self, inferior, description):
+    self._inferior = inferior
+    self.address = description['address']
+    self.type_name = description['type']
+    self._len = description.get('len')
+
+  def _Call(self, funcname, *args):
+    return self._inferior.handle_cache.Call(self._inferior.gdb, funcname,
+                                            self.address, *args)
+
+  def Attr(self, name):
+    """Looks up an attribute of the remote object."""
+    return Wrap(self._inferior, self._Call('HandleAttr', name))
+
+  def Fetch(self):
+    """Retrieves the whole object, like p() without lazy does."""
+    return self._Call('HandleValue')['value']
+
+  def __getattr__(self, name):
+    if name.startswith('__'):
+      raise AttributeError(name)
+    return self.Attr(name)
+
+  def __getitem__(self, key):
+    if isinstance(key, slice):
+      return [self[i] for i in xrange(*key.indices(len(self)))]
+    return Wrap(self._inferior, self._Call('HandleItem', key))
+
+  def __len__(self):
+    if self._len is None:
+      raise TypeError('object of type %r has no len()' % self.type_name)
+    return self._len
+
+  def __nonzero__(self):
+    return self._len is None or self._len > 0
+
+  def _IterEntries(self):
+    cursor = 0
+    while cursor is not None:
+      chunk = self._Call('HandleItems', cursor, ITER_CHUNK)
+      RaiseError(chunk)
+      for item in chunk['items']:
+        if isinstance(item, list):
+          yield tuple(Wrap(self._inferior, part) for part in item)
+        else:
+          yield Wrap(self._inferior, item)
+      cursor = chunk['next']
+
+  def __iter__(self):
+    """Iterates over the members of sequences and sets, or a dict's keys."""
+    for entry in self._IterEntries():
+      yield entry[0] if isinstance(entry, tuple) else entry
+
+  def iteritems(self):
+    """Iterates over the (key, value) pairs of a dict."""
+    for key, value in self._IterEntries():
+      yield key, value
+
+  def __repr__(self):
+    return '<handle of %s object at remote 0x%x>' % (self.type_name,
+                                                      self.address)
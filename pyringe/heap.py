@@ -0,0 +1,137 @@
+#! /usr/bin/env python
+#
+# Copyright 2014 Google Inc.  All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compact snapshots of the inferior's heap census, and heap dumps."""
+
+import array
+import collections
+import time
+
+from payload import heapgraph
+
+# How the number of objects and bytes of one type changed between snapshots.
+TypeDelta = collections.namedtuple(
+    'TypeDelta', 'name type_address count size count_delta size_delta')
+
+
+class Snapshot(object):
+  """A per-type census of the heap at one point in time.
+
+  The census is kept as parallel arrays sorted by type address rather than as
+  python objects, so even snapshots of heaps with many thousands of types stay
+  small.
+
+  Attributes:
+    time: When the snapshot was taken.
+    reason: Why the census is incomplete, or None.
+    objects: The total number of objects counted.
+    bytes: The total number of bytes counted.
+    type_addresses: array of the addresses of the types, sorted.
+    names: The names of the types, in the same order.
+    counts: array of the number of objects of each type.
+    sizes: array of the number of bytes taken up by each type.
+  """
+
+  def __init__(self, census, taken=None):
+    """Builds the snapshot.
+
+    Args:
+      census: The result of Inferior.HeapCensus for all types.
+      taken: When the census was taken, defaults to now.
+    """
+    self.time = time.time() if taken is None else taken
+    self.reason = getattr(census, 'reason', None)
+    self.objects = census['objects']
+    self.bytes = census['bytes']
+    types = sorted(census['types'])
+    self.type_addresses = array.array('L', (entry[0] for entry in types))
+    self.names = [entry[1] for entry in types]
+    self.counts = array.array('l', (entry[2] for entry in types))
+    self.sizes = array.array('l', (entry[3] for entry in types))
+
+  def __len__(self):
+    return len(self.type_addresses)
+
+  def __repr__(self):
+    return '<heap snapshot of %d types, %d objects, %d bytes%s at %s>' % (
+        len(self), self.objects, self.bytes,
+        ' (partial)' if self.reason else '',
+        time.strftime('%H:%M:%S', time.localtime(self.time)))
+
+
+def Diff(before, after):
+  """Compares two snapshots type by type.
+
+  A type address both snapshots have, but with different names, was reused for
+  a new type after the old one was freed. The two are compared as unrelated
+  types.
+  Args:
+    before: The earlier Snapshot.
+    after: The later Snapshot.
+  Returns:
+    A list of TypeDelta, one for every type with objects in either snapshot,
+    with the counts and sizes of the later one. Sorted by growth in bytes.
+  """
+  deltas = []
+  i = j = 0
+  while i < len(before) or j < len(after):
+    if j == len(after) or (i < len(before) and
+                           before.type_addresses[i] < after.type_addresses[j]):
+      before_index, after_index = i, None
+    elif i == len(before) or after.type_addresses[j] < (
+        before.type_addresses[i]):
+      before_index, after_index = None, j
+    elif before.names[i] != after.names[j]:
+      deltas.append(_Delta(before, i, None, None))
+      before_index, after_index = None, j
+      i += 1
+    else:
+      before_index, after_index = i, j
+    deltas.append(_Delta(before, before_index, after, after_index))
+    i += before_index is not None
+    j += after_index is not None
+  deltas.sort(key=lambda delta: (-delta.size_delta, -delta.count_delta))
+  return deltas
+
+
+def _Delta(before, before_index, after, after_index):
+  """Returns the TypeDelta of one type of two snapshots.
+
+  Either index may be None for a type that is missing from that snapshot.
+  """
+  count = size = old_count = old_size = 0
+  if after_index is not None:
+    name = after.names[after_index]
+    type_address = after.type_addresses[after_index]
+    count = after.counts[after_index]
+    size = after.sizes[after_index]
+  if before_index is not None:
+    name = before.names[before_index]
+    type_address = before.type_addresses[before_index]
+    old_count = before.counts[before_index]
+    old_size = before.sizes[before_index]
+  return TypeDelta(name, type_address, count, size, count - old_count,
+                   size - old_size)
+
+
+def LoadDump(path):
+  """Opens a heap dump written by Inferior.DumpHeap, for offline analysis.
+
+  Returns:
+    A heapgraph.Dump. Its HeapCensus, FindReferrers, PathToRoot and
+    RetainedSizes methods work like Inferior's, minus labels and previews,
+    which need the inferior's memory.
+  """
+  return heapgraph.Dump(path)
@@ -24,6 +24,8 @@ performing common tasks (e.g. listing threads, moving around the stack, etc.)
 import collections
 import errno
 import functools
+import gzip
+import itertools
 import json
 import logging
 import os
@@ -32,14 +34,34 @@ import select
 import signal
 import subprocess
 import tempfile
+import threading
 import time
 
+import graph
+import handles
+import heap
+import rpcstats
+
+try:
+  import numpy  # pylint: disable=g-import-not-at-top
+except ImportError:
+  numpy = None
+
 
 # Setting these overrides the defaults. See _SymbolFilePath.
 SYMBOL_FILE = None  # default: <PAYLOAD_DIR>/python2.7.debug
 PAYLOAD_DIR = os.path.join(os.path.dirname(__file__), 'payload')
 TIMEOUT_DEFAULT = 3
 TIMEOUT_FOREVER = None
+# Seconds between progress reports for RPCs that asked for them.
+PROGRESS_INTERVAL = 0.5
+# If set, the traffic of every gdb session is appended to this file, see
+# TrafficRecorder. Names ending in '.gz' are compressed.
+RECORD_PATH = None
+# Arrays NdArray transfers are memory-mapped from this many bytes on.
+NDARRAY_MMAP_SIZE = 1 << 28
+# How many bytes of an array SummarizeArray looks at at once.
+NDARRAY_SUMMARY_CHUNK = 1 << 24
 
 _GDB_STARTUP_FILES = [
     'importsetup.py',
@@ -47,6 +69,58 @@ _GDB_STARTUP_FILES = [
 ]
 _GDB_ARGS = ['gdb', '--nw', '--quiet', '--batch-silent']
 
+# GdbService functions that only inspect the stopped inferior. As long as none
+# of the other functions are called in between, calling one of these twice with
+# the same arguments yields the same result.
+READ_ONLY_RPCS = frozenset([
+    'BacktraceAt',
+    'ClassDicts',
+    'DictHealth',
+    'DuplicateStrings',
+    'GilState',
+    'HandleAttr',
+    'HandleDictHealth',
+    'HandleItem',
+    'HandleItems',
+    'HandleLookup',
+    'HandlePathToRoot',
+    'HandleReferrers',
+    'HandleSummary',
+    'HandleValue',
+    'HeapCensus',
+    'InferiorBuiltins',
+    'InferiorGlobals',
+    'InferiorLocals',
+    'InferiorLocalsGraph',
+    'IsAttached',
+    'IsSymbolFileSane',
+    'LookupGraph',
+    'LookupInFrame',
+    'PathToRoot',
+    'Referrers',
+    'RetainedSizes',
+    'StackDepth',
+    'Summary',
+    'ThreadIds',
+    'ThreadLwps',
+])
+
+# GdbService functions that only inspect the stopped inferior too, but write
+# what they find to a file on the gdb host. They leave the stop epoch alone,
+# but aren't coalesced or cached like READ_ONLY_RPCS.
+FILE_WRITING_RPCS = frozenset([
+    'DumpBuffer',
+    'DumpHeap',
+    'HandleDumpBuffer',
+    'HandleNdArray',
+    'NdArray',
+])
+
+
+# GdbService forwards requests for functions with this prefix to its admin
+# namespace (see the protocol description below).
+ADMIN_PREFIX = 'admin.'
+
 
 def _SymbolFilePath():
   return SYMBOL_FILE or os.path.join(PAYLOAD_DIR, 'python2.7.debug')
@@ -72,13 +146,18 @@ class GdbProcessError(Error):
   """Thrown when attempting to start gdb when it's already running."""
 
 
+class CancelledError(Error):
+  """Raised for RPCs that were cancelled before producing a result."""
+
+
 ### RPC protocol for gdb service ###
 #
 # In order to ensure compatibility with all versions of python JSON was
 # chosen as the main data format for the communication protocol between
 # the gdb-internal python process and the process using this module.
-# RPC requests to GdbService ('the service') are JSON objects containing exactly
-# two keys:
+# RPC requests to GdbService ('the service') are JSON objects containing the
+# following keys:
+# * 'id'   : A number identifying the request, unique within one session.
 # * 'func' : the name of the function to be called in the service. RPCs for
 #            function names starting with _ will be rejected by the service.
 # * 'args' : An array containing all the parameters for the function. Due to
@@ -87,36 +166,249 @@ class GdbProcessError(Error):
 #            3-element array specifying the selected pid, python thread id and
 #            depth of the selected frame in the stack (where 0 is the outermost
 #            frame).
+# * 'opts' : (optional) An object with options for processing the request:
+#            'budget'   : Seconds after which the service stops gathering data
+#                         and answers with what it has got so far.
+#            'progress' : Seconds between progress reports.
+#            'limits'   : An object limiting how much of the values returned by
+#                         the function to retrieve: 'depth' (of nesting below
+#                         the returned values), 'items' (per container),
+#                         'string' (characters per string) and 'bytes' (in
+#                         total). Containers and strings cut short are sent as
+#                         {'__pyringe_truncated__': <limit>, 'omitted': <number
+#                         of items or characters>, 'value': <partial value>}
+#                         objects, instances with the key
+#                         '__pyringe_incomplete__' set. Values beyond the depth
+#                         or byte limits are replaced by placeholder strings.
+# Function names starting with 'admin.' address the service's admin namespace,
+# which offers functions for debugging the service itself (e.g. profiling it).
 # The session is terminated upon sending an RPC request for the function
 # '__kill__' (upon which args are ignored).
+# Sending a request for '__cancel__' with args [<id>, <partial>] while request
+# <id> is being processed asks the service to stop working on it. The service
+# checks for this regularly while iterating over the inferior's data. If
+# <partial> is true, the request is answered with whatever has been gathered
+# until then, otherwise it is answered as cancelled. Cancellation requests
+# arriving after the request has been answered are ignored.
 #
-# RPC return values are not wrapped in JSON objects, but are bare JSON
-# representations of return values.
+# Replies are JSON objects with the key 'id' identifying the request they
+# answer, and either
+# * 'result'    : The return value of the function, and optionally
+#   'truncated' : A string explaining why the result is incomplete, and
+#   'stats'     : An object with the seconds spent running the function
+#                 ('compute'), reading inferior data while encoding the result
+#                 ('read') and otherwise encoding it ('encode'), plus the size
+#                 of the encoded result ('bytes'), or
+# * 'cancelled' : true, if the request was cancelled, or
+# * 'progress'  : An object with the keys 'items' (the number of items of
+#                 inferior data visited), 'bytes' (the size of the encoded
+#                 result so far) and 'elapsed' (seconds). Progress reports
+#                 precede the actual reply.
+# Replies to requests the client has given up on (e.g. due to a timeout) are
+# recognized by their id and dropped.
 # Python class instances (old and new-style) will also be serialized to JSON
-# objects with keys '__pyringe_type_name__' and '__pyringe_address__', which
-# carry the expected meaning. The remaining keys in these objects are simple
-# JSON representations of the attributes visible in the instance (this means the
-# object includes class-level attributes, but these are overshadowed by any
-# instance attributes. (There is currently no recursion in this representation,
-# only one level of object references is serialized in this way.)
+# objects with keys '__pyringe_type_name__', '__pyringe_address__' and
+# '__pyringe_type__' (the address of the instance's class), which carry the
+# expected meaning. The remaining keys in these objects are simple JSON
+# representations of the instance's own attributes. The class-level attributes
+# are sent once per class and session, as a JSON object under the key
+# '__pyringe_class_dict__' of the first instance of the class the service
+# sends. The client keeps them in a table of ProxyClass objects, which can be
+# refilled using the 'ClassDicts' function should a reply carrying them get
+# lost. (There is currently no recursion in this representation, only one level
+# of object references is serialized in this way.)
+# The functions LookupGraph and InferiorLocalsGraph preserve the identity of
+# shared objects and cycles instead, by returning an object graph:
+# * 'roots'   : An object mapping names (e.g. of locals) to values.
+# * 'objects' : An object mapping object ids to nodes, each an array
+#               [<kind>, ...]. Containers are ['list'|'tuple'|'set'|'frozenset',
+#               <values>] or ['dict', <[key, value] pairs>], long strings are
+#               ['str'|'unicode', <string>], and instances are ['instance',
+#               <type name>, <class address>, <value of the instance dict>].
+#               Nodes the service didn't get to (see 'budget') are null, and
+#               containers it stopped reading early have the number of items
+#               left out as a third element.
+# * 'classes' : The class dicts not sent earlier, by class address.
+# Values are either simple JSON values, or {'r': <id>} references to nodes.
 # Should an exception be raised to the top level within the service, it will
 # write a JSON-representation of the traceback string to stderr
 
-# TODO: add message-id to the protocol to make sure that canceled operations
-# that never had their output read don't end up supplying output for the wrong
-# command
+
+class TruncatedDict(dict):
+  """A dict the gdb service could only partially retrieve.
+
+  Attributes:
+    reason: Why the dict is incomplete, e.g. 'cancelled'.
+  """
+
+  def __init__(self, items, reason):
+    super(TruncatedDict, self).__init__(items)
+    self.reason = reason
+
+  def __repr__(self):
+    return '%s...(truncated: %s)' % (dict.__repr__(self), self.reason)
+
+
+class TruncatedList(list):
+  """A list the gdb service could only partially retrieve.
+
+  Attributes:
+    reason: Why the list is incomplete, e.g. 'cancelled'.
+  """
+
+  def __init__(self, items, reason):
+    super(TruncatedList, self).__init__(items)
+    self.reason = reason
+
+  def __repr__(self):
+    return '%s...(truncated: %s)' % (list.__repr__(self), self.reason)
+
+
+def Limits(depth=None, items=None, string=None, total=None):
+  """Assembles the 'limits' option of value retrieving RPCs.
+
+  Args:
+    depth: How deeply nested containers and instances to retrieve.
+    items: How many items of each container to retrieve.
+    string: How many characters of each string to retrieve.
+    total: Roughly how many bytes to retrieve in total.
+  Returns:
+    The limits as expected by GdbProxy, or None if there are none.
+  """
+  limits = dict((name, value) for name, value in (
+      ('depth', depth), ('items', items), ('string', string), ('bytes', total))
+                if value is not None)
+  return limits or None
+
+
+def _MarkTruncated(result, reason):
+  """Wraps a partial RPC result so it's recognizable as such."""
+  if isinstance(result, dict):
+    return TruncatedDict(result, reason)
+  if isinstance(result, list):
+    return TruncatedList(result, reason)
+  if isinstance(result, basestring):
+    return result + '...(truncated)'
+  logging.warning('Result is incomplete (%s).', reason)
+  return result
+
+
+def SummarizeArray(array):
+  """Computes statistics of a numpy array, like numpy.nanmin() and friends.
+
+  The array is looked at a chunk at a time, so huge memory-mapped arrays never
+  need to fit in memory.
+  Returns:
+    A dict of the array's 'shape' and 'dtype', and of the 'min', 'max' and
+    'mean' of its elements that aren't NaN, and the number of 'nans'. The
+    statistics are None for arrays of strs, unicodes or void, and for arrays
+    with nothing but NaNs.
+  """
+  summary = {'shape': array.shape, 'dtype': array.dtype.str,
+             'min': None, 'max': None, 'mean': None, 'nans': 0}
+  if array.dtype.kind not in 'biufc' or not array.size:
+    return summary
+  # Chunks are slices along the first axis, so they're views rather than
+  # copies whatever the strides.
+  array = numpy.atleast_1d(numpy.asarray(array))
+  rows = max(1, NDARRAY_SUMMARY_CHUNK // (array[0].nbytes or 1))
+  low = high = None
+  total = 0
+  counted = 0
+  for start in xrange(0, len(array), rows):
+    chunk = array[start:start + rows]
+    if array.dtype.kind in 'fc':
+      nans = int(numpy.isnan(chunk).sum())
+      summary['nans'] += nans
+      if nans == chunk.size:
+        continue
+    else:
+      nans = 0
+    # fmin and fmax ignore NaNs.
+    chunk_low = numpy.fmin.reduce(chunk, axis=None)
+    chunk_high = numpy.fmax.reduce(chunk, axis=None)
+    low = chunk_low if low is None else numpy.fmin(low, chunk_low)
+    high = chunk_high if high is None else numpy.fmax(high, chunk_high)
+    total += numpy.nansum(chunk, dtype=numpy.result_type(chunk, numpy.float64))
+    counted += chunk.size - nans
+  if counted:
+    summary.update(min=low.item(), max=high.item(),
+                   mean=(total / counted).item())
+  return summary
+
+
+class ProxyClass(object):
+  """The class-level attributes of a class in the inferior.
+
+  Attributes:
+    address: The address of the class in the inferior.
+    attrdict: The class dict, or None while it hasn't been retrieved.
+  """
+
+  def __init__(self, address):
+    self.address = address
+    self.attrdict = None
 
 
 class ProxyObject(object):
+  """An instance in the inferior, with its attributes copied over.
+
+  Class-level attributes are looked up in the instance's ProxyClass, which is
+  shared among all instances of the class.
+  """
 
   def __init__(self, attrdict):
     self.__dict__ = attrdict
 
+  def __getattr__(self, name):
+    proxy_class = self.__dict__.get('__pyringe_class__')
+    if proxy_class and proxy_class.attrdict and name in proxy_class.attrdict:
+      return proxy_class.attrdict[name]
+    raise AttributeError(name)
+
+  def __dir__(self):
+    names = set(self.__dict__)
+    proxy_class = self.__dict__.get('__pyringe_class__')
+    if proxy_class and proxy_class.attrdict:
+      names.update(proxy_class.attrdict)
+    return sorted(names)
+
   def __repr__(self):
     return ('<proxy of %s object at remote 0x%x>'
             % (self.__pyringe_type_name__, self.__pyringe_address__))
 
 
+class TrafficRecorder(object):
+  """Appends everything exchanged with one gdb session to a log file.
+
+  The log consists of one JSON array per line, [time, kind, data], with time
+  being the number of seconds since the session started and kind one of
+  * 'session': A new session starts, data is gdb's command line.
+  * 's': data is a request line sent to gdb.
+  * 'o': data is a line gdb wrote to stdout, i.e. a reply or progress report.
+  * 'e': data is an exception gdb wrote to stderr.
+  Lines are stored verbatim, see replay.py for playing them back.
+  """
+
+  def __init__(self, path, arglist):
+    opener = gzip.open if path.endswith('.gz') else open
+    self._file = opener(path, 'ab')
+    self._lock = threading.Lock()
+    self._start = time.time()
+    self.Record('session', arglist)
+
+  def Record(self, kind, data):
+    with self._lock:
+      if self._file.closed:
+        return
+      elapsed = round(time.time() - self._start, 6)
+      self._file.write(json.dumps([elapsed, kind, data]) + '\n')
+
+  def Close(self):
+    with self._lock:
+      self._file.close()
+
+
 class GdbProxy(object):
   """The gdb that is being run as a service for the inferior.
 
@@ -125,37 +417,27 @@ class GdbProxy(object):
   is done by pushing around JSON encoded dicts specifying RPC requests and
   their results. Automatic respawning is not handled by this class and must be
   implemented on top of this if it is to be available.
+
+  RPCs may be issued from multiple threads; they are serialized so that only
+  one request is ever in flight.
+
+  Attributes:
+    stop_epoch: Incremented after every RPC not in READ_ONLY_RPCS or
+      FILE_WRITING_RPCS, i.e. every time the state of the inferior may have
+      changed.
+    stats: The rpcstats.RpcStats every call is recorded in.
   """
 
   firstrun = True
 
-  def __init__(self, args=None, arch=None):
+  def __init__(self, args=None, arch=None, stats=None):
     super(GdbProxy, self).__init__()
-    gdb_version = GdbProxy.Version()
-    if gdb_version < (7, 4, None) and GdbProxy.firstrun:
-      # The user may have a custom-built version, so we only warn them
-      logging.warning('Your version of gdb may be unsupported (< 7.4), '
-                      'proceed with caution.')
-      GdbProxy.firstrun = False
-
-    arglist = _GDB_ARGS
-    # Due to a design flaw in the C part of the gdb python API, setting the
-    # target architecture from within a running script doesn't work, so we have
-    # to do this with a command line flag.
-    if arch:
-        arglist = arglist + ['--eval-command', 'set architecture ' + arch]
-    arglist = (arglist +
-               ['--command=' + os.path.join(PAYLOAD_DIR, fname)
-                for fname in _GDB_STARTUP_FILES])
-
-    # Add version-specific args
-    if gdb_version >= (7, 6, 1):
-      # We want as little interference from user settings as possible,
-      # but --nh was only introduced in 7.6.1
-      arglist.append('--nh')
-
-    if args:
-      arglist.extend(args)
+    # This has to be done before anything else, since __getattr__ would
+    # otherwise happily turn the attributes into RPCs.
+    self._InitRpcState(stats)
+    arglist = GdbProxy.CommandLine(args, arch)
+    if RECORD_PATH:
+      self._recorder = TrafficRecorder(RECORD_PATH, arglist)
 
     # We use a temporary file for pushing IO between pyringe and gdb so we
     # don't have to worry about writes larger than the capacity of one pipe
@@ -188,6 +470,64 @@ class GdbProxy(object):
     self._poller.register(self._errfile_r.fileno(),
                           select.POLLIN | select.POLLPRI)
 
+  def _InitRpcState(self, stats):
+    """Sets up the bookkeeping for RPCs, independent of the transport."""
+    self._lock = threading.RLock()
+    self._send_lock = threading.Lock()
+    self._ids = itertools.count(1)
+    # The request currently waited for, and the last one whose reply was
+    # never read.
+    self._current_id = None
+    self._unanswered_id = None
+    self._partial_line = ''
+    self._recorder = None
+    self.stop_epoch = 0
+    self.stats = stats or rpcstats.RpcStats()
+    self._InitClassTable()
+
+  def _InitClassTable(self):
+    # The ProxyClass of every class seen in this session, by address, and the
+    # addresses of those whose class dict is yet to be retrieved.
+    self.classes = {}
+    self._unresolved_classes = set()
+
+  @staticmethod
+  def CommandLine(args=None, arch=None):
+    """Assembles the command line used for starting the gdb service.
+
+    Args:
+      args: Additional arguments for gdb.
+      arch: The target architecture gdb should be set to.
+    Returns:
+      The argument list for gdb.
+    """
+    gdb_version = GdbProxy.Version()
+    if gdb_version < (7, 4, None) and GdbProxy.firstrun:
+      # The user may have a custom-built version, so we only warn them
+      logging.warning('Your version of gdb may be unsupported (< 7.4), '
+                      'proceed with caution.')
+      GdbProxy.firstrun = False
+
+    arglist = list(_GDB_ARGS)
+    # Due to a design flaw in the C part of the gdb python API, setting the
+    # target architecture from within a running script doesn't work, so we have
+    # to do this with a command line flag.
+    if arch:
+        arglist = arglist + ['--eval-command', 'set architecture ' + arch]
+    arglist = (arglist +
+               ['--command=' + os.path.join(PAYLOAD_DIR, fname)
+                for fname in _GDB_STARTUP_FILES])
+
+    # Add version-specific args
+    if gdb_version >= (7, 6, 1):
+      # We want as little interference from user settings as possible,
+      # but --nh was only introduced in 7.6.1
+      arglist.append('--nh')
+
+    if args:
+      arglist.extend(args)
+    return arglist
+
   def __getattr__(self, name):
     """Handles transparent proxying to gdb subprocess.
 
@@ -199,6 +539,10 @@ class GdbProxy(object):
     """
     return lambda *args, **kwargs: self._Execute(name, *args, **kwargs)
 
+  def Admin(self, name, *args, **kwargs):
+    """Calls `name` in the service's admin namespace, see _Execute."""
+    return self._Execute(ADMIN_PREFIX + name, *args, **kwargs)
+
   def Kill(self):
     """Send death pill to Gdb and forcefully kill it if that doesn't work."""
     try:
@@ -220,6 +564,8 @@ class GdbProxy(object):
       self._process.wait()
     self._errfile_r.close()
     self._outfile_r.close()
+    if self._recorder:
+      self._recorder.Close()
 
   @property
   def is_running(self):
@@ -313,11 +659,69 @@ class GdbProxy(object):
       elif isinstance(value, list):
         value = self._JsonDecodeList(value)
       rv[key] = value
+    if '__pyringe_truncated__' in data:
+      return _MarkTruncated(rv['value'], '%s limit, %d omitted' % (
+          rv['__pyringe_truncated__'], rv['omitted']))
     if '__pyringe_type_name__' in data:
       # We're looking at a proxyobject
+      class_dict = rv.pop('__pyringe_class_dict__', None)
+      if '__pyringe_type__' in rv:
+        rv['__pyringe_class__'] = self._ProxyClass(rv.pop('__pyringe_type__'),
+                                                   class_dict)
       rv = ProxyObject(rv)
     return rv
 
+  def _ProxyClass(self, address, class_dict):
+    """Looks up a class in the class table, filling in its dict if given."""
+    proxy_class = self.classes.get(address)
+    if not proxy_class:
+      proxy_class = self.classes[address] = ProxyClass(address)
+    if class_dict is not None:
+      proxy_class.attrdict = class_dict
+    elif proxy_class.attrdict is None:
+      self._unresolved_classes.add(address)
+    return proxy_class
+
+  def RebuildGraph(self, result):
+    """Turns the result of a graph RPC back into python objects.
+
+    Args:
+      result: The graph, as returned by e.g. LookupGraph.
+    Returns:
+      A dict of the graph's root names to the rebuilt objects, marked as
+      truncated if the graph is incomplete.
+    """
+    for address, class_dict in result['classes'].iteritems():
+      self._ProxyClass(long(address), class_dict)
+    def MakeInstance(type_name, address, class_address):
+      return ProxyObject({'__pyringe_type_name__': type_name,
+                          '__pyringe_address__': address,
+                          '__pyringe_class__': self._ProxyClass(class_address,
+                                                                None)})
+    def MakeTruncated(kind, omitted):
+      truncated_type = TruncatedList if kind == 'list' else TruncatedDict
+      return truncated_type([], '%d omitted' % omitted)
+    roots = graph.Rebuild(result, MakeInstance, MakeTruncated)
+    if self._unresolved_classes:
+      with self._lock:
+        self._ResolveClasses()
+    if isinstance(result, TruncatedDict):
+      return _MarkTruncated(roots, result.reason)
+    return roots
+
+  def _FillClassDicts(self, class_dicts):
+    """Stores the result of a 'ClassDicts' RPC in the class table."""
+    for address, class_dict in class_dicts.iteritems():
+      self._ProxyClass(long(address), class_dict)
+      self._unresolved_classes.discard(long(address))
+
+  def _ResolveClasses(self):
+    """Retrieves the class dicts that got lost along with earlier replies."""
+    while self._unresolved_classes:
+      addresses = sorted(self._unresolved_classes)
+      self._unresolved_classes.clear()
+      self._FillClassDicts(self._ExecuteLocked('ClassDicts', addresses))
+
   # There is a reason for this messy method signature, it's got to do with
   # python 2's handling of function arguments, how this class is expected to
   # behave and the responsibilities of __getattr__. Suffice it to say that if
@@ -329,18 +733,161 @@ class GdbProxy(object):
     Args:
       funcname: the name of the function to call.
       *args: the function's arguments.
-      **kwargs: Only the key 'wait_for_completion' is inspected, which decides
-        whether to wait forever for completion or just 3 seconds.
+      **kwargs: The following keys are inspected:
+        'wait_for_completion': wait forever for completion instead of just
+          3 seconds.
+        'budget': seconds after which the service is to stop gathering data
+          and return what it has got so far, marked as truncated. The timeout
+          is extended accordingly.
+        'progress': a callable receiving the service's progress reports (see
+          the protocol description above). Every report extends the timeout.
+        'timeout': seconds to wait for the result, overriding the above.
     Returns:
       The result of the function call.
     """
-    wait_for_completion = kwargs.get('wait_for_completion', False)
-    rpc_dict = {'func': funcname, 'args': args}
-    self._Send(json.dumps(rpc_dict))
-    timeout = TIMEOUT_FOREVER if wait_for_completion else TIMEOUT_DEFAULT
+    with self._lock:
+      try:
+        return self._ExecuteLocked(funcname, *args, **kwargs)
+      finally:
+        if (funcname not in READ_ONLY_RPCS and
+            funcname not in FILE_WRITING_RPCS and
+            not funcname.startswith(ADMIN_PREFIX)):
+          self.stop_epoch += 1
+
+  def _ExecuteLocked(self, funcname, *args, **kwargs):
+    rpc_id = next(self._ids)
+    timing = {}
+    start = time.time()
+    try:
+      self._Send(json.dumps(self._RequestDict(rpc_id, funcname, args, kwargs)))
+      result = self._AwaitReply(rpc_id, self._Timeout(kwargs),
+                                kwargs.get('progress'), timing)
+      if self._unresolved_classes:
+        self._ResolveClasses()
+    except Exception:
+      self.stats.RecordFailure(funcname)
+      raise
+    self.stats.Record(funcname, time.time() - start, timing.get('decode', 0),
+                      timing.get('service'))
+    return result
+
+  @staticmethod
+  def _RequestDict(rpc_id, funcname, args, kwargs):
+    """Assembles an RPC request as described in the protocol above."""
+    rpc_dict = {'id': rpc_id, 'func': funcname, 'args': args}
+    opts = {}
+    if kwargs.get('budget') is not None:
+      opts['budget'] = kwargs['budget']
+    if kwargs.get('progress'):
+      opts['progress'] = PROGRESS_INTERVAL
+    if kwargs.get('limits'):
+      opts['limits'] = kwargs['limits']
+    if opts:
+      rpc_dict['opts'] = opts
+    return rpc_dict
 
-    result_string = self._Recv(timeout)
+  @staticmethod
+  def _Timeout(kwargs):
+    if 'timeout' in kwargs:
+      return kwargs['timeout']
+    if kwargs.get('wait_for_completion', False):
+      return TIMEOUT_FOREVER
+    if kwargs.get('budget') is not None:
+      return kwargs['budget'] + TIMEOUT_DEFAULT
+    return TIMEOUT_DEFAULT
+
+  def _AwaitReply(self, rpc_id, timeout, progress=None, timing=None):
+    """Reads replies until the one for request `rpc_id` shows up.
 
+    Args:
+      rpc_id: The id of the request to wait for.
+      timeout: Seconds to wait for the reply, or TIMEOUT_FOREVER.
+      progress: Optional callable receiving progress reports for the request.
+      timing: Optional dict, receives the seconds spent decoding as 'decode'
+        and the service's timings for the request as 'service'.
+    Raises:
+      CancelledError: if the request was cancelled.
+      TimeoutError: if no reply arrived in time. The request is then
+          remembered, so it can still be cancelled.
+    Returns:
+      The result of the request.
+    """
+    deadline = None if timeout is TIMEOUT_FOREVER else time.time() + timeout
+    self._current_id = rpc_id
+    self._unanswered_id = rpc_id
+    try:
+      while True:
+        remaining = (TIMEOUT_FOREVER if deadline is None
+                     else max(deadline - time.time(), 0))
+        line = self._Recv(remaining)
+        decode_start = time.time()
+        reply = self._DecodeResult(line)
+        if timing is not None:
+          timing['decode'] = time.time() - decode_start
+          if isinstance(reply, dict):
+            timing['service'] = reply.get('stats')
+        if not isinstance(reply, dict) or reply.get('id') != rpc_id:
+          logging.debug('Dropping reply to abandoned request: %r', reply)
+          continue
+        if 'progress' in reply:
+          if progress:
+            progress(reply['progress'])
+            if deadline is not None:
+              # Still making progress, so it's not hanging.
+              deadline = max(deadline, time.time() + TIMEOUT_DEFAULT)
+          continue
+        self._unanswered_id = None
+        return self._UnwrapReply(reply)
+    finally:
+      self._current_id = None
+
+  def _UnwrapReply(self, reply):
+    """Extracts the result from a decoded reply envelope."""
+    if reply.get('cancelled'):
+      raise CancelledError('Request was cancelled.')
+    result = reply.get('result')
+    if reply.get('truncated'):
+      result = _MarkTruncated(result, reply['truncated'])
+    return result
+
+  def Cancel(self, partial=False, timeout=TIMEOUT_DEFAULT):
+    """Asks gdb to stop working on the current request, leaving gdb running.
+
+    If another thread is waiting for the request, it will see either its
+    partial result or a CancelledError. Otherwise the request is the last one
+    that timed out, and its reply is waited for here.
+    Args:
+      partial: Whether the request should be answered with what has been
+        gathered so far instead of being aborted.
+      timeout: Seconds to wait for gdb to acknowledge the cancellation.
+    Raises:
+      TimeoutError: if gdb didn't react in time.
+      CancelledError: if the request was aborted.
+    Returns:
+      The partial result, or None if there was nothing to cancel.
+    """
+    rpc_id = self._current_id
+    if rpc_id is not None:
+      self._Send(json.dumps({'func': '__cancel__', 'args': [rpc_id, partial]}))
+    if not self._lock.acquire(False):
+      # Somebody else is waiting for the reply.
+      return None
+    try:
+      if self._current_id is not None:
+        # The lock is reentrant, so this thread is the one waiting for the
+        # reply, e.g. cancelling from a progress callback. The reply is read
+        # there.
+        return None
+      rpc_id = self._unanswered_id
+      if rpc_id is None:
+        return None
+      self._Send(json.dumps({'func': '__cancel__', 'args': [rpc_id, partial]}))
+      return self._AwaitReply(rpc_id, timeout)
+    finally:
+      self._lock.release()
+
+  def _DecodeResult(self, result_string):
+    """Turns a JSON-encoded RPC result into python objects."""
     try:
       result = json.loads(result_string, object_hook=self._JsonDecodeDict)
       if isinstance(result, unicode):
@@ -356,7 +903,21 @@ class GdbProxy(object):
 
   def _Send(self, string):
     """Write a string of data to the gdb-internal python interpreter."""
-    self._process.stdin.write(string + '\n')
+    with self._send_lock:
+      if self._recorder:
+        self._recorder.Record('s', string)
+      self._process.stdin.write(string + '\n')
+
+  @staticmethod
+  def _ProxyErrorFromStderr(exc):
+    """Builds a ProxyError from what GdbService wrote to stderr."""
+    exc_text = '\n-----------------------------------\n'
+    exc_text += 'Error occurred within GdbService:\n'
+    try:
+      exc_text += json.loads(exc)
+    except ValueError:
+      exc_text = exc
+    return ProxyError(exc_text)
 
   def _Recv(self, timeout):
     """Receive output from gdb.
@@ -378,7 +939,8 @@ class GdbProxy(object):
       or `None`, should the read fail or timeout.
     """
 
-    buf = ''
+    # A line may only have been partially written when we last timed out.
+    buf, self._partial_line = self._partial_line, ''
     # The messiness of this stems from the "duck-typiness" of this function.
     # The timeout parameter of poll has different semantics depending on whether
     # it's <=0, >0, or None. Yay.
@@ -401,16 +963,16 @@ class GdbProxy(object):
       if self._outfile_r.fileno() in fd_list:
         buf += self._outfile_r.readline()
         if buf.endswith('\n'):
+          if self._recorder:
+            self._recorder.Record('o', buf)
           return buf
 
       # GDB-internal exception passing
       if self._errfile_r.fileno() in fd_list:
         exc = self._errfile_r.readline()
         if exc:
-          exc_text = '\n-----------------------------------\n'
-          exc_text += 'Error occurred within GdbService:\n'
           try:
-            exc_text += json.loads(exc)
+            json.loads(exc)
           except ValueError:
             # whatever we got back wasn't valid JSON.
             # This usually means we've run into an exception before the special
@@ -420,12 +982,11 @@ class GdbProxy(object):
             deadline = time.time() + 0.5
             while self.is_running and TimeLeft() > 0:
               exc += self._errfile_r.read()
-            try:
-              exc_text += json.loads(exc)
-            except ValueError:
-              exc_text = exc
-          raise ProxyError(exc_text)
+          if self._recorder:
+            self._recorder.Record('e', exc)
+          raise self._ProxyErrorFromStderr(exc)
     # timeout
+    self._partial_line = buf
     raise TimeoutError()
 
 
@@ -448,6 +1009,8 @@ class Inferior(object):
     self._symbol_file = None
     self.arch = architecture
     self.auto_symfile_loading = auto_symfile_loading
+    self.rpc_stats = rpcstats.RpcStats()
+    self.handle_cache = handles.HandleCache()
 
     # Inferior objects are created before the user ever issues the 'attach'
     # command, but since this is used by `Reinit`, we call upon gdb to do this
@@ -466,8 +1029,22 @@ class Inferior(object):
     return wrap
 
   @needsattached
-  def Cancel(self):
-    self.ShutDownGdb()
+  def Cancel(self, partial=False):
+    """Cancels the command that last timed out.
+
+    gdb is only restarted if it doesn't react to the cancellation.
+    Args:
+      partial: Whether to return what the command has gathered so far.
+    Returns:
+      The partial result of the command if `partial` was requested.
+    """
+    try:
+      return self._gdb.Cancel(partial)
+    except CancelledError:
+      return None
+    except (TimeoutError, ProxyError):
+      logging.warning('Gdb did not respond to cancellation, restarting it.')
+      self.ShutDownGdb()
 
   def Reinit(self, pid, auto_symfile_loading=True):
     """Reinitializes the object with a new pid.
@@ -499,14 +1076,14 @@ class Inferior(object):
     """
     if self.attached:
       raise GdbProcessError('Gdb is already running.')
-    self._gdb = GdbProxy(arch=self.arch)
+    self._gdb = self._NewGdbProxy()
     self._gdb.Attach(self.position)
 
     if self.auto_symfile_loading:
       try:
         self.LoadSymbolFile()
       except (ProxyError, TimeoutError) as err:
-        self._gdb = GdbProxy(arch=self.arch)
+        self._gdb = self._NewGdbProxy()
         self._gdb.Attach(self.position)
         if not self.gdb.IsSymbolFileSane(self.position):
           logging.warning('Failed to automatically load a sane symbol file, '
@@ -514,6 +1091,9 @@ class Inferior(object):
                           'file is provided.')
           logging.debug(err.message)
 
+  def _NewGdbProxy(self):
+    return GdbProxy(arch=self.arch, stats=self.rpc_stats)
+
   def ShutDownGdb(self):
     if self._gdb and self._gdb.is_running:
       self._gdb.Kill()
@@ -558,20 +1138,417 @@ class Inferior(object):
                                    frame_depth=frame_depth)
 
   @needsattached
-  def Lookup(self, var_name):
-    return self.gdb.LookupInFrame(self.position, var_name)
+  def Lookup(self, var_name, budget=None, progress=None, limits=None):
+    """Looks up a variable in the current frame.
+
+    Args:
+      var_name: The name of the variable.
+      budget: Seconds after which to settle for a partial result.
+      progress: Callable receiving progress reports from gdb.
+      limits: How much of the value to retrieve, see Limits.
+    Returns:
+      The value of the variable.
+    """
+    return self.gdb.LookupInFrame(self.position, var_name, budget=budget,
+                                  progress=progress, limits=limits)
+
+  @needsattached
+  def LookupHandle(self, var_name):
+    """Looks up a variable in the current frame, without retrieving it.
+
+    Args:
+      var_name: The name of the variable.
+    Returns:
+      A handles.RemoteHandle of the variable's value, or the value itself if
+      it is a number, string or similar.
+    Raises:
+      NameError: if there is no such variable.
+    """
+    return handles.Wrap(self, self.handle_cache.Call(
+        self.gdb, 'HandleLookup', tuple(self.position), var_name))
+
+  @needsattached
+  def Summary(self, target, preview=5, budget=None, progress=None):
+    """Summarizes a container without retrieving it.
+
+    Only the container's length, the types of its items, how much memory it
+    takes up and its first few items are sent over, so this is cheap even for
+    huge containers. Items referred to more than once count once per reference.
+    Args:
+      target: The name of a variable in the current frame, a
+        handles.RemoteHandle or an address.
+      preview: How many items to include.
+      budget: Seconds after which to settle for looking at fewer items.
+      progress: Callable receiving progress reports from gdb.
+    Returns:
+      A dict of
+      * 'type', 'address': The object's type name and address.
+      * 'size': The bytes the object takes up, including the item arrays and
+                hash tables of lists, dicts and sets.
+      * 'preview': The first items (key-value pairs for dicts), retrieved
+                   with small limits. The object itself if it isn't a list,
+                   tuple, dict or set.
+      and for lists, tuples, dicts and sets also
+      * 'len': The number of items.
+      * 'scanned': How many items were looked at, less than 'len' if the
+                   budget ran out.
+      * 'items_size': The bytes the scanned items (and keys) take up.
+      * 'types': [[type name, count], ...] of the scanned items (the values
+                 of dicts), most common first.
+      * 'key_types': The same for the keys of dicts.
+    Raises:
+      NameError: if there is no such variable.
+    """
+    return self._ObjectRpc('Summary', target, preview, budget=budget,
+                           progress=progress)
+
+  @needsattached
+  def DictHealth(self, target, collisions=10, budget=None, progress=None):
+    """Analyzes the hash table of a dict.
+
+    Long probe sequences and many keys with the same hash make dict lookups
+    slow. This follows CPython's probe sequence for every entry, working from
+    the hashes stored in the table, without retrieving the keys or values.
+    Args:
+      target: As for Summary, or the address of the dict.
+      collisions: How many of the most common colliding hashes to report.
+      budget: Seconds after which to settle for looking at fewer entries.
+      progress: Callable receiving progress reports from gdb.
+    Returns:
+      A dict of
+      * 'address': The dict's address.
+      * 'used', 'fill', 'mask': The dict's ma_used, ma_fill and ma_mask.
+      * 'dummies': The number of slots of deleted entries.
+      * 'load': The fraction of slots in use, deleted ones included.
+      * 'table_size': The bytes the dict and its table take up.
+      * 'scanned': How many entries were looked at, less than 'used' if the
+                   budget ran out.
+      * 'probe_mean', 'probe_max': The mean and maximum number of slots a
+                                   lookup of an entry's key looks at.
+      * 'probe_histogram': [[probes, count], ...], with all entries needing
+                           gdb_service.DICT_HEALTH_MAX_PROBES probes or more
+                           counted under that number.
+      * 'distinct_hashes': The number of different hashes in the dict.
+      * 'collisions': A list of {'hash', 'count', 'keys'} for the hashes
+                      shared by most keys, with a few of those keys.
+    Raises:
+      NameError: if there is no such variable.
+      TypeError: if the target is not a dict.
+    """
+    return self._ObjectRpc('DictHealth', target, collisions, budget=budget,
+                           progress=progress)
+
+  @needsattached
+  def HeapCensus(self, contents=False, top=None, sort='bytes', budget=None,
+                 progress=None):
+    """Counts the inferior's objects and the memory they take up, by type.
+
+    The objects are found by walking the gc's generations, without injecting
+    any code. Sizes are what sys.getsizeof() would report, plus the item
+    arrays and hash tables of lists, dicts and sets.
+    Args:
+      contents: Also count the objects the gc doesn't track (such as strs and
+        ints), as far as they're held by lists, tuples, dicts, sets and
+        instances. This takes longer.
+      top: How many types to report, or None for all of them.
+      sort: 'bytes' or 'count', what to sort the types by.
+      budget: Seconds after which to settle for a partial census.
+      progress: Callable receiving progress reports from gdb.
+    Returns:
+      A dict of
+      * 'objects', 'bytes': The number of objects and bytes counted.
+      * 'tracked': How many of the objects the gc tracks.
+      * 'types': [[type address, type name, count, bytes], ...] of the types
+                 with the most objects or bytes.
+    """
+    return self.gdb.HeapCensus(self.position, contents, top, sort,
+                               budget=budget, progress=progress)
+
+  def HeapSnapshot(self, contents=False, budget=None, progress=None):
+    """Takes a census of all types, see HeapCensus.
+
+    Returns:
+      A heap.Snapshot, to compare with a later one using heap.Diff.
+    """
+    return heap.Snapshot(self.HeapCensus(contents=contents, budget=budget,
+                                         progress=progress))
+
+  @needsattached
+  def Referrers(self, target, limit=50, budget=None, progress=None):
+    """Finds the objects referring to an object, without injecting code.
+
+    The first call after the inferior was stopped scans the heap for all
+    references between objects, like HeapCensus(contents=True) does. Later
+    calls, and PathToRoot, reuse that scan for as long as the inferior stays
+    stopped.
+    Args:
+      target: As for Summary.
+      limit: How many referrers to report.
+      budget: Seconds after which to settle for a partial scan of the heap.
+        Partial scans are not reused.
+      progress: Callable receiving progress reports from gdb.
+    Returns:
+      A dict of
+      * 'address': The object's address.
+      * 'referrers': A list of {'address', 'type', 'label'} of the referrers,
+                     where label is how the referrer refers to the object,
+                     e.g. "['key']", '[3]' or '.__dict__'. Those that are
+                     roots (see PathToRoot) have a 'root' description, too.
+      * 'count': The number of referrers, including those not reported.
+      * 'complete': Whether the whole heap was scanned.
+    Raises:
+      NameError: if there is no such variable.
+    """
+    return self._ObjectRpc('Referrers', target, self.gdb.stop_epoch, limit,
+                           budget=budget, progress=progress)
+
+  @needsattached
+  def PathToRoot(self, target, budget=None, progress=None):
+    """Finds a shortest chain of references keeping an object alive.
+
+    The chain starts at a root: sys.modules, a sys or builtins dict, the
+    frame of a running function or a thread-local dict.
+    Args:
+      target: As for Summary.
+      budget: As for Referrers.
+      progress: Callable receiving progress reports from gdb.
+    Returns:
+      A dict of
+      * 'address': The object's address.
+      * 'root', 'root_address': The description and address of the root, or
+                                None if no root refers to the object.
+      * 'path': The objects after the root, ending with the object itself, as
+                {'address', 'type', 'label'}, where label is how the previous
+                one refers to it.
+      * 'complete': Whether the whole heap was scanned.
+    Raises:
+      NameError: if there is no such variable.
+    """
+    return self._ObjectRpc('PathToRoot', target, self.gdb.stop_epoch,
+                           budget=budget, progress=progress)
+
+  @needsattached
+  def RetainedSizes(self, top=20, budget=None, progress=None):
+    """Finds the objects keeping the most memory alive.
+
+    An object's retained size is the memory that would be freed along with
+    it: its own size, plus that of all objects only reachable through it.
+    These are computed from the dominator tree of the objects reachable from
+    the roots (see PathToRoot), built on the same scan of the heap as
+    Referrers. Sizes are as for HeapCensus(contents=True).
+    Args:
+      top: How many objects to report.
+      budget: Seconds after which to settle for approximate sizes.
+      progress: Callable receiving progress reports from gdb.
+    Returns:
+      A dict of
+      * 'objects', 'bytes': The number of objects reachable from the roots,
+                            and the bytes they take up.
+      * 'unreachable', 'unreachable_bytes': The same for the objects only
+                                            C code refers to, if anything.
+      * 'largest': A list of {'address', 'type', 'size', 'retained', 'path'}
+                   for the objects retaining the most bytes, where path is a
+                   way of getting to the object from a root, such as
+                   "sys.modules['app'].cache".
+      * 'complete': False if the budget ran out, and the sizes are only
+                    approximations.
+    """
+    return self.gdb.RetainedSizes(self.position, self.gdb.stop_epoch, top,
+                                  budget=budget, progress=progress)
+
+  @needsattached
+  def DuplicateStrings(self, top=20, budget=None, progress=None):
+    """Finds strs and unicodes held as many separate, equal objects.
+
+    Interning or otherwise sharing such strings would save memory. The
+    strings looked at are those found by the scan of the heap Referrers
+    makes (and reuses), their contents are compared by hash.
+    Args:
+      top: How many of the most wasteful values to report.
+      budget: Seconds after which to settle for looking at fewer strings.
+      progress: Callable receiving progress reports from gdb.
+    Returns:
+      A dict of
+      * 'strings', 'bytes': How many strings there are, and how many bytes
+                            they take up.
+      * 'distinct': The number of different values among them.
+      * 'wasted': The bytes all but one copy of every value take up.
+      * 'duplicates': A list of {'address', 'type', 'value', 'count',
+                      'size', 'wasted', 'interned'} for the values wasting the
+                      most memory: the address of one of the copies, a
+                      preview of the value, the number of copies and the size
+                      of one, and whether one of them is interned.
+      * 'complete': False if the budget ran out.
+    """
+    return self.gdb.DuplicateStrings(self.position, self.gdb.stop_epoch, top,
+                                     budget=budget, progress=progress)
+
+  @needsattached
+  def DumpHeap(self, path, payloads=False, budget=None, progress=None):
+    """Writes the objects of the heap and their references to a file.
+
+    This is the scan of the heap Referrers makes (and reuses), saved so that
+    it can be analyzed offline, on any machine, with heap.LoadDump. The
+    inferior needs to be stopped only for the scan itself.
+    Args:
+      path: The file to write.
+      payloads: Also save the characters of all strs and unicodes.
+      budget: Seconds after which to settle for a partial dump.
+      progress: Callable receiving progress reports from gdb.
+    Returns:
+      A dict of 'path', the number of 'objects' and 'references' dumped, the
+      'bytes' written and whether the dump is 'complete'.
+    """
+    return self.gdb.DumpHeap(self.position, self.gdb.stop_epoch,
+                             os.path.abspath(path), payloads, budget=budget,
+                             progress=progress)
+
+  @needsattached
+  def DumpBuffer(self, target, path, budget=None, progress=None):
+    """Writes the raw contents of a str, bytearray, array or buffer to a file.
+
+    The contents go from the inferior's memory to the file in chunks, without
+    being decoded or sent over as JSON, so even huge binary data is cheap to
+    get at. Open the file, or mmap it, to look at it. Unicodes work, too,
+    giving their Py_UNICODE characters.
+    Args:
+      target: As for Summary.
+      path: The file to write.
+      budget: Seconds after which to settle for writing only the beginning.
+      progress: Callable receiving progress reports from gdb.
+    Returns:
+      A dict of
+      * 'address', 'type': The object's address and type name.
+      * 'path': The file written.
+      * 'bytes': How many bytes were written.
+      * 'length': The size of the contents, more than 'bytes' if the budget
+                  ran out.
+      * 'typecode': The array module typecode of the contents, i.e. the file
+                    holds array.array(typecode) items.
+    Raises:
+      NameError: if there is no such variable.
+      TypeError: if the object is of none of these types.
+    """
+    return self._ObjectRpc('DumpBuffer', target, os.path.abspath(path),
+                           budget=budget, progress=progress)
+
+  @needsattached
+  def NdArray(self, target, path=None, mmap=None, budget=None,
+              progress=None):
+    """Copies a numpy array out of the inferior.
+
+    The elements go from the inferior's memory to a file in chunks, the way
+    DumpBuffer's do, and become a local array with the same dtype, shape and
+    strides. Arrays of python objects, datetimes or structured dtypes can't be
+    copied this way.
+    Args:
+      target: As for Summary.
+      path: The file to transfer the elements through. Defaults to a temporary
+        file, which is deleted again.
+      mmap: Whether to memory-map the file rather than read it, so only the
+        parts of the array looked at take up memory. Defaults to doing so for
+        arrays of NDARRAY_MMAP_SIZE bytes or more.
+      budget: Seconds after which to give up.
+      progress: Callable receiving progress reports from gdb.
+    Returns:
+      A numpy.ndarray, read-only if memory-mapped.
+    Raises:
+      ImportError: if numpy isn't installed.
+      NameError: if there is no such variable.
+      TypeError: if the object isn't a numpy array, or one of the above.
+      Error: if the budget ran out before all elements were copied.
+    """
+    if numpy is None:
+      raise ImportError('NdArray needs numpy')
+    temporary = path is None
+    if temporary:
+      handle, path = tempfile.mkstemp(prefix='pyringe-ndarray-')
+      os.close(handle)
+    try:
+      result = self._ObjectRpc('NdArray', target, os.path.abspath(path),
+                               budget=budget, progress=progress)
+      if result['bytes'] < result['length']:
+        raise Error('Only %d of %d bytes of the array were copied (%s)' % (
+            result['bytes'], result['length'],
+            getattr(result, 'reason', 'incomplete')))
+      if mmap is None:
+        mmap = result['length'] >= NDARRAY_MMAP_SIZE
+      if mmap and result['length']:
+        data = numpy.memmap(path, dtype=numpy.uint8, mode='r')
+      else:
+        data = numpy.fromfile(path, dtype=numpy.uint8)
+      return numpy.ndarray(result['shape'], result['dtype'], buffer=data,
+                           offset=result['offset'], strides=result['strides'])
+    finally:
+      if temporary:
+        # A memory map outlives the file's name.
+        os.remove(path)
+
+  @needsattached
+  def NdArraySummary(self, target, budget=None, progress=None):
+    """Copies a numpy array out of the inferior and summarizes it.
+
+    Args:
+      target: As for Summary.
+      budget: Seconds after which to give up.
+      progress: Callable receiving progress reports from gdb.
+    Returns:
+      A dict as returned by SummarizeArray.
+    Raises:
+      As NdArray.
+    """
+    return SummarizeArray(self.NdArray(target, budget=budget,
+                                       progress=progress))
+
+  def _ObjectRpc(self, funcname, target, *args, **kwargs):
+    """Makes an RPC about a single object, raising the errors it reports.
+
+    Args:
+      funcname: The name of the RPC taking a variable name. The variant
+        taking an address has a 'Handle' prefix.
+      target: The name of a variable in the current frame, a
+        handles.RemoteHandle or an address.
+      *args: The remaining arguments of the RPC.
+      **kwargs: As for GdbProxy calls.
+    Returns:
+      The result of the RPC.
+    """
+    if isinstance(target, handles.RemoteHandle):
+      target = target.address
+    if isinstance(target, (int, long)):
+      result = getattr(self.gdb, 'Handle' + funcname)(target, *args, **kwargs)
+    else:
+      result = getattr(self.gdb, funcname)(self.position, target, *args,
+                                           **kwargs)
+    handles.RaiseError(result)
+    return result
+
+  @needsattached
+  def LookupGraph(self, var_name, budget=None, progress=None):
+    """Like Lookup, but preserving shared objects and reference cycles."""
+    return self.gdb.RebuildGraph(self.gdb.LookupGraph(
+        self.position, var_name, budget=budget, progress=progress))[var_name]
+
+  @needsattached
+  def InferiorLocalsGraph(self, budget=None, progress=None):
+    """Like InferiorLocals, but preserving shared objects and cycles."""
+    return self.gdb.RebuildGraph(self.gdb.InferiorLocalsGraph(
+        self.position, budget=budget, progress=progress))
 
   @needsattached
-  def InferiorLocals(self):
-    return self.gdb.InferiorLocals(self.position)
+  def InferiorLocals(self, budget=None, progress=None, limits=None):
+    return self.gdb.InferiorLocals(self.position, budget=budget,
+                                   progress=progress, limits=limits)
 
   @needsattached
-  def InferiorGlobals(self):
-    return self.gdb.InferiorGlobals(self.position)
+  def InferiorGlobals(self, budget=None, progress=None, limits=None):
+    return self.gdb.InferiorGlobals(self.position, budget=budget,
+                                    progress=progress, limits=limits)
 
   @needsattached
-  def InferiorBuiltins(self):
-    return self.gdb.InferiorBuiltins(self.position)
+  def InferiorBuiltins(self, budget=None, progress=None, limits=None):
+    return self.gdb.InferiorBuiltins(self.position, budget=budget,
+                                     progress=progress, limits=limits)
 
   @property
   def is_running(self):
@@ -619,6 +1596,72 @@ class Inferior(object):
     else:
       logging.error('Thread ' + str(tid) + ' does not exist')
 
+  @needsattached
+  def ThreadCpu(self, interval=1.0):
+    """Measures how busy each thread of the inferior is.
+
+    The inferior doesn't run while gdb has it stopped, so gdb detaches for the
+    measurement, and the threads' CPU times are read from /proc before and
+    after interval seconds of undisturbed running. Then gdb attaches again to
+    find out which python threads the busy ones are, and what they're doing.
+    All of this happens in a single RPC, so no other request sees gdb
+    detached.
+    Args:
+      interval: How many seconds to measure for.
+    Returns:
+      A list of dicts of
+      * 'lwp': The kernel's id of the thread.
+      * 'tid': The python thread ident, None for threads python doesn't know
+               about (yet).
+      * 'cpu': The share of a core the thread used, in percent.
+      * 'frame': Where in the python code the thread is now, if anywhere.
+      sorted by 'cpu', busiest first. Threads that weren't there for all of the
+      measurement are left out.
+    """
+    return self.gdb.ThreadCpu(self.position, interval,
+                              timeout=interval + TIMEOUT_DEFAULT)
+
+  @needsattached
+  def GilState(self):
+    """Finds out which thread holds the GIL, and what the others are doing.
+
+    Returns:
+      A dict of
+      * 'holder': The ident of the python thread holding the GIL, or None.
+      * 'locked': Whether the GIL is taken, None if threads were never used.
+      * 'threads': A list of {'tid', 'lwp', 'state', 'function'}, for every
+                   python thread its ident and LWP, the innermost native
+                   function it's in, and its state: 'running' python code
+                   (holding the GIL), 'waiting-gil', in a 'syscall' (or
+                   elsewhere in the C library) or 'other', e.g. in C code
+                   that released the GIL. 'unknown' if gdb doesn't know the
+                   thread.
+    """
+    return self.gdb.GilState(self.position)
+
+  @needsattached
+  def GilContention(self, samples=10, interval=0.1):
+    """Samples the GIL's state repeatedly, to see how contended it is.
+
+    The inferior runs undisturbed for interval seconds between samples, see
+    ThreadCpu. The whole sampling happens in a single RPC.
+    Args:
+      samples: How many times to look at the GIL.
+      interval: How many seconds to let the inferior run in between.
+    Returns:
+      A dict of
+      * 'samples': The number of samples taken.
+      * 'contended': In how many percent of them some thread was waiting for
+                     the GIL.
+      * 'threads': A list of dicts of 'tid', 'lwp', the number of 'samples'
+                   the thread was in, how many of them it was in each state
+                   of GilState, and 'contention', the percentage of them it
+                   was waiting for the GIL in. Sorted by contention.
+    """
+    return self.gdb.GilContention(
+        self.position, samples, interval,
+        timeout=samples * (interval + TIMEOUT_DEFAULT))
+
   @needsattached
   def Continue(self):
     self.gdb.Continue(self.position)
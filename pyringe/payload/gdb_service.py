@@ -22,15 +22,28 @@ Interaction with the REPL part of the debugger is done through a simple RPC
 mechanism based on JSON dicts shoved through stdin/stdout.
 """
 
+import array
+import base64
 import collections
+import contextlib
+import cProfile
+import heapq
+import itertools
 import json
+import marshal
 import os
 import re
+import pstats
+import select
+import StringIO
+import struct
 import sys
+import time
 import traceback
 import zipfile
 # GDB already imports this for us, but this shuts up lint
 import gdb
+import heapgraph
 import libpython
 
 Position = collections.namedtuple('Position', 'pid tid frame_depth')
@@ -48,6 +61,108 @@ class RpcException(Error):
   pass
 
 
+class RpcCancelled(Error):
+  """Raised from within long-running loops when the client cancelled the RPC.
+
+  This deliberately isn't a RuntimeError, as libpython swallows those.
+  """
+
+
+# Objects that handles return as values rather than as further handles, see
+# GdbService.HandleAttr. Objects libpython has no special class for (e.g.
+# floats and functions) are treated as values as well.
+_HANDLE_VALUE_PTRS = (libpython.PyBoolObjectPtr, libpython.PyCFunctionObjectPtr,
+                      libpython.PyCodeObjectPtr, libpython.PyIntObjectPtr,
+                      libpython.PyLongObjectPtr, libpython.PyNoneStructPtr,
+                      libpython.PyStringObjectPtr, libpython.PyUnicodeObjectPtr)
+
+# Objects _GraphEncoder sends as nodes of their own, rather than inline.
+_GRAPH_NODE_PTRS = (libpython.HeapTypeObjectPtr, libpython.PyDictObjectPtr,
+                    libpython.PyInstanceObjectPtr, libpython.PyListObjectPtr,
+                    libpython.PySetObjectPtr, libpython.PyTupleObjectPtr)
+
+# Strings at least this long are sent only once per object graph, see
+# _GraphEncoder.
+GRAPH_SHARED_STRING_LEN = 64
+
+# Requests for functions with this prefix go to ServiceAdmin instead of
+# GdbService. They are meant for debugging the service itself.
+ADMIN_PREFIX = 'admin.'
+
+# How many bytes _ObjectReader reads from the inferior at a time.
+BULK_READ_SIZE = 1 << 16
+_WORD_FORMATS = {4: 'I', 8: 'Q'}
+
+# What GdbService.Summary retrieves of the first few items of a container.
+SUMMARY_PREVIEW_LIMITS = {'depth': 0, 'items': 3, 'string': 40}
+# How many types the histograms of GdbService.Summary list by name.
+SUMMARY_TYPES = 8
+
+# Probe lengths above this are lumped together by GdbService.DictHealth.
+DICT_HEALTH_MAX_PROBES = 32
+# How many keys GdbService.DictHealth shows per colliding hash.
+DICT_HEALTH_SAMPLE_KEYS = 3
+# How CPython's lookdict() perturbs its probe sequence, see dictobject.c.
+PERTURB_SHIFT = 5
+
+# How many strings' hashes GdbService.DuplicateStrings counts per pass.
+DUPLICATE_STRINGS_PER_PASS = 1 << 20
+
+# The functions that take the GIL by calling PyThread_acquire_lock on
+# interpreter_lock, see ceval.c and pystate.c.
+_GIL_ACQUIRERS = frozenset(['PyEval_AcquireLock', 'PyEval_AcquireThread',
+                            'PyEval_EvalFrameEx', 'PyEval_RestoreThread'])
+# How many native frames GdbService.GilState looks through for them.
+GIL_WAIT_DEPTH = 16
+# The libraries whose code a thread without the GIL is most likely blocked in
+# a system call in.
+_SYSCALL_LIBS = re.compile(r'/lib(c|pthread|rt)[-.]')
+
+# How often (in seconds) long-running loops check for cancellation requests.
+CANCEL_POLL_INTERVAL = 0.05
+# libpython's own version, which the service wraps to make loops interruptible.
+_LIBPYTHON_SAFE_RANGE = libpython.safe_range
+
+
+class _RpcCall(object):
+  """Bookkeeping for the RPC request currently being processed.
+
+  Attributes:
+    rpc_id: The id the client assigned to the request.
+    truncated: None, or the reason why the result is incomplete.
+    cancel_requested: None, or a (partial,) tuple once the client asked for the
+      call to be cancelled. If partial is true, the call is to wind down and
+      return what it has got so far; otherwise it is aborted.
+    deadline: None, or the time at which the call is to wind down and return
+      what it has got so far.
+    progress_interval: None, or the number of seconds between progress
+      reports sent to the client.
+    iterations: The number of items visited so far.
+    bytes_written: The size of the encoded result produced so far.
+    compute_time: Seconds spent running the requested function.
+    read_time: Seconds spent retrieving inferior data while encoding.
+    limits: None, or a dict with the limits on how much of each value to
+      retrieve, see GdbService._LimitedValue.
+    limited_bytes: The approximate size of the values retrieved under limits.
+  """
+
+  def __init__(self, rpc_id, budget=None, progress_interval=None, limits=None):
+    self.rpc_id = rpc_id
+    self.truncated = None
+    self.cancel_requested = None
+    self.started = time.time()
+    self.deadline = self.started + budget if budget is not None else None
+    self.progress_interval = progress_interval
+    self.iterations = 0
+    self.bytes_written = 0
+    self.next_poll = self.started + CANCEL_POLL_INTERVAL
+    self.next_progress = self.started + (progress_interval or 0)
+    self.compute_time = 0
+    self.read_time = 0
+    self.limits = limits
+    self.limited_bytes = 0
+
+
 class GdbCache(object):
   """Cache of gdb objects for common symbols."""
 
@@ -57,6 +172,8 @@ class GdbCache(object):
   INTERP_HEAD = None
   PENDINGBUSY = None
   PENDINGCALLS_TO_DO = None
+  # (prefix, suffix) of _Py_HashSecret, which salts the hashes of strings.
+  HASH_SECRET = (0, 0)
 
   @staticmethod
   def Refresh():
@@ -80,6 +197,12 @@ class GdbCache(object):
       GdbCache.INTERP_HEAD = gdb.parse_and_eval('PyInterpreterState_Head()')
     GdbCache.PENDINGBUSY = GdbCache.FuzzySymbolLookup('pendingbusy')
     GdbCache.PENDINGCALLS_TO_DO = GdbCache.FuzzySymbolLookup('pendingcalls_to_do')
+    try:
+      secret = gdb.parse_and_eval('_Py_HashSecret')
+      GdbCache.HASH_SECRET = (long(secret['prefix']), long(secret['suffix']))
+    except gdb.error:
+      # Python before 2.7.3 doesn't salt its hashes, later ones only with -R.
+      GdbCache.HASH_SECRET = (0, 0)
 
   @staticmethod
   def FuzzySymbolLookup(symbol_name):
@@ -121,6 +244,36 @@ class GdbCache(object):
         raise err
 
 
+def _JsonKey(key):
+  """Returns a dict key as is if JSON can have it as a key, else its repr()."""
+  if key is None or isinstance(key, (basestring, int, long, float, bool)):
+    return key
+  return repr(key)
+
+
+def _TaskCpuTimes(pid):
+  """Reads how much CPU time every thread of a process has used so far.
+
+  Returns:
+    {LWP: seconds of user and system time}, from /proc/<pid>/task/*/stat.
+  """
+  ticks = float(os.sysconf('SC_CLK_TCK'))
+  task_dir = '/proc/%d/task' % pid
+  times = {}
+  for lwp in os.listdir(task_dir):
+    try:
+      with open(os.path.join(task_dir, lwp, 'stat')) as stat_file:
+        stat = stat_file.read()
+    except IOError:
+      # The thread exited in the meantime.
+      continue
+    # The command name is in parentheses, and may contain anything. utime and
+    # stime are the 14th and 15th fields, see proc(5).
+    fields = stat[stat.rindex(')') + 2:].split()
+    times[int(lwp)] = (int(fields[11]) + int(fields[12])) / ticks
+  return times
+
+
 class PyFrameObjectPtr(libpython.PyFrameObjectPtr):
   """Patched version of PyFrameObjectPtr that handles reading zip files."""
 
@@ -190,6 +343,709 @@ class PyFrameObjectPtr(libpython.PyFrameObjectPtr):
     return line if line else '<file not available>'
 
 
+class _GraphEncoder(object):
+  """Serializes object graphs, sending every object only once.
+
+  See the protocol description in inferior for the format.
+  """
+  # This is part of GdbService, really.
+  # pylint: disable=protected-access
+
+  def __init__(self, service):
+    self.service = service
+    self.objects = {}
+    self.classes = {}
+    self._pending = []
+
+  def Encode(self, roots):
+    """Serializes everything reachable from roots.
+
+    Args:
+      roots: A dict of names to the libpython.PyObjectPtrs to start from.
+    Returns:
+      The graph, as a JSON-serializable dict.
+    """
+    encoded_roots = dict((name, self.Ref(pyop))
+                         for name, pyop in roots.iteritems())
+    while self._pending and not self.service._ShouldStop():
+      pyop = self._pending.pop()
+      self.objects[str(pyop.as_address())] = self._Node(pyop)
+    return {'roots': encoded_roots, 'objects': self.objects,
+            'classes': self.classes}
+
+  def Ref(self, pyop):
+    """Returns what stands for pyop wherever it's referred to.
+
+    Simple values stand for themselves, everything else is referred to by a
+    {'r': <id>} object and queued for serialization.
+    """
+    if pyop is None or pyop.is_null():
+      return None
+    if isinstance(pyop, (libpython.PyStringObjectPtr,
+                         libpython.PyUnicodeObjectPtr)):
+      length_field = ('ob_size' if isinstance(pyop, libpython.PyStringObjectPtr)
+                      else 'length')
+      if libpython.int_from_int(pyop.field(length_field)) < (
+          GRAPH_SHARED_STRING_LEN):
+        return pyop
+    elif not isinstance(pyop, _GRAPH_NODE_PTRS):
+      return pyop
+    object_id = str(pyop.as_address())
+    if object_id not in self.objects:
+      # Reserve the slot, so it's queued only once.
+      self.objects[object_id] = None
+      self._pending.append(pyop)
+    return {'r': object_id}
+
+  def _Items(self, pyop):
+    """Refers to the items of a container, stopping early if asked to.
+
+    Returns:
+      [<items>], the items being [key, value] pairs for dicts, plus the number
+      of items left out if not all of them were read.
+    """
+    from_ptr = libpython.PyObjectPtr.from_pyobject_ptr
+    items = []
+    for _, key, value in self.service._Entries(pyop, 0):
+      if self.service._ShouldStop():
+        break
+      value = self.Ref(from_ptr(value))
+      items.append(value if key is None else [self.Ref(from_ptr(key)), value])
+    omitted = self.service._Length(pyop) - len(items)
+    return [items, omitted] if omitted > 0 else [items]
+
+  def _Instance(self, type_name, class_address, attr_dict):
+    if class_address not in self.service._sent_classes:
+      self.service._sent_classes.add(class_address)
+      self.classes[str(class_address)] = self.service._ClassDict(
+          class_address)
+    return ['instance', type_name, class_address,
+            self.Ref(attr_dict) if attr_dict else None]
+
+  def _Node(self, pyop):
+    """Serializes a single object, referring to the objects it contains."""
+    if isinstance(pyop, libpython.PyStringObjectPtr):
+      return ['str', pyop]
+    if isinstance(pyop, libpython.PyUnicodeObjectPtr):
+      return ['unicode', pyop]
+    if isinstance(pyop, libpython.PyDictObjectPtr):
+      return ['dict'] + self._Items(pyop)
+    if isinstance(pyop, libpython.PyListObjectPtr):
+      return ['list'] + self._Items(pyop)
+    if isinstance(pyop, libpython.PyTupleObjectPtr):
+      return ['tuple'] + self._Items(pyop)
+    if isinstance(pyop, libpython.PySetObjectPtr):
+      kind = pyop.safe_tp_name() == 'frozenset' and 'frozenset' or 'set'
+      return [kind] + self._Items(pyop)
+    if isinstance(pyop, libpython.PyInstanceObjectPtr):
+      in_class = pyop.pyop_field('in_class')
+      return self._Instance(in_class.pyop_field('cl_name').proxyval(set()),
+                            in_class.as_address(), pyop.pyop_field('in_dict'))
+    return self._Instance(pyop.safe_tp_name(), long(pyop.field('ob_type')),
+                          pyop.get_attr_dict())
+
+
+def _Offsets(type_name):
+  """Returns {field name: byte offset} for a struct of the inferior."""
+  return dict((field.name, field.bitpos // 8)
+              for field in gdb.lookup_type(type_name).fields())
+
+
+# What _ObjectReader knows about a type. kind is 'list', 'tuple', 'dict' or
+# 'set' for (subclasses of) those containers, and None otherwise.
+_TypeInfo = collections.namedtuple(
+    '_TypeInfo', 'name basicsize itemsize flags dictoffset kind')
+
+# The pointer fields through which objects of these types refer to others,
+# besides the items of containers and instance __dict__s. Types whose struct
+# isn't in the symbols are skipped.
+_REFERENCE_FIELDS = {
+    'cell': ('PyCellObject', ('ob_ref',)),
+    'classobj': ('PyClassObject', ('cl_bases', 'cl_dict', 'cl_name')),
+    'frame': ('PyFrameObject', ('f_back', 'f_code', 'f_builtins', 'f_globals',
+                                'f_locals')),
+    'function': ('PyFunctionObject', ('func_code', 'func_globals',
+                                      'func_defaults', 'func_closure',
+                                      'func_doc', 'func_name', 'func_dict',
+                                      'func_module')),
+    'instance': ('PyInstanceObject', ('in_class', 'in_dict')),
+    'instancemethod': ('PyMethodObject', ('im_func', 'im_self', 'im_class')),
+    'module': ('PyModuleObject', ('md_dict',)),
+    'type': ('PyTypeObject', ('tp_dict', 'tp_bases', 'tp_mro')),
+}
+
+# What python calls the _REFERENCE_FIELDS that have a different name there.
+_FIELD_ATTRS = {
+    'cl_bases': '__bases__',
+    'cl_dict': '__dict__',
+    'cl_name': '__name__',
+    'func_closure': '__closure__',
+    'func_dict': '__dict__',
+    'func_module': '__module__',
+    'in_class': '__class__',
+    'in_dict': '__dict__',
+    'md_dict': '__dict__',
+    'ob_ref': 'cell_contents',
+    'tp_bases': '__bases__',
+    'tp_dict': '__dict__',
+    'tp_mro': '__mro__',
+}
+
+# A label of _EdgeLabel that looks up an identifier in a dict.
+_ATTR_LABEL = re.compile(r"^\['([A-Za-z_][A-Za-z0-9_]*)'\]$")
+
+# The layouts of objects whose structs are private to their .c files, and so
+# are often missing from the symbols, as {field: offset in words}.
+_PRIVATE_LAYOUTS = {
+    'arrayobject': {'ob_item': 3, 'allocated': 4, 'ob_descr': 5},
+    'PyBufferObject': {'b_base': 2, 'b_ptr': 3, 'b_size': 4, 'b_offset': 5},
+    'PyArrayObject_fields': {'data': 2, 'nd': 3, 'dimensions': 4,
+                             'strides': 5, 'descr': 7},
+}
+
+# What _ObjectReader knows about a numpy array: where its first element is,
+# the kind, byteorder and size of its dtype (see numpy.dtype), whether that is
+# a structured or subarray dtype, and its dimensions and strides in bytes.
+_NdArrayInfo = collections.namedtuple(
+    '_NdArrayInfo',
+    'data kind byteorder itemsize structured shape strides')
+
+# The dtype kinds whose elements are plain bytes, and so can be transferred as
+# such: booleans, numbers, strs, unicodes and opaque void.
+_NUMPY_KINDS = 'biufcSUV'
+
+Py_TPFLAGS_HAVE_GC = 1 << 14
+# gc_refs of objects of gc types the gc isn't tracking, see objimpl.h.
+_PyGC_REFS_UNTRACKED = -2
+NUM_GENERATIONS = 3
+
+
+class _ObjectReader(object):
+  """Reads types, sizes and contents of inferior objects in bulk.
+
+  Unlike libpython, this works on plain addresses and reads whole tables of
+  containers at once, which is what makes looking at millions of objects
+  feasible. Struct layouts are looked up once, type information once per type.
+  """
+
+  def __init__(self):
+    self.word = libpython.SIZEOF_VOID_P
+    self._type_offset = _Offsets('PyObject')['ob_type']
+    self._size_offset = _Offsets('PyVarObject')['ob_size']
+    self._dict = _Offsets('PyDictObject')
+    self._dict_entry = self._EntryLayout('PyDictEntry')
+    self._set = _Offsets('PySetObject')
+    self._set_entry = self._EntryLayout('setentry')
+    self._list = _Offsets('PyListObject')
+    self._tuple_items = _Offsets('PyTupleObject')['ob_item']
+    self._str = _Offsets('PyStringObject')
+    self._unicode = _Offsets('PyUnicodeObject')
+    self._unicode_unit = gdb.lookup_type('Py_UNICODE').sizeof
+    self._tp_base = _Offsets('PyTypeObject')['tp_base']
+    self._gc_head_size = None
+    self._types = {}
+    self._dummies = set()
+    self._fields = {}
+
+  def _EntryLayout(self, type_name):
+    """Returns the size (in words) and field indices of a table entry."""
+    return (gdb.lookup_type(type_name).sizeof // self.word,
+            dict((name, offset // self.word)
+                 for name, offset in _Offsets(type_name).iteritems()))
+
+  def Words(self, address, count):
+    """Reads count pointer-sized unsigned words."""
+    data = gdb.selected_inferior().read_memory(address, count * self.word)
+    return struct.unpack('=%d%s' % (count, _WORD_FORMATS[self.word]),
+                         buffer(data)[:])
+
+  def Word(self, address):
+    return self.Words(address, 1)[0]
+
+  def Raw(self, address, count):
+    """Reads count bytes, as the buffer object gdb returns."""
+    return gdb.selected_inferior().read_memory(address, count)
+
+  def Bytes(self, address, count):
+    """Reads count bytes, as a str."""
+    if not count:
+      return ''
+    return buffer(self.Raw(address, count))[:]
+
+  def Signed(self, word):
+    """Reinterprets an unsigned word as a Py_ssize_t."""
+    if word >> (8 * self.word - 1):
+      return word - (1 << (8 * self.word))
+    return word
+
+  def Array(self, address, slots, entry_words):
+    """Yields the slots of an array as tuples of entry_words words each."""
+    per_read = max(1, BULK_READ_SIZE // (entry_words * self.word))
+    for start in xrange(0, slots, per_read):
+      count = min(per_read, slots - start)
+      words = self.Words(address + start * entry_words * self.word,
+                         count * entry_words)
+      for i in xrange(0, count * entry_words, entry_words):
+        yield words[i:i + entry_words]
+
+  def TypeOf(self, address):
+    return self.Word(address + self._type_offset)
+
+  def TypeInfo(self, type_address):
+    """Returns the _TypeInfo of the type at type_address."""
+    info = self._types.get(type_address)
+    if info is None:
+      type_object = gdb.Value(type_address).cast(GdbCache.TYPE).dereference()
+      name = type_object['tp_name'].string()
+      flags = long(type_object['tp_flags'])
+      kind = None
+      if flags & libpython.Py_TPFLAGS_LIST_SUBCLASS:
+        kind = 'list'
+      elif flags & libpython.Py_TPFLAGS_TUPLE_SUBCLASS:
+        kind = 'tuple'
+      elif flags & libpython.Py_TPFLAGS_DICT_SUBCLASS:
+        kind = 'dict'
+      elif name in ('set', 'frozenset'):
+        kind = 'set'
+      info = _TypeInfo(name, int(type_object['tp_basicsize']),
+                       int(type_object['tp_itemsize']), flags,
+                       int(type_object['tp_dictoffset']), kind)
+      self._types[type_address] = info
+    return info
+
+  def IsSubtype(self, type_address, name):
+    """Whether a type is the type called name, or derives from it."""
+    while type_address:
+      if self.TypeInfo(type_address).name == name:
+        return True
+      type_address = self.Word(type_address + self._tp_base)
+    return False
+
+  @property
+  def gc_head_size(self):
+    if self._gc_head_size is None:
+      self._gc_head_size = gdb.lookup_type('PyGC_Head').sizeof
+    return self._gc_head_size
+
+  def SizeOf(self, address, type_address=None):
+    """Returns how many bytes an object takes up.
+
+    This is what sys.getsizeof() returns (tp_basicsize, plus tp_itemsize for
+    every item of variable-size objects like tuples, strs and longs, plus the
+    gc header), plus the item arrays and hash tables of lists, dicts and sets.
+    """
+    if type_address is None:
+      type_address = self.TypeOf(address)
+    info = self.TypeInfo(type_address)
+    size = info.basicsize
+    if info.itemsize:
+      ob_size = self.Signed(self.Word(address + self._size_offset))
+      size += info.itemsize * abs(ob_size)
+    if info.flags & Py_TPFLAGS_HAVE_GC:
+      size += self.gc_head_size
+    if info.kind == 'list':
+      size += self.word * self.Word(address + self._list['allocated'])
+    elif info.kind in ('dict', 'set'):
+      table, slots, (entry_words, _) = self._HashTable(address, info.kind)
+      if table != address + (self._dict['ma_smalltable'] if info.kind == 'dict'
+                             else self._set['smalltable']):
+        size += slots * entry_words * self.word
+    return size
+
+  def StringBuffer(self, address, type_address):
+    """Locates the characters of a str or unicode object.
+
+    Returns:
+      (address, length, size, interned): Where the characters are and how
+      many bytes they take up (the Py_UNICODE buffer of unicodes); the bytes
+      the whole object takes up; whether the str is interned. None if the
+      object is neither a str nor a unicode.
+    """
+    flags = self.TypeInfo(type_address).flags
+    if flags & libpython.Py_TPFLAGS_STRING_SUBCLASS:
+      header = self.Bytes(address, self._str['ob_sval'])
+      length = self.Signed(struct.unpack_from(
+          '=' + _WORD_FORMATS[self.word], header, self._size_offset)[0])
+      state = struct.unpack_from('=i', header, self._str['ob_sstate'])[0]
+      return (address + self._str['ob_sval'], length,
+              self.SizeOf(address, type_address), bool(state))
+    if flags & libpython.Py_TPFLAGS_UNICODE_SUBCLASS:
+      length = self.Word(address + self._unicode['length'])
+      characters = self.Word(address + self._unicode['str'])
+      return (characters, length * self._unicode_unit,
+              (self.SizeOf(address, type_address)
+               + (length + 1) * self._unicode_unit), False)
+    return None
+
+  def _PrivateOffsets(self, struct_name):
+    """Like _Offsets, falling back to _PRIVATE_LAYOUTS."""
+    try:
+      return _Offsets(struct_name)
+    except gdb.error:
+      return dict((field, index * self.word) for field, index
+                  in _PRIVATE_LAYOUTS[struct_name].iteritems())
+
+  def RawBuffer(self, address, type_address):
+    """Locates the memory an object keeps its contents in.
+
+    This works for strs and unicodes (see StringBuffer), bytearrays,
+    array.arrays and buffers.
+    Returns:
+      (address, length, typecode): Where the contents are and how many bytes
+      they take up, and the typecode of the array module they can be read as.
+      None if the object is of none of these types.
+    """
+    info = self.TypeInfo(type_address)
+    located = self.StringBuffer(address, type_address)
+    if located is not None:
+      return (located[0], located[1],
+              'c' if info.flags & libpython.Py_TPFLAGS_STRING_SUBCLASS
+              else 'u')
+    if info.name == 'bytearray':
+      offsets = _Offsets('PyByteArrayObject')
+      return (self.Word(address + offsets['ob_bytes']),
+              self.Signed(self.Word(address + self._size_offset)), 'c')
+    if info.name == 'array.array':
+      offsets = self._PrivateOffsets('arrayobject')
+      typecode, itemsize = struct.unpack(
+          '=ii', self.Bytes(self.Word(address + offsets['ob_descr']), 8))
+      return (self.Word(address + offsets['ob_item']),
+              itemsize * self.Signed(self.Word(address + self._size_offset)),
+              chr(typecode))
+    if info.name == 'buffer':
+      offsets = self._PrivateOffsets('PyBufferObject')
+      size = self.Signed(self.Word(address + offsets['b_size']))
+      base = self.Word(address + offsets['b_base'])
+      if not base:
+        return self.Word(address + offsets['b_ptr']), size, 'c'
+      # The buffer is a view of part of another object's contents. A negative
+      # size (Py_END_OF_BUFFER) means up to the end.
+      located = self.RawBuffer(base, self.TypeOf(base))
+      if located is None:
+        return None
+      base_address, base_length, _ = located
+      offset = min(self.Word(address + offsets['b_offset']), base_length)
+      length = base_length - offset
+      if size >= 0:
+        length = min(size, length)
+      return base_address + offset, length, 'c'
+    return None
+
+  def _DescrOffsets(self):
+    """The offsets of numpy's PyArray_Descr, from its symbols if there."""
+    try:
+      return _Offsets('PyArray_Descr')
+    except gdb.error:
+      # The typeobj pointer is followed by the chars kind, type, byteorder and
+      # flags, the ints type_num, elsize and alignment, then by pointers.
+      chars = 3 * self.word
+      pointers = -(-(chars + 16) // self.word) * self.word
+      return {'kind': chars, 'byteorder': chars + 2, 'elsize': chars + 8,
+              'subarray': pointers, 'names': pointers + 2 * self.word}
+
+  def NdArray(self, address, type_address):
+    """Locates the elements of a numpy array.
+
+    Returns:
+      The _NdArrayInfo of the array. None if the object is not a
+      numpy.ndarray (or an instance of a subclass, like numpy.memmap).
+    """
+    if not self.IsSubtype(type_address, 'numpy.ndarray'):
+      return None
+    offsets = self._PrivateOffsets('PyArrayObject_fields')
+    dimensions = struct.unpack('=i', self.Bytes(address + offsets['nd'], 4))[0]
+    shape = strides = ()
+    if dimensions:
+      shape = tuple(self.Signed(word) for word in self.Words(
+          self.Word(address + offsets['dimensions']), dimensions))
+      strides = tuple(self.Signed(word) for word in self.Words(
+          self.Word(address + offsets['strides']), dimensions))
+    descr = self.Word(address + offsets['descr'])
+    descr_offsets = self._DescrOffsets()
+    kind, byteorder = struct.unpack('=c1xc', self.Bytes(
+        descr + descr_offsets['kind'], 3))
+    itemsize = struct.unpack('=i', self.Bytes(
+        descr + descr_offsets['elsize'], 4))[0]
+    structured = bool(self.Word(descr + descr_offsets['subarray']) or
+                      self.Word(descr + descr_offsets['names']))
+    return _NdArrayInfo(self.Word(address + offsets['data']), kind, byteorder,
+                        itemsize, structured, shape, strides)
+
+  def IsTracked(self, address, type_address):
+    """Whether the gc tracks an object, i.e. it's in one of the generations."""
+    if not self.TypeInfo(type_address).flags & Py_TPFLAGS_HAVE_GC:
+      return False
+    gc_refs = self.Word(address - self.gc_head_size + 2 * self.word)
+    return self.Signed(gc_refs) != _PyGC_REFS_UNTRACKED
+
+  def Generations(self):
+    """Returns the addresses of the list heads of the gc generations."""
+    generation0 = long(gdb.parse_and_eval('_PyGC_generation0'))
+    try:
+      stride = gdb.lookup_type('struct gc_generation').sizeof
+    except gdb.error:
+      # A PyGC_Head and two ints, aligned like the PyGC_Head (long double).
+      alignment = min(self.gc_head_size, 16)
+      stride = -(-(self.gc_head_size + 8) // alignment) * alignment
+    return [generation0 + i * stride for i in range(NUM_GENERATIONS)]
+
+  def Tracked(self):
+    """Yields (address, type address) of every object the gc tracks.
+
+    The generations are linked lists, so this reads object by object; the
+    gc header and the object header come in with a single read each.
+    """
+    header_words = (self.gc_head_size + self._type_offset) // self.word + 1
+    for head in self.Generations():
+      node = self.Word(head)
+      while node != head:
+        words = self.Words(node, header_words)
+        yield node + self.gc_head_size, words[-1]
+        node = words[0]
+
+  def _HashTable(self, address, kind):
+    """Returns (table address, slots, entry layout) of a dict or set."""
+    if kind == 'dict':
+      offsets, layout = self._dict, self._dict_entry
+      table, mask = offsets['ma_table'], offsets['ma_mask']
+    else:
+      offsets, layout = self._set, self._set_entry
+      table, mask = offsets['table'], offsets['mask']
+    return (self.Word(address + table), self.Word(address + mask) + 1,
+            layout)
+
+  def DictSlots(self, address):
+    """Yields (hash, key, value) of every slot of a dict's hash table."""
+    table, slots, (entry_words, fields) = self._HashTable(address, 'dict')
+    indices = fields['me_hash'], fields['me_key'], fields['me_value']
+    for entry in self.Array(table, slots, entry_words):
+      yield tuple(entry[i] for i in indices)
+
+  def KeyHash(self, key):
+    """Returns the hash the inferior has for a key, as an unsigned word.
+
+    Like CPython 2.7's string_hash, unicode_hash and int_hash, this supports
+    str, unicode and int keys (longs, too, as far as they fit into an int).
+    Returns:
+      The hash, or None for other keys.
+    """
+    mask = (1 << (8 * self.word)) - 1
+    if isinstance(key, (int, long)):
+      if not -(mask >> 1) - 1 <= key <= mask >> 1:
+        return None
+      value = key & mask
+    elif isinstance(key, basestring):
+      if isinstance(key, unicode):
+        if self._unicode_unit == 2:
+          encoded = key.encode('utf-16-le')
+          units = struct.unpack('<%dH' % (len(encoded) // 2), encoded)
+        else:
+          units = [ord(char) for char in key]
+      else:
+        units = [ord(char) for char in key]
+      if not units:
+        return 0
+      prefix, suffix = GdbCache.HASH_SECRET
+      value = (prefix ^ (units[0] << 7)) & mask
+      for unit in units:
+        value = ((1000003 * value) & mask) ^ unit
+      value = (value ^ len(units) ^ suffix) & mask
+    else:
+      return None
+    # -1 means "not computed yet" to CPython, so it is never a hash.
+    return mask - 1 if value == mask else value
+
+  def DictProbe(self, address, key_hash):
+    """Yields the (key, value) entries lookdict() compares a key with.
+
+    These are the live entries with the key's hash along its probe sequence,
+    which ends at the first empty slot.
+    """
+    table, slots, (entry_words, fields) = self._HashTable(address, 'dict')
+    size_mask = (1 << (8 * self.word)) - 1
+    i = perturb = key_hash
+    for _ in xrange(slots):
+      entry = self.Words(table + (i & (slots - 1)) * entry_words * self.word,
+                         entry_words)
+      key, value = entry[fields['me_key']], entry[fields['me_value']]
+      if not key:
+        return
+      if value and entry[fields['me_hash']] == key_hash:
+        yield key, value
+      i = (5 * i + perturb + 1) & size_mask
+      perturb >>= PERTURB_SHIFT
+
+  def _IsDummy(self, address):
+    """Whether address is the '<dummy key>' str sets mark deleted slots with.
+    """
+    if address in self._dummies:
+      return True
+    if (self.TypeInfo(self.TypeOf(address)).name == 'str'
+        and self.Word(address + self._size_offset) == len('<dummy key>')):
+      pyop = libpython.PyObjectPtr.from_pyobject_ptr(
+          gdb.Value(address).cast(libpython.PyObjectPtr.get_gdb_type()))
+      if str(pyop) == '<dummy key>':
+        self._dummies.add(address)
+        return True
+    return False
+
+  def Entries(self, address, type_address=None):
+    """Yields (key, item) addresses for the items of a list, tuple, dict or set.
+
+    key is 0 except for dicts. Other objects have no entries.
+    """
+    if type_address is None:
+      type_address = self.TypeOf(address)
+    kind = self.TypeInfo(type_address).kind
+    if kind in ('list', 'tuple'):
+      length = self.Signed(self.Word(address + self._size_offset))
+      if kind == 'list':
+        items = self.Word(address + self._list['ob_item'])
+      else:
+        items = address + self._tuple_items
+      for (item,) in self.Array(items, length, 1):
+        if item:
+          yield 0, item
+    elif kind == 'dict':
+      for _, key, value in self.DictSlots(address):
+        if value:
+          yield key, value
+    elif kind == 'set':
+      table, slots, (entry_words, fields) = self._HashTable(address, 'set')
+      key_index = fields['key']
+      for entry in self.Array(table, slots, entry_words):
+        key = entry[key_index]
+        if key and not self._IsDummy(key):
+          yield 0, key
+
+  def Fields(self, type_name):
+    """Returns [(field name, offset), ...] of _REFERENCE_FIELDS[type_name]."""
+    fields = self._fields.get(type_name)
+    if fields is None:
+      fields = []
+      if type_name in _REFERENCE_FIELDS:
+        struct_name, names = _REFERENCE_FIELDS[type_name]
+        try:
+          offsets = _Offsets(struct_name)
+        except gdb.error:
+          offsets = {}
+        fields = [(name, offsets[name]) for name in names if name in offsets]
+      self._fields[type_name] = fields
+    return fields
+
+  def FrameSlots(self, address):
+    """Returns the addresses in a frame's local, cell and free variables."""
+    frame = gdb.Value(address).cast(
+        gdb.lookup_type('PyFrameObject').pointer())
+    code = frame['f_code']
+    slots = int(code['co_nlocals'])
+    for names in (code['co_cellvars'], code['co_freevars']):
+      if long(names):
+        slots += self.Signed(self.Word(long(names) + self._size_offset))
+    if not slots:
+      return ()
+    return self.Words(long(frame['f_localsplus'].address), slots)
+
+  def References(self, address, type_address):
+    """Yields the addresses of the objects an object refers to.
+
+    These are the items (and keys) of lists, tuples, dicts and sets, the
+    __dict__ of instances of classes with one, the variables of frames and
+    the fields in _REFERENCE_FIELDS.
+    """
+    info = self.TypeInfo(type_address)
+    if info.kind:
+      for key, item in self.Entries(address, type_address):
+        if key:
+          yield key
+        yield item
+    if info.dictoffset > 0:
+      attr_dict = self.Word(address + info.dictoffset)
+      if attr_dict:
+        yield attr_dict
+    for _, offset in self.Fields(info.name):
+      referent = self.Word(address + offset)
+      if referent:
+        yield referent
+    if info.name == 'frame':
+      for referent in self.FrameSlots(address):
+        if referent:
+          yield referent
+
+
+class _HeapGraph(heapgraph.Graph):
+  """The heapgraph.Graph of the inferior's heap.
+
+  The objects are the ones the gc tracks, and all objects they (or untracked
+  objects they refer to) refer to, see _ObjectReader.References.
+  """
+
+  def __init__(self, service, reader):
+    super(_HeapGraph, self).__init__()
+    sources = array.array('L')
+    targets = array.array('L')
+    visited = array.array('L')
+    visited_types = array.array('L')
+    visited_sizes = array.array('L')
+    seen = set()
+    pending = []
+    for address, type_address in reader.Tracked():
+      if service._ShouldStop():  # pylint: disable=protected-access
+        self.complete = False
+        break
+      seen.add(address)
+      pending.append((address, type_address))
+      while pending:
+        address, type_address = pending.pop()
+        visited.append(address)
+        visited_types.append(type_address)
+        visited_sizes.append(reader.SizeOf(address, type_address))
+        for referent in reader.References(address, type_address):
+          sources.append(address)
+          targets.append(referent)
+          if referent not in seen:
+            seen.add(referent)
+            referent_type = reader.TypeOf(referent)
+            if not reader.IsTracked(referent, referent_type):
+              pending.append((referent, referent_type))
+    self.Build(seen, itertools.izip(visited, visited_types, visited_sizes),
+               sources, targets)
+
+
+class ServiceAdmin(object):
+  """RPCs for debugging the service itself, reached via ADMIN_PREFIX."""
+
+  def __init__(self):
+    self.profiler = None
+    self.profiling = False
+
+  def StartProfiler(self):
+    """Starts profiling all following RPCs, discarding any earlier profile."""
+    self.profiler = cProfile.Profile()
+    self.profiling = True
+
+  def StopProfiler(self):
+    """Stops profiling. The profile gathered so far is kept."""
+    self.profiling = False
+
+  def _Stats(self):
+    if not self.profiler:
+      raise RpcException('The profiler was never started.')
+    return pstats.Stats(self.profiler)
+
+  def ProfilerStats(self, sort='cumulative', limit=40):
+    """Returns the profile as printed by pstats, sorted by `sort`."""
+    stream = StringIO.StringIO()
+    stats = self._Stats()
+    stats.stream = stream
+    stats.sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+  def ProfilerDump(self):
+    """Returns the profile as a base64-encoded pstats file."""
+    return base64.b64encode(marshal.dumps(self._Stats().stats))
+
+
 class GdbService(object):
   """JSON-based RPC Service for commanding gdb."""
 
@@ -197,6 +1053,17 @@ class GdbService(object):
     self.stdin = stdin or sys.stdin
     self.stdout = stdout or sys.stdout
     self.stderr = stderr or sys.stderr
+    # Requests read ahead while polling for cancellation.
+    self._read_buffer = ''
+    self._call = _RpcCall(None)
+    self.admin = ServiceAdmin()
+    # Addresses of the classes whose dicts were sent to the client already.
+    self._sent_classes = set()
+    # (stop epoch, _HeapGraph) of the last complete heap graph built.
+    self._heap_graph = None
+    # All of libpython's loops over inferior data go through safe_range, which
+    # makes it the natural place to check for cancellation.
+    libpython.safe_range = self._SafeRange
 
   @property
   def breakpoints(self):
@@ -205,29 +1072,40 @@ class GdbService(object):
       return gdb.breakpoints()
     return ()
 
+  def _TimedFallback(self, obj):
+    start = time.time()
+    try:
+      return self._UnserializableObjectFallback(obj)
+    finally:
+      self._call.read_time += time.time() - start
+
   def _UnserializableObjectFallback(self, obj):
     """Handles sanitizing of unserializable objects for Json.
 
-    For instances of heap types, we take the class dict, augment it with the
-    instance's __dict__, tag it and transmit it over to the RPC client to be
-    reconstructed there. (Works with both old and new style classes)
+    For instances of heap types, we take the instance's __dict__, tag it with
+    its class and transmit it over to the RPC client to be reconstructed there.
+    (Works with both old and new style classes.) The class dict only goes along
+    with the first instance of each class sent in this session, see
+    _TagInstance.
     Args:
       obj: The object to Json-serialize
     Returns:
       A Json-serializable version of the parameter
     """
+    if self._call.truncated and isinstance(obj, libpython.PyObjectPtr):
+      # Out of time; make it obvious this wasn't looked at.
+      return '<%s at remote 0x%x (not retrieved)>' % (obj.safe_tp_name(),
+                                                      obj.as_address())
+    if self._call.limits and isinstance(obj, libpython.PyObjectPtr):
+      return self._LimitedValue(obj, 0)
     if isinstance(obj, libpython.PyInstanceObjectPtr):
       # old-style classes use 'classobj'/'instance'
-      # get class attribute dictionary
-      in_class = obj.pyop_field('in_class')
-      result_dict = in_class.pyop_field('cl_dict').proxyval(set())
-
       # let libpython.py do the work of getting the instance dict
       instanceproxy = obj.proxyval(set())
-      result_dict.update(instanceproxy.attrdict)
-      result_dict['__pyringe_type_name__'] = instanceproxy.cl_name
-      result_dict['__pyringe_address__'] = instanceproxy.address
-      return result_dict
+      result_dict = dict(instanceproxy.attrdict)
+      return self._TagInstance(result_dict, instanceproxy.cl_name,
+                               instanceproxy.address,
+                               long(obj.field('in_class')))
 
     if isinstance(obj, libpython.HeapTypeObjectPtr):
       # interestingly enough, HeapTypeObjectPtr seems to handle all pointers to
@@ -236,23 +1114,12 @@ class GdbService(object):
       # new-style classes are simple PyObject pointers to the interpreter,
       # libpython.py tends to give us HeapTypeObjectPtrs for things we can't
       # handle properly.
-
-      try:
-        # get class attribute dictionary
-        type_ptr = obj.field('ob_type')
-        tp_dict = type_ptr.cast(GdbCache.TYPE)['tp_dict'].cast(GdbCache.DICT)
-        result_dict = libpython.PyDictObjectPtr(tp_dict).proxyval(set())
-      except gdb.error:
-        # There was probably a type mismatch triggered by wrong assumptions in
-        # libpython.py
-        result_dict = {}
-
       try:
         # get instance attributes
-        result_dict.update(obj.get_attr_dict().proxyval(set()))
-        result_dict['__pyringe_type_name__'] = obj.safe_tp_name()
-        result_dict['__pyringe_address__'] = long(obj._gdbval)  # pylint: disable=protected-access
-        return result_dict
+        result_dict = obj.get_attr_dict().proxyval(set())
+        return self._TagInstance(result_dict, obj.safe_tp_name(),
+                                 long(obj._gdbval),  # pylint: disable=protected-access
+                                 long(obj.field('ob_type')))
       except TypeError:
         # This happens in the case where we're not really looking at a heap type
         # instance. There isn't really anything we can do, so we fall back to
@@ -270,14 +1137,334 @@ class GdbService(object):
     except AttributeError:
       return str(obj)
 
+  def _LimitedValue(self, pyop, depth, visited=None):
+    """Retrieves a value within the limits of the current call.
+
+    The limits (all optional) are
+    * 'depth'  : Containers and instances nested deeper than this below the
+                 top-level value are replaced by a placeholder string.
+    * 'items'  : How many items of each container to retrieve.
+    * 'string' : How many characters of each string to retrieve.
+    * 'bytes'  : Roughly how many bytes of data to retrieve in total. Once
+                 exceeded, the call is truncated and the remaining values are
+                 replaced by placeholders.
+    Incomplete containers and strings are marked as described in inferior.
+    Args:
+      pyop: The value, as a libpython.PyObjectPtr.
+      depth: How deeply nested the value is below the top-level value.
+      visited: The addresses of the containers and instances the value is
+        nested in. One of them showing up again is replaced by a placeholder
+        string, like libpython does for cycles.
+    Returns:
+      A JSON-serializable version of the value.
+    """
+    call = self._call
+    limits = call.limits
+    if pyop.is_null():
+      return None
+    if call.truncated:
+      return '<%s at remote 0x%x (not retrieved)>' % (pyop.safe_tp_name(),
+                                                      pyop.as_address())
+    if isinstance(pyop, (libpython.PyStringObjectPtr,
+                         libpython.PyUnicodeObjectPtr)):
+      return self._Account(self._LimitedString(pyop, limits.get('string')))
+    length = self._Length(pyop)
+    is_instance = isinstance(pyop, (libpython.HeapTypeObjectPtr,
+                                    libpython.PyInstanceObjectPtr))
+    if length is None and not is_instance:
+      return self._Account(self._UnserializableObjectFallbackNoLimits(pyop))
+    if limits.get('depth') is not None and depth > limits['depth']:
+      return '<%s at remote 0x%x (depth limit)>' % (pyop.safe_tp_name(),
+                                                    pyop.as_address())
+    address = pyop.as_address()
+    if visited is None:
+      visited = set()
+    if address in visited:
+      return '<%s at remote 0x%x (cycle)>' % (pyop.safe_tp_name(), address)
+    visited.add(address)
+    try:
+      if is_instance:
+        return self._LimitedInstance(pyop, depth, visited)
+      max_items = limits.get('items')
+      items = []
+      for _, key, value in self._Entries(pyop, 0):
+        if max_items is not None and len(items) >= max_items:
+          break
+        if self._ShouldStop():
+          break
+        if key is not None:
+          # Keys are read first and in full: once the call is truncated,
+          # libpython's loops (see _SafeRange) no longer read anything.
+          key = _JsonKey(self._Account(
+              libpython.PyObjectPtr.from_pyobject_ptr(key).proxyval(set())))
+        value = self._LimitedValue(
+            libpython.PyObjectPtr.from_pyobject_ptr(value), depth + 1, visited)
+        items.append(value if key is None else (key, value))
+      if isinstance(pyop, libpython.PyDictObjectPtr):
+        result = dict(items)
+      else:
+        result = items
+      if len(items) < length:
+        return {'__pyringe_truncated__': 'items',
+                'omitted': length - len(items), 'value': result}
+      return result
+    finally:
+      visited.discard(address)
+
+  def _UnserializableObjectFallbackNoLimits(self, pyop):
+    limits = self._call.limits
+    self._call.limits = None
+    try:
+      return self._UnserializableObjectFallback(pyop)
+    finally:
+      self._call.limits = limits
+
+  def _LimitedInstance(self, pyop, depth, visited):
+    """_LimitedValue for instances of classes."""
+    if isinstance(pyop, libpython.PyInstanceObjectPtr):
+      in_class = pyop.pyop_field('in_class')
+      type_name = in_class.pyop_field('cl_name').proxyval(set())
+      class_address = in_class.as_address()
+      attr_dict = pyop.pyop_field('in_dict')
+    else:
+      type_name = pyop.safe_tp_name()
+      class_address = long(pyop.field('ob_type'))
+      attr_dict = pyop.get_attr_dict()
+    result = {}
+    if attr_dict:
+      # The attributes count as part of the instance, not as a nested value.
+      result = self._LimitedValue(attr_dict, depth, visited)
+      if not isinstance(result, dict):
+        result = {}
+      elif '__pyringe_truncated__' in result:
+        result = dict(result['value'], __pyringe_incomplete__=True)
+    return self._TagInstance(result, type_name, pyop.as_address(),
+                             class_address)
+
+  def _LimitedString(self, pyop, max_chars):
+    """Reads (at most max_chars characters of) a string, without libpython's
+    size limit."""
+    if isinstance(pyop, libpython.PyStringObjectPtr):
+      length = libpython.int_from_int(pyop.field('ob_size'))
+      address = pyop.field('ob_sval').address
+      char_size, encoding = 1, None
+    else:
+      length = libpython.int_from_int(pyop.field('length'))
+      address = pyop.field('str')
+      char_size = gdb.lookup_type('Py_UNICODE').sizeof
+      encoding = 'utf-32-le' if char_size == 4 else 'utf-16-le'
+    read = length if max_chars is None else min(length, max_chars)
+    data = buffer(gdb.selected_inferior().read_memory(address,
+                                                      read * char_size))[:]
+    if encoding:
+      data = data.decode(encoding, 'replace')
+    if read < length:
+      return {'__pyringe_truncated__': 'string', 'omitted': length - read,
+              'value': data}
+    return data
+
+  def _Account(self, value):
+    """Adds the (approximate) size of a value to the current call's total."""
+    call = self._call
+    if isinstance(value, dict) and '__pyringe_truncated__' in value:
+      size = len(value['value'])
+    elif isinstance(value, basestring):
+      size = len(value)
+    else:
+      size = 8
+    call.limited_bytes += size
+    max_bytes = call.limits.get('bytes') if call.limits else None
+    if max_bytes is not None and call.limited_bytes > max_bytes:
+      call.truncated = 'bytes'
+    return value
+
+  def _TagInstance(self, result_dict, type_name, address, class_address):
+    """Marks up the __dict__ of an instance as described in inferior.
+
+    Args:
+      result_dict: The instance's attributes.
+      type_name: The name of the instance's class.
+      address: The address of the instance.
+      class_address: The address of the instance's type or classobj.
+    Returns:
+      result_dict.
+    """
+    result_dict['__pyringe_type_name__'] = type_name
+    result_dict['__pyringe_address__'] = address
+    result_dict['__pyringe_type__'] = class_address
+    if class_address not in self._sent_classes:
+      self._sent_classes.add(class_address)
+      result_dict['__pyringe_class_dict__'] = self._ClassDict(class_address)
+    return result_dict
+
+  def _ClassDict(self, class_address):
+    """Returns the attribute dict of a type or an old-style classobj."""
+    class_ptr = libpython.PyObjectPtr.from_pyobject_ptr(
+        gdb.Value(class_address).cast(libpython.PyObjectPtr.get_gdb_type()))
+    if isinstance(class_ptr, libpython.PyClassObjectPtr):
+      return class_ptr.pyop_field('cl_dict').proxyval(set())
+    try:
+      tp_dict = class_ptr._gdbval.cast(GdbCache.TYPE)['tp_dict']  # pylint: disable=protected-access
+      return libpython.PyDictObjectPtr(tp_dict.cast(GdbCache.DICT)).proxyval(
+          set())
+    except gdb.error:
+      # There was probably a type mismatch triggered by wrong assumptions in
+      # libpython.py
+      return {}
+
+  def ClassDicts(self, class_addresses):
+    """Returns the attribute dicts of the given types, keyed by address."""
+    result = {}
+    for class_address in class_addresses:
+      self._sent_classes.add(class_address)
+      result[str(class_address)] = self._ClassDict(class_address)
+    return result
+
+  def _StdinFd(self):
+    try:
+      return self.stdin.fileno()
+    except (AttributeError, IOError, ValueError):
+      # Not a real file, so there's no way of polling it.
+      return None
+
+  def _FillReadBuffer(self, block):
+    """Reads from stdin into the read buffer.
+
+    Args:
+      block: Whether to wait for input if none is available.
+    Returns:
+      False if stdin has been closed, True otherwise.
+    """
+    fd = self._StdinFd()
+    if fd is None:
+      if not block:
+        return True
+      data = self.stdin.readline()
+    else:
+      # We have to bypass python's file buffering here, as select wouldn't
+      # know about anything waiting in there.
+      if not block and not select.select([fd], [], [], 0)[0]:
+        return True
+      data = os.read(fd, 4096)
+    self._read_buffer += data
+    return bool(data)
+
   def _Read(self):
-    return self.stdin.readline()
+    while '\n' not in self._read_buffer:
+      if not self._FillReadBuffer(block=True):
+        line, self._read_buffer = self._read_buffer, ''
+        return line
+    line, self._read_buffer = self._read_buffer.split('\n', 1)
+    return line + '\n'
+
+  def _PollCancel(self):
+    """Checks stdin for cancellation requests for the current call.
+
+    Anything that isn't a cancellation request stays in the read buffer and is
+    handled once the current call is done.
+    """
+    if not self._FillReadBuffer(block=False):
+      return
+    lines = self._read_buffer.split('\n')
+    remaining = []
+    for line in lines[:-1]:
+      try:
+        request = json.loads(line)
+      except ValueError:
+        request = None
+      if (isinstance(request, dict) and request.get('func') == '__cancel__'
+          and request.get('args')
+          and request['args'][0] == self._call.rpc_id):
+        self._call.cancel_requested = (bool(request['args'][1:2]
+                                            and request['args'][1]),)
+      else:
+        remaining.append(line)
+    remaining.append(lines[-1])
+    self._read_buffer = '\n'.join(remaining)
+
+  def _ShouldStop(self):
+    """Checks whether the current call is to stop iterating over data.
+
+    This is cheap enough to be called on every iteration of a loop.
+    Raises:
+      RpcCancelled: if the call was cancelled without asking for partial
+          results.
+    Returns:
+      True if the call is to return what it has got so far.
+    """
+    call = self._call
+    if call.truncated:
+      return True
+    call.iterations += 1
+    if not call.iterations & 0x3f:
+      now = time.time()
+      if now >= call.next_poll:
+        call.next_poll = now + CANCEL_POLL_INTERVAL
+        self._PollCancel()
+      if call.deadline is not None and now >= call.deadline:
+        call.truncated = 'deadline'
+        return True
+      if call.progress_interval and now >= call.next_progress:
+        call.next_progress = now + call.progress_interval
+        self._WriteProgress()
+    if call.cancel_requested:
+      if not call.cancel_requested[0]:
+        raise RpcCancelled()
+      call.truncated = 'cancelled'
+      return True
+    return False
+
+  def _WriteProgress(self):
+    call = self._call
+    self._Write(json.dumps({'id': call.rpc_id,
+                            'progress': {
+                                'items': call.iterations,
+                                'bytes': call.bytes_written,
+                                'elapsed': time.time() - call.started,
+                            }}))
+
+  def _SafeRange(self, val):
+    """Interruptible replacement for libpython.safe_range."""
+    for i in _LIBPYTHON_SAFE_RANGE(val):
+      if self._ShouldStop():
+        return
+      yield i
 
   def _Write(self, string):
     self.stdout.write(string + '\n')
 
-  def _WriteObject(self, obj):
-    self._Write(json.dumps(obj, default=self._UnserializableObjectFallback))
+  def _WriteReply(self, result):
+    """Writes the reply to the current call, wrapped as described in inferior.
+
+    Args:
+      result: The return value of the call.
+    Raises:
+      RpcCancelled: if the call was cancelled while encoding the result.
+    """
+    # Encoding the result is where most of the inferior's data is actually
+    # read, so this has to happen before we know whether it was truncated.
+    encode_start = time.time()
+    if self._call.progress_interval:
+      # The pure-python encoder is slower, but lets us keep track of how much
+      # has been produced.
+      encoder = json.JSONEncoder(default=self._TimedFallback)
+      chunks = []
+      for chunk in encoder.iterencode(result):
+        chunks.append(chunk)
+        self._call.bytes_written += len(chunk)
+      encoded = ''.join(chunks)
+    else:
+      encoded = json.dumps(result, default=self._TimedFallback)
+    encode_time = time.time() - encode_start
+    envelope = {'id': self._call.rpc_id,
+                'stats': {'compute': self._call.compute_time,
+                          'read': self._call.read_time,
+                          'encode': max(encode_time - self._call.read_time, 0),
+                          'bytes': len(encoded)}}
+    if self._call.truncated:
+      envelope['truncated'] = self._call.truncated
+    # Splice the encoded result into the envelope's closing brace.
+    self._Write('%s, "result": %s}' % (json.dumps(envelope)[:-1], encoded))
 
   def _ReadObject(self):
     try:
@@ -300,14 +1487,37 @@ class GdbService(object):
           function exists.
     """
     request = self._ReadObject()
+    opts = request.get('opts') or {}
+    self._call = _RpcCall(request.get('id'), budget=opts.get('budget'),
+                          limits=opts.get('limits'),
+                          progress_interval=opts.get('progress'))
+    if request['func'] == '__cancel__':
+      # Whatever this was meant for has already finished.
+      return True
     if request['func'] == '__kill__':
       self.ClearBreakpoints()
-      self._WriteObject('__kill_ack__')
+      self._WriteReply('__kill_ack__')
       return False
-    if 'func' not in request or request['func'].startswith('_'):
+    if 'func' not in request:
       raise RpcException('Not a valid public API function.')
-    rpc_result = getattr(self, request['func'])(*request['args'])
-    self._WriteObject(rpc_result)
+    target, funcname = self, request['func']
+    if funcname.startswith(ADMIN_PREFIX):
+      target, funcname = self.admin, funcname[len(ADMIN_PREFIX):]
+    if funcname.startswith('_') or not hasattr(target, funcname):
+      raise RpcException('Not a valid public API function.')
+    profiler = None
+    if target is self and self.admin.profiling:
+      profiler = self.admin.profiler
+      profiler.enable()
+    try:
+      rpc_result = getattr(target, funcname)(*request['args'])
+      self._call.compute_time = time.time() - self._call.started
+      self._WriteReply(rpc_result)
+    except RpcCancelled:
+      self._Write(json.dumps({'id': self._call.rpc_id, 'cancelled': True}))
+    finally:
+      if profiler:
+        profiler.disable()
     return True
 
   def _UnpackGdbVal(self, gdb_value):
@@ -478,6 +1688,188 @@ class GdbService(object):
     return [self._UnpackGdbVal(tstate['thread_id'])
             for tstate in self._ThreadPtrs(position)]
 
+  def ThreadLwps(self, position):
+    """Maps the python threads to the kernel's thread ids (LWPs).
+
+    Args:
+      position: array of pid, tid, framedepth specifying the requested position.
+    Returns:
+      A list of {'tid', 'lwp', 'frame'} for every python thread: its thread
+      ident, its LWP (None if gdb doesn't know the thread) and where it is in
+      the python code, or None if it isn't running any.
+    """
+    result = []
+    for tid, tstate, thread in self._PythonThreads(position):
+      frame = None
+      if long(tstate['frame']):
+        frame = PyFrameObjectPtr(tstate['frame'])
+        frame = 'File "%s", line %s, in %s' % (
+            frame.filename(), frame.current_line_num(),
+            frame.co_name.proxyval(set()))
+      result.append({'tid': tid, 'lwp': thread and thread.ptid[1],
+                     'frame': frame})
+    return result
+
+  @contextlib.contextmanager
+  def _Running(self, position):
+    """Lets the inferior run for the duration of a with block.
+
+    gdb keeps the inferior stopped while it's attached, so this detaches, and
+    attaches again afterwards. Doing both within one RPC keeps other requests
+    from finding gdb detached.
+    """
+    self.Detach()
+    try:
+      yield
+    finally:
+      self.Attach(position)
+
+  def ThreadCpu(self, position, interval):
+    """Measures how busy each thread of the inferior is, see inferior.ThreadCpu.
+
+    Args:
+      position: array of pid, tid, framedepth specifying the requested position.
+      interval: How many seconds to let the inferior run for the measurement.
+    Returns:
+      A list of {'lwp', 'tid', 'cpu', 'frame'}, sorted by 'cpu'.
+    """
+    with self._Running(position):
+      before, start = _TaskCpuTimes(position[0]), time.time()
+      time.sleep(interval)
+      after, end = _TaskCpuTimes(position[0]), time.time()
+    python_threads = dict((thread['lwp'], thread)
+                          for thread in self.ThreadLwps(position))
+    result = []
+    for lwp in set(before) & set(after):
+      python_thread = python_threads.get(lwp, {})
+      result.append({'lwp': lwp,
+                     'tid': python_thread.get('tid'),
+                     'cpu': 100 * (after[lwp] - before[lwp]) / (end - start),
+                     'frame': python_thread.get('frame')})
+    result.sort(key=lambda thread: (-thread['cpu'], thread['lwp']))
+    return result
+
+  def _PythonThreads(self, position):
+    """Yields (tid, tstate, gdb thread or None) for every python thread."""
+    tstates = self._ThreadPtrs(position)
+    tids = [self._UnpackGdbVal(tstate['thread_id']) for tstate in tstates]
+    threads = gdb.selected_inferior().threads()
+    if len(threads) == 1:
+      tid_map = dict((tid, threads[0].num) for tid in tids)
+    else:
+      tid_map = self._GetGdbThreadMapping(position)
+    threads = dict((thread.num, thread) for thread in threads)
+    for tid, tstate in zip(tids, tstates):
+      yield tid, tstate, threads.get(tid_map.get(tid))
+
+  def GilState(self, position):
+    """Finds out which thread holds the GIL, and what the others are doing.
+
+    Args:
+      position: array of pid, tid, framedepth specifying the requested position.
+    Returns:
+      A dict of
+      * 'holder': The ident of the python thread holding the GIL, or None.
+      * 'locked': Whether the GIL is taken, None if there is none (yet).
+      * 'threads': A list of {'tid', 'lwp', 'state', 'function'} for every
+                   python thread: its thread ident and LWP, the innermost
+                   native function it's in and what it's doing, see
+                   _NativeState. The holder's state is 'running'.
+    """
+    self.EnsureGdbPosition(position[0], None, None)
+    holder = gdb.parse_and_eval('_PyThreadState_Current')
+    holder = self._UnpackGdbVal(holder['thread_id']) if long(holder) else None
+    try:
+      lock = long(gdb.parse_and_eval('(long) interpreter_lock'))
+    except gdb.error:
+      lock = 0
+    # The lock is a semaphore, see thread_pthread.h. Its value comes first in
+    # all of glibc's layouts, and is 0 while someone holds it.
+    locked = None
+    if lock:
+      locked = not struct.unpack(
+          '=I', buffer(gdb.selected_inferior().read_memory(lock, 4))[:])[0]
+    result = {'holder': holder, 'locked': locked, 'threads': []}
+    selected = gdb.selected_thread()
+    try:
+      for tid, _, thread in self._PythonThreads(position):
+        state, function = self._NativeState(thread)
+        if tid == holder:
+          state = 'running'
+        result['threads'].append({'tid': tid,
+                                  'lwp': thread and thread.ptid[1],
+                                  'state': state,
+                                  'function': function})
+    finally:
+      if selected is not None:
+        selected.switch()
+    return result
+
+  def GilContention(self, position, samples, interval):
+    """Samples GilState repeatedly, see inferior.GilContention.
+
+    Args:
+      position: array of pid, tid, framedepth specifying the requested position.
+      samples: How many times to look at the GIL.
+      interval: How many seconds to let the inferior run in between.
+    Returns:
+      A dict of 'samples', 'contended' and 'threads', see
+      inferior.GilContention. 'samples' is the number actually taken, if the
+      call was cancelled.
+    """
+    states = ('running', 'waiting-gil', 'syscall', 'other', 'unknown')
+    threads = {}
+    contended = 0
+    taken = 0
+    for sample in xrange(samples):
+      if self._ShouldStop():
+        break
+      if sample:
+        with self._Running(position):
+          time.sleep(interval)
+      gil = self.GilState(position)
+      taken += 1
+      contended += any(thread['state'] == 'waiting-gil'
+                       for thread in gil['threads'])
+      for thread in gil['threads']:
+        counts = threads.setdefault(thread['tid'], dict(
+            [('tid', thread['tid']), ('lwp', thread['lwp']), ('samples', 0)] +
+            [(state, 0) for state in states]))
+        counts['samples'] += 1
+        counts[thread['state']] += 1
+    for counts in threads.itervalues():
+      counts['contention'] = 100.0 * counts['waiting-gil'] / counts['samples']
+    return {'samples': taken,
+            'contended': 100.0 * contended / taken if taken else 0.0,
+            'threads': sorted(threads.itervalues(), key=lambda counts: (
+                -counts['contention'], -counts['running'], counts['tid']))}
+
+  def _NativeState(self, thread):
+    """Classifies what a thread is doing by its native frames.
+
+    Returns:
+      (state, function): The name of the innermost function the thread is in,
+      and state 'waiting-gil' if it's blocked taking the GIL, 'syscall' if
+      it's in the C library, likely blocked in a system call, or else
+      'other'. 'unknown' if gdb doesn't know the thread.
+    """
+    if thread is None:
+      return 'unknown', None
+    thread.switch()
+    frame = gdb.newest_frame()
+    function = frame.name()
+    in_libc = _SYSCALL_LIBS.search(gdb.solib_name(frame.pc()) or '')
+    for _ in xrange(GIL_WAIT_DEPTH):
+      if frame.name() == 'PyThread_acquire_lock':
+        caller = frame.older()
+        if caller is not None and caller.name() in _GIL_ACQUIRERS:
+          return 'waiting-gil', function
+        break
+      frame = frame.older()
+      if frame is None:
+        break
+    return 'syscall' if in_libc else 'other', function
+
   def ClearBreakpoints(self):
     for bkp in self.breakpoints:
       bkp.enabled = False
@@ -632,6 +2024,8 @@ class GdbService(object):
   def _CreateProxyValFromIterator(self, iterator):
     result_dict = {}
     for key, value in iterator():
+      if self._ShouldStop():
+        break
       native_key = key.proxyval(set()) if key else key
       result_dict[native_key] = value
     return result_dict
@@ -651,6 +2045,911 @@ class GdbService(object):
     frame = PyFrameObjectPtr(self.selected_frame)
     return self._CreateProxyValFromIterator(frame.iter_builtins)
 
+  # The following functions back inferior.RemoteHandle. They identify objects
+  # by address, and report errors as {'error': <exception name>, 'message':
+  # <text>} rather than raising them, as that would end the session.
+
+  def _PyObjectAt(self, address):
+    return libpython.PyObjectPtr.from_pyobject_ptr(
+        gdb.Value(address).cast(libpython.PyObjectPtr.get_gdb_type()))
+
+  def _Describe(self, pyop):
+    """Returns the handle description of a remote object.
+
+    Args:
+      pyop: The object, as a libpython.PyObjectPtr.
+    Returns:
+      {'value': pyop} for objects in _HANDLE_VALUE_PTRS, which json then
+      retrieves as a whole. Otherwise {'address': <address>, 'type': <type
+      name>}, plus 'len' for containers.
+    """
+    if (pyop.is_null() or type(pyop) is libpython.PyObjectPtr
+        or isinstance(pyop, _HANDLE_VALUE_PTRS)):
+      return {'value': pyop}
+    description = {'address': pyop.as_address(), 'type': pyop.safe_tp_name()}
+    length = self._Length(pyop)
+    if length is not None:
+      description['len'] = length
+    return description
+
+  def _Length(self, pyop):
+    if isinstance(pyop, (libpython.PyListObjectPtr,
+                         libpython.PyTupleObjectPtr)):
+      return libpython.int_from_int(pyop.field('ob_size'))
+    if isinstance(pyop, libpython.PyDictObjectPtr):
+      return libpython.int_from_int(pyop.field('ma_used'))
+    if isinstance(pyop, libpython.PySetObjectPtr):
+      return libpython.int_from_int(pyop.field('used'))
+    return None
+
+  def _Entries(self, pyop, cursor):
+    """Iterates over a container, unlike libpython without a size limit.
+
+    Args:
+      pyop: The container.
+      cursor: Where to start, 0 or a cursor yielded earlier.
+    Yields:
+      (cursor, key, item) tuples, cursor being where to continue after the
+      item. key is the gdb.Value of a dict's key, and None for other
+      containers. item is the gdb.Value of the value or member.
+    """
+    if isinstance(pyop, (libpython.PyListObjectPtr,
+                         libpython.PyTupleObjectPtr)):
+      for i in xrange(cursor, self._Length(pyop)):
+        yield i + 1, None, pyop[i]
+    elif isinstance(pyop, libpython.PyDictObjectPtr):
+      table = pyop.field('ma_table')
+      mask = libpython.int_from_int(pyop.field('ma_mask'))
+      for i in xrange(cursor, mask + 1):
+        entry = table[i]
+        if long(entry['me_value']):
+          yield i + 1, entry['me_key'], entry['me_value']
+    elif isinstance(pyop, libpython.PySetObjectPtr):
+      table = pyop.field('table')
+      mask = libpython.int_from_int(pyop.field('mask'))
+      for i in xrange(cursor, mask + 1):
+        key = table[i]['key']
+        if not long(key):
+          continue
+        member = libpython.PyObjectPtr.from_pyobject_ptr(key)
+        if (isinstance(member, libpython.PyStringObjectPtr)
+            and str(member) == '<dummy key>'):
+          continue
+        yield i + 1, None, key
+
+  def _DictLookup(self, dict_pyop, key):
+    """Returns the PyObjectPtr stored under key in a remote dict, or None.
+
+    Keys whose hash _ObjectReader.KeyHash knows are looked up like lookdict()
+    does, reading only the entries along their probe sequence. Others are
+    compared with every key of the dict.
+    """
+    reader = _ObjectReader()
+    key_hash = reader.KeyHash(key)
+    if key_hash is not None:
+      for entry_key, value in reader.DictProbe(dict_pyop.as_address(),
+                                               key_hash):
+        entry_key = self._PyObjectAt(entry_key)
+        if (isinstance(entry_key, _HANDLE_VALUE_PTRS)
+            and entry_key.proxyval(set()) == key):
+          return self._PyObjectAt(value)
+      return None
+    for _, entry_key, value in self._Entries(dict_pyop, 0):
+      if self._ShouldStop():
+        break
+      entry_key = libpython.PyObjectPtr.from_pyobject_ptr(entry_key)
+      if (isinstance(entry_key, _HANDLE_VALUE_PTRS)
+          and entry_key.proxyval(set()) == key):
+        return libpython.PyObjectPtr.from_pyobject_ptr(value)
+    return None
+
+  def _LookupVar(self, position, var_name):
+    """Like LookupInFrame, but without libpython's size limit on dicts.
+
+    Returns:
+      The variable's value as a libpython.PyObjectPtr, or None if there's no
+      such variable.
+    """
+    self.EnsureGdbPosition(*position)
+    frame = PyFrameObjectPtr(self.selected_frame)
+    for pyop_name, pyop_value in frame.iter_locals():
+      if pyop_name.proxyval(set()) == var_name:
+        return pyop_value
+    for scope in ('f_globals', 'f_builtins'):
+      scope_dict = libpython.PyObjectPtr.from_pyobject_ptr(frame.field(scope))
+      value = self._DictLookup(scope_dict, var_name)
+      if value is not None:
+        return value
+    return None
+
+  def _NameError(self, var_name):
+    return {'error': 'NameError',
+            'message': "name '%s' is not defined" % var_name}
+
+  def HandleLookup(self, position, var_name):
+    """Looks up a variable in the selected frame, returning a handle."""
+    value = self._LookupVar(position, var_name)
+    if value is None:
+      return self._NameError(var_name)
+    return self._Describe(value)
+
+  def HandleAttr(self, address, name):
+    """Looks up an attribute of the object at address.
+
+    Like libpython, this only looks at instance and class dicts, and ignores
+    descriptors.
+    """
+    pyop = self._PyObjectAt(address)
+    if isinstance(pyop, libpython.PyInstanceObjectPtr):
+      dicts = [pyop.pyop_field('in_dict')]
+      classes = [pyop.pyop_field('in_class')]
+      while classes:
+        cls = classes.pop(0)
+        dicts.append(cls.pyop_field('cl_dict'))
+        bases = cls.pyop_field('cl_bases')
+        classes.extend(libpython.PyObjectPtr.from_pyobject_ptr(base)
+                       for _, _, base in self._Entries(bases, 0))
+    else:
+      attr_dict = libpython.HeapTypeObjectPtr(pyop._gdbval).get_attr_dict()  # pylint: disable=protected-access
+      dicts = [attr_dict] if attr_dict else []
+      mro = pyop.type().field('tp_mro')
+      if long(mro):
+        for _, _, cls in self._Entries(
+            libpython.PyObjectPtr.from_pyobject_ptr(mro), 0):
+          dicts.append(libpython.PyObjectPtr.from_pyobject_ptr(
+              cls.cast(GdbCache.TYPE)['tp_dict']))
+    for attr_dict in dicts:
+      if not isinstance(attr_dict, libpython.PyDictObjectPtr):
+        continue
+      value = self._DictLookup(attr_dict, name)
+      if value is not None:
+        return self._Describe(value)
+    return {'error': 'AttributeError',
+            'message': "'%s' object has no attribute '%s'" % (
+                pyop.safe_tp_name(), name)}
+
+  def HandleItem(self, address, key):
+    """Returns the item stored under key in the container at address."""
+    pyop = self._PyObjectAt(address)
+    if isinstance(pyop, libpython.PyDictObjectPtr):
+      value = self._DictLookup(pyop, key)
+      if value is not None:
+        return self._Describe(value)
+      return {'error': 'KeyError', 'message': repr(key)}
+    if (isinstance(pyop, (libpython.PyListObjectPtr,
+                          libpython.PyTupleObjectPtr))
+        and isinstance(key, (int, long))):
+      length = self._Length(pyop)
+      index = key + length if key < 0 else key
+      if 0 <= index < length:
+        return self._Describe(libpython.PyObjectPtr.from_pyobject_ptr(
+            pyop[index]))
+      return {'error': 'IndexError', 'message': 'index out of range'}
+    return {'error': 'TypeError',
+            'message': 'cannot index %r object with %r' % (pyop.safe_tp_name(),
+                                                          key)}
+
+  def HandleItems(self, address, cursor, count):
+    """Returns up to count items of the container at address.
+
+    Returns:
+      {'items': <descriptions>, 'next': <cursor>}, the cursor being None after
+      the last item. The items of dicts are [key, value] pairs.
+    """
+    pyop = self._PyObjectAt(address)
+    if self._Length(pyop) is None:
+      return {'error': 'TypeError',
+              'message': '%r object is not iterable' % pyop.safe_tp_name()}
+    items = []
+    next_cursor = None
+    for next_cursor, key, value in self._Entries(pyop, cursor):
+      value = self._Describe(libpython.PyObjectPtr.from_pyobject_ptr(value))
+      if key is None:
+        items.append(value)
+      else:
+        items.append([self._Describe(
+            libpython.PyObjectPtr.from_pyobject_ptr(key)), value])
+      if len(items) >= count or self._ShouldStop():
+        break
+    else:
+      next_cursor = None
+    return {'items': items, 'next': next_cursor}
+
+  def LookupGraph(self, position, var_name):
+    """Like LookupInFrame, but preserving shared objects and cycles."""
+    self.EnsureGdbPosition(*position)
+    frame = PyFrameObjectPtr(self.selected_frame)
+    return _GraphEncoder(self).Encode(
+        {var_name: frame.get_var_by_name(var_name)[0]})
+
+  def InferiorLocalsGraph(self, position):
+    """Like InferiorLocals, but preserving shared objects and cycles."""
+    self.EnsureGdbPosition(*position)
+    frame = PyFrameObjectPtr(self.selected_frame)
+    roots = {}
+    for name, value in frame.iter_locals():
+      roots[name.proxyval(set())] = value
+    return _GraphEncoder(self).Encode(roots)
+
+  def HandleValue(self, address):
+    """Retrieves the object at address as a whole."""
+    return {'value': self._PyObjectAt(address)}
+
+  # The following functions look at how much memory objects use and what
+  # they're made up of, reading the inferior's memory in bulk (see
+  # _ObjectReader). They take objects by variable name or address, and report
+  # errors like the handle functions do.
+
+  def _Preview(self, address):
+    """Retrieves a small part of an object, see SUMMARY_PREVIEW_LIMITS."""
+    call = self._call
+    limits = call.limits
+    call.limits = SUMMARY_PREVIEW_LIMITS
+    try:
+      return self._LimitedValue(self._PyObjectAt(address), 0)
+    finally:
+      call.limits = limits
+
+  def _TypeHistogram(self, reader, counts):
+    """Turns {type address: count} into [[type name, count], ...].
+
+    The list is sorted by count, with all but the SUMMARY_TYPES most common
+    types added up as '(other)'.
+    """
+    by_name = {}
+    for type_address, count in counts.iteritems():
+      name = reader.TypeInfo(type_address).name
+      by_name[name] = by_name.get(name, 0) + count
+    histogram = sorted(([name, count] for name, count in by_name.iteritems()),
+                       key=lambda entry: -entry[1])
+    if len(histogram) > SUMMARY_TYPES:
+      other = sum(count for _, count in histogram[SUMMARY_TYPES:])
+      histogram = histogram[:SUMMARY_TYPES] + [['(other)', other]]
+    return histogram
+
+  def _Summary(self, pyop, preview):
+    """Summarizes an object without retrieving it, see inferior.Summary."""
+    reader = _ObjectReader()
+    summary = {'address': pyop.as_address(), 'type': pyop.safe_tp_name(),
+               'size': reader.SizeOf(pyop.as_address())}
+    length = self._Length(pyop)
+    if length is None:
+      summary['preview'] = self._Preview(pyop.as_address())
+      return summary
+    key_counts = {}
+    item_counts = {}
+    items_size = 0
+    scanned = 0
+    previews = []
+    for key, item in reader.Entries(pyop.as_address()):
+      if self._ShouldStop():
+        break
+      scanned += 1
+      item_type = reader.TypeOf(item)
+      item_counts[item_type] = item_counts.get(item_type, 0) + 1
+      items_size += reader.SizeOf(item, item_type)
+      if key:
+        key_type = reader.TypeOf(key)
+        key_counts[key_type] = key_counts.get(key_type, 0) + 1
+        items_size += reader.SizeOf(key, key_type)
+      if len(previews) < preview:
+        if key:
+          previews.append([self._Preview(key), self._Preview(item)])
+        else:
+          previews.append(self._Preview(item))
+    summary.update({'len': length, 'scanned': scanned,
+                    'items_size': items_size, 'preview': previews,
+                    'types': self._TypeHistogram(reader, item_counts)})
+    if isinstance(pyop, libpython.PyDictObjectPtr):
+      summary['key_types'] = self._TypeHistogram(reader, key_counts)
+    return summary
+
+  def Summary(self, position, var_name, preview):
+    """Summarizes a variable of the selected frame, see inferior.Summary."""
+    value = self._LookupVar(position, var_name)
+    if value is None:
+      return self._NameError(var_name)
+    return self._Summary(value, preview)
+
+  def HandleSummary(self, address, preview):
+    """Summarizes the object at address, see inferior.Summary."""
+    return self._Summary(self._PyObjectAt(address), preview)
+
+  def _DictHealth(self, pyop, collisions):
+    """Analyzes a dict's hash table, see inferior.DictHealth."""
+    if not isinstance(pyop, libpython.PyDictObjectPtr):
+      return {'error': 'TypeError',
+              'message': '%s is not a dict' % pyop.safe_tp_name()}
+    reader = _ObjectReader()
+    mask = libpython.int_from_int(pyop.field('ma_mask'))
+    size_mask = (1 << (8 * reader.word)) - 1
+    probe_counts = [0] * (DICT_HEALTH_MAX_PROBES + 1)
+    probe_total = probe_max = 0
+    dummies = 0
+    hash_counts = {}
+    for slot, (entry_hash, key, value) in enumerate(
+        reader.DictSlots(pyop.as_address())):
+      if self._ShouldStop():
+        break
+      if not value:
+        if key:
+          dummies += 1
+        continue
+      hash_counts[entry_hash] = hash_counts.get(entry_hash, 0) + 1
+      # Follow lookdict()'s probe sequence until it gets to this entry.
+      i = perturb = entry_hash
+      probes = 1
+      while i & mask != slot and probes <= mask:
+        i = (5 * i + perturb + 1) & size_mask
+        perturb >>= PERTURB_SHIFT
+        probes += 1
+      probe_counts[min(probes, DICT_HEALTH_MAX_PROBES)] += 1
+      probe_total += probes
+      probe_max = max(probe_max, probes)
+    scanned = sum(probe_counts)
+    colliding = sorted((entry_hash for entry_hash, count
+                        in hash_counts.iteritems() if count > 1),
+                       key=lambda entry_hash: -hash_counts[entry_hash])
+    colliding = colliding[:collisions]
+    samples = dict((entry_hash, []) for entry_hash in colliding)
+    if samples:
+      for entry_hash, key, value in reader.DictSlots(pyop.as_address()):
+        if (value and entry_hash in samples
+            and len(samples[entry_hash]) < DICT_HEALTH_SAMPLE_KEYS):
+          samples[entry_hash].append(self._Preview(key))
+    used = libpython.int_from_int(pyop.field('ma_used'))
+    fill = libpython.int_from_int(pyop.field('ma_fill'))
+    return {
+        'address': pyop.as_address(),
+        'used': used,
+        'fill': fill,
+        'mask': mask,
+        'dummies': dummies,
+        'load': float(fill) / (mask + 1),
+        'table_size': reader.SizeOf(pyop.as_address()),
+        'scanned': scanned,
+        'probe_mean': float(probe_total) / scanned if scanned else 0,
+        'probe_max': probe_max,
+        'probe_histogram': [[probes, count] for probes, count
+                            in enumerate(probe_counts) if count],
+        'distinct_hashes': len(hash_counts),
+        'collisions': [{'hash': reader.Signed(entry_hash),
+                        'count': hash_counts[entry_hash],
+                        'keys': samples[entry_hash]}
+                       for entry_hash in colliding],
+    }
+
+  def DictHealth(self, position, var_name, collisions):
+    """Analyzes the hash table of a dict in the selected frame."""
+    value = self._LookupVar(position, var_name)
+    if value is None:
+      return self._NameError(var_name)
+    return self._DictHealth(value, collisions)
+
+  def HandleDictHealth(self, address, collisions):
+    """Analyzes the hash table of the dict at address."""
+    return self._DictHealth(self._PyObjectAt(address), collisions)
+
+  def HeapCensus(self, position, contents, top, sort):
+    """Counts the objects in the heap and the bytes they take up, by type.
+
+    This walks the gc generations, so on its own it only sees the objects
+    the gc tracks: containers, instances, frames and the like, but not e.g.
+    strs and ints.
+    Args:
+      position: The inferior to look at.
+      contents: Whether to count the objects the gc doesn't track, too, as
+        far as they are held by lists, tuples, dicts, sets or instance
+        __dict__s. Each is counted once, however often it is referred to.
+      top: How many types to report, or None for all of them.
+      sort: 'bytes' or 'count', what to sort the types by.
+    Returns:
+      A dict of
+      * 'objects', 'bytes': The totals.
+      * 'tracked': How many of the objects the gc tracks.
+      * 'types': [[type address, type name, count, bytes], ...], sorted.
+    """
+    self.EnsureGdbPosition(position[0], None, None)
+    reader = _ObjectReader()
+    counts = {}
+    tracked = 0
+    seen = set()
+    pending = []
+    for address, type_address in reader.Tracked():
+      if self._ShouldStop():
+        break
+      tracked += 1
+      pending.append((address, type_address))
+      while pending:
+        address, type_address = pending.pop()
+        count = counts.get(type_address)
+        if count is None:
+          count = counts[type_address] = [0, 0]
+        count[0] += 1
+        count[1] += reader.SizeOf(address, type_address)
+        if not contents:
+          continue
+        for referent in reader.References(address, type_address):
+          if referent in seen:
+            continue
+          seen.add(referent)
+          referent_type = reader.TypeOf(referent)
+          if not reader.IsTracked(referent, referent_type):
+            pending.append((referent, referent_type))
+    index = 3 if sort == 'bytes' else 2
+    types = sorted(([type_address, reader.TypeInfo(type_address).name]
+                    + count for type_address, count in counts.iteritems()),
+                   key=lambda entry: -entry[index])
+    return {'objects': sum(count for count, _ in counts.itervalues()),
+            'bytes': sum(size for _, size in counts.itervalues()),
+            'tracked': tracked,
+            'types': types[:top] if top else types}
+
+  def _HeapGraph(self, epoch):
+    """Returns the _HeapGraph of the current stop, building it if need be.
+
+    Args:
+      epoch: The client's stop epoch, which identifies the current stop. A
+        complete graph is reused for as long as the epoch stays the same.
+    """
+    if self._heap_graph and self._heap_graph[0] == epoch:
+      return self._heap_graph[1]
+    graph = _HeapGraph(self, _ObjectReader())
+    self._heap_graph = (epoch, graph) if graph.complete else None
+    return graph
+
+  def _HeapRoots(self):
+    """Returns {address: description} of the objects that are always alive.
+
+    These are the modules, sys and builtins dicts of every interpreter, and
+    the frames and thread-local dicts of all their threads.
+    """
+    roots = {}
+    for interp in self._IterateChainedList(GdbCache.INTERP_HEAD, 'next'):
+      for field, description in (('modules', 'sys.modules'),
+                                 ('sysdict', 'sys.__dict__'),
+                                 ('builtins', '__builtins__')):
+        if long(interp[field]):
+          roots.setdefault(long(interp[field]), description)
+      for tstate in self._IterateChainedList(interp['tstate_head'], 'next'):
+        thread_id = self._UnpackGdbVal(tstate['thread_id'])
+        frames = list(self._IterateChainedList(tstate['frame'], 'f_back'))
+        frames.reverse()
+        for depth, frame in enumerate(frames):
+          name = self._Preview(long(frame['f_code']['co_name']))
+          roots.setdefault(long(frame), 'thread %d, frame %d (%s)' % (
+              thread_id, depth, name))
+        if long(tstate['dict']):
+          roots.setdefault(long(tstate['dict']),
+                           'thread %d, thread-local dict' % thread_id)
+    return roots
+
+  def _FrameVarNames(self, reader, frame):
+    """Returns the names of a frame's local, cell and free variables."""
+    code = long(gdb.Value(frame).cast(
+        gdb.lookup_type('PyFrameObject').pointer())['f_code'])
+    names = []
+    offsets = _Offsets('PyCodeObject')
+    for field in ('co_varnames', 'co_cellvars', 'co_freevars'):
+      names_tuple = reader.Word(code + offsets[field])
+      if names_tuple:
+        names.extend(self._Preview(name)
+                     for _, name in reader.Entries(names_tuple))
+    return names
+
+  def _EdgeLabel(self, reader, source, target):
+    """Returns how the object at source refers to the one at target.
+
+    Returns:
+      Python-like syntax for getting from source to target, such as '[3]',
+      "['key']" or '.__dict__', '(key)' if target is a key of the dict at
+      source, '(member)' if it's in the set at source, '' if none of these.
+    """
+    type_address = reader.TypeOf(source)
+    info = reader.TypeInfo(type_address)
+    if info.kind:
+      for i, (key, item) in enumerate(reader.Entries(source, type_address)):
+        if item == target:
+          if info.kind == 'set':
+            return '(member)'
+          if info.kind == 'dict':
+            return '[%r]' % (self._Preview(key),)
+          return '[%d]' % i
+        if key == target:
+          return '(key)'
+    if (info.dictoffset > 0
+        and reader.Word(source + info.dictoffset) == target):
+      return '.__dict__'
+    for name, offset in reader.Fields(info.name):
+      if reader.Word(source + offset) == target:
+        return '.' + _FIELD_ATTRS.get(name, name)
+    if info.name == 'frame':
+      for name, value in itertools.izip(self._FrameVarNames(reader, source),
+                                        reader.FrameSlots(source)):
+        if value == target:
+          return '.f_locals[%r]' % (name,)
+    return ''
+
+  def _Referrers(self, pyop, epoch, limit):
+    """Finds the objects referring to an object, see inferior.Referrers."""
+    graph = self._HeapGraph(epoch)
+    reader = _ObjectReader()
+    address = pyop.as_address()
+    i = graph.Id(address)
+    referrers = graph.Referrers(i) if i is not None else ()
+    roots = self._HeapRoots()
+    result = []
+    for referrer in sorted(set(referrers))[:limit]:
+      referrer = graph.addresses[referrer]
+      entry = {'address': referrer,
+               'type': reader.TypeInfo(reader.TypeOf(referrer)).name,
+               'label': self._EdgeLabel(reader, referrer, address)}
+      if referrer in roots:
+        entry['root'] = roots[referrer]
+      result.append(entry)
+    return {'address': address,
+            'referrers': result,
+            'count': len(set(referrers)),
+            'complete': graph.complete}
+
+  def Referrers(self, position, var_name, epoch, limit):
+    """Finds the referrers of a variable of the selected frame."""
+    value = self._LookupVar(position, var_name)
+    if value is None:
+      return self._NameError(var_name)
+    return self._Referrers(value, epoch, limit)
+
+  def HandleReferrers(self, address, epoch, limit):
+    """Finds the referrers of the object at address."""
+    return self._Referrers(self._PyObjectAt(address), epoch, limit)
+
+  def _PathToRoot(self, pyop, epoch):
+    """Finds out what keeps an object alive, see inferior.PathToRoot."""
+    graph = self._HeapGraph(epoch)
+    reader = _ObjectReader()
+    address = pyop.as_address()
+    roots = self._HeapRoots()
+    start = graph.Id(address)
+    # Breadth-first over the referrers, so the path found is a shortest one.
+    parents = {start: None}
+    queue = collections.deque([start] if start is not None else [])
+    root = None
+    while queue:
+      i = queue.popleft()
+      if graph.addresses[i] in roots:
+        root = i
+        break
+      for referrer in graph.Referrers(i):
+        if referrer not in parents:
+          parents[referrer] = i
+          queue.append(referrer)
+    path = []
+    if root is None:
+      root_address = address if address in roots else None
+    else:
+      root_address = graph.addresses[root]
+      i = root
+      while parents[i] is not None:
+        source, target = graph.addresses[i], graph.addresses[parents[i]]
+        path.append({'address': target,
+                     'type': reader.TypeInfo(reader.TypeOf(target)).name,
+                     'label': self._EdgeLabel(reader, source, target)})
+        i = parents[i]
+    return {'address': address,
+            'root': roots.get(root_address),
+            'root_address': root_address,
+            'path': path,
+            'complete': graph.complete}
+
+  def PathToRoot(self, position, var_name, epoch):
+    """Finds what keeps a variable of the selected frame alive."""
+    value = self._LookupVar(position, var_name)
+    if value is None:
+      return self._NameError(var_name)
+    return self._PathToRoot(value, epoch)
+
+  def HandlePathToRoot(self, address, epoch):
+    """Finds what keeps the object at address alive."""
+    return self._PathToRoot(self._PyObjectAt(address), epoch)
+
+  def _TreePath(self, reader, graph, order, parent, roots, k):
+    """Describes how to get to the object at order[k] from its root.
+
+    Returns:
+      Python-like syntax for the chain of references in the breadth-first
+      tree of _HeapGraph.Dominators, e.g. "sys.modules['app'].cache[3]".
+    """
+    labels = []
+    while parent[k]:
+      labels.append(self._EdgeLabel(reader, graph.addresses[order[parent[k]]],
+                                    graph.addresses[order[k]]) or '.?')
+      k = parent[k]
+    path = roots[graph.addresses[order[k]]]
+    for label in reversed(labels):
+      match = _ATTR_LABEL.match(label)
+      if match and path.endswith('.__dict__'):
+        path = path[:-len('__dict__')] + match.group(1)
+      else:
+        path += label
+    return path
+
+  def RetainedSizes(self, position, epoch, top):
+    """Finds the objects that keep the most memory alive.
+
+    Args:
+      position: The inferior to look at.
+      epoch: The client's stop epoch, see _HeapGraph.
+      top: How many objects to report.
+    Returns:
+      A dict of
+      * 'objects', 'bytes': The number of objects reachable from the roots
+        (see _HeapRoots) and the bytes they take up.
+      * 'unreachable', 'unreachable_bytes': The same for the other objects,
+        which only C code (or nothing) refers to.
+      * 'largest': A list of {'address', 'type', 'size', 'retained', 'path'}
+        of the objects with the largest retained sizes, i.e. the bytes taken
+        up by the objects only reachable through them, themselves included.
+        path is how to get to the object from a root.
+      * 'complete': False if the scan of the heap or the dominator tree was
+        cut short, in which case the retained sizes are approximations.
+    """
+    self.EnsureGdbPosition(position[0], None, None)
+    graph = self._HeapGraph(epoch)
+    reader = _ObjectReader()
+    roots = self._HeapRoots()
+    root_ids = [i for i in (graph.Id(address) for address in sorted(roots))
+                if i is not None]
+    order, parent, idom, complete = graph.Dominators(root_ids,
+                                                     self._ShouldStop)
+    retained = graph.Retained(order, idom)
+    largest = []
+    for k in graph.Largest(retained, top):
+      address = graph.addresses[order[k]]
+      largest.append({
+          'address': address,
+          'type': reader.TypeInfo(reader.TypeOf(address)).name,
+          'size': graph.sizes[order[k]],
+          'retained': retained[k],
+          'path': self._TreePath(reader, graph, order, parent, roots, k)})
+    total = sum(graph.sizes)
+    return {'objects': len(order) - 1,
+            'bytes': retained[0],
+            'unreachable': len(graph) - len(order) + 1,
+            'unreachable_bytes': total - retained[0],
+            'largest': largest,
+            'complete': graph.complete and complete}
+
+  def DuplicateStrings(self, position, epoch, top):
+    """Finds the strs and unicodes that exist as several equal objects.
+
+    The strings are those in the heap graph, see _HeapGraph. Their contents
+    are reduced to hashes in one pass, which are then counted in passes over
+    a part of the hashes each, so the counters take up bounded memory even
+    for many millions of distinct strings.
+    Args:
+      position: The inferior to look at.
+      epoch: The client's stop epoch, see _HeapGraph.
+      top: How many of the most wasteful duplicated strings to report.
+    Returns:
+      A dict of
+      * 'strings', 'bytes': The number of strs and unicodes, and the bytes
+        they take up.
+      * 'distinct': The number of different values among them.
+      * 'wasted': The bytes taken up by all but one object of each value.
+      * 'duplicates': A list of {'address', 'type', 'value', 'count', 'size',
+        'wasted', 'interned'} of the values wasting the most bytes, where
+        address is one of the objects, value a preview of it, size the
+        bytes one object takes up and interned whether one of them is.
+      * 'complete': False if the heap or its strings were not all scanned.
+    """
+    self.EnsureGdbPosition(position[0], None, None)
+    graph = self._HeapGraph(epoch)
+    reader = _ObjectReader()
+    ids = array.array('l')
+    hashes = array.array('l')
+    sizes = array.array('L')
+    interned = array.array('b')
+    complete = graph.complete
+    for i, address in enumerate(graph.addresses):
+      if self._ShouldStop():
+        complete = False
+        break
+      type_address = reader.TypeOf(address)
+      located = reader.StringBuffer(address, type_address)
+      if located is None:
+        continue
+      characters, length, size, is_interned = located
+      if length <= BULK_READ_SIZE:
+        content_hash = hash(reader.Bytes(characters, length))
+      else:
+        content_hash = hash(tuple(
+            hash(reader.Bytes(characters + start,
+                              min(BULK_READ_SIZE, length - start)))
+            for start in xrange(0, length, BULK_READ_SIZE)))
+      ids.append(i)
+      # strs and unicodes of the same characters are different values.
+      hashes.append(hash((type_address, length, content_hash)))
+      sizes.append(size)
+      interned.append(is_interned)
+    passes = len(hashes) // DUPLICATE_STRINGS_PER_PASS + 1
+    distinct = wasted = 0
+    largest = []
+    for part in xrange(passes):
+      # {hash: [count, index of the first string, number interned]}
+      counts = {}
+      for j, content_hash in enumerate(hashes):
+        if content_hash % passes != part:
+          continue
+        count = counts.get(content_hash)
+        if count is None:
+          counts[content_hash] = [1, j, interned[j]]
+        else:
+          count[0] += 1
+          count[2] += interned[j]
+      distinct += len(counts)
+      duplicates = []
+      for count, j, interned_count in counts.itervalues():
+        if count > 1:
+          wasted += (count - 1) * sizes[j]
+          duplicates.append(((count - 1) * sizes[j], count, j, interned_count))
+      del counts
+      largest = heapq.nlargest(top, largest + duplicates)
+    result = []
+    for waste, count, j, interned_count in largest:
+      address = graph.addresses[ids[j]]
+      result.append({'address': address,
+                     'type': reader.TypeInfo(reader.TypeOf(address)).name,
+                     'value': self._Preview(address),
+                     'count': count,
+                     'size': sizes[j],
+                     'wasted': waste,
+                     'interned': bool(interned_count)})
+    return {'strings': len(hashes),
+            'bytes': sum(sizes),
+            'distinct': distinct,
+            'wasted': wasted,
+            'duplicates': result,
+            'complete': complete}
+
+  def _StringPayloads(self, reader, graph):
+    """Yields (number, chunks) of the characters of the strings in graph."""
+    for i, (address, type_address) in enumerate(
+        itertools.izip(graph.addresses, graph.types)):
+      if self._ShouldStop():
+        return
+      if not type_address:
+        continue
+      located = reader.StringBuffer(address, type_address)
+      if located is None:
+        continue
+      characters, length, _, _ = located
+      yield i, (reader.Bytes(characters + start,
+                             min(BULK_READ_SIZE, length - start))
+                for start in xrange(0, length, BULK_READ_SIZE))
+
+  def DumpHeap(self, position, epoch, path, payloads):
+    """Writes the heap graph to a file, see heapgraph.WriteDump.
+
+    Args:
+      position: The inferior to look at.
+      epoch: The client's stop epoch, see _HeapGraph.
+      path: The file to write.
+      payloads: Whether to include the characters of strs and unicodes.
+    Returns:
+      A dict of 'path', the number of 'objects' and 'references' dumped, the
+      'bytes' written and whether the dump is 'complete'.
+    """
+    self.EnsureGdbPosition(position[0], None, None)
+    graph = self._HeapGraph(epoch)
+    reader = _ObjectReader()
+    type_names = dict((type_address, reader.TypeInfo(type_address).name)
+                      for type_address in set(graph.types) if type_address)
+    info = {'pid': position[0], 'time': time.time(),
+            'complete': graph.complete, 'word': reader.word}
+    with open(path, 'wb') as out:
+      heapgraph.WriteDump(
+          out, graph, type_names, self._HeapRoots(), info,
+          self._StringPayloads(reader, graph) if payloads else ())
+      size = out.tell()
+    return {'path': path,
+            'objects': len(graph),
+            'references': len(graph.references),
+            'bytes': size,
+            'complete': graph.complete and not self._call.truncated}
+
+  def _DumpBuffer(self, pyop, path):
+    """Writes the contents of an object to a file, see inferior.DumpBuffer."""
+    reader = _ObjectReader()
+    address = pyop.as_address()
+    located = reader.RawBuffer(address, reader.TypeOf(address))
+    if located is None:
+      return {'error': 'TypeError',
+              'message': '%s objects have no buffer to dump' % (
+                  pyop.safe_tp_name())}
+    data, length, typecode = located
+    return {'address': address,
+            'type': pyop.safe_tp_name(),
+            'path': path,
+            'bytes': self._WriteMemory(reader, data, length, path),
+            'length': length,
+            'typecode': typecode}
+
+  def _WriteMemory(self, reader, address, length, path):
+    """Copies length bytes of the inferior's memory to a file, in chunks.
+
+    Returns:
+      How many bytes were written, fewer than length if time ran out.
+    """
+    written = 0
+    with open(path, 'wb') as out:
+      for start in xrange(0, length, BULK_READ_SIZE):
+        if self._ShouldStop():
+          break
+        count = min(BULK_READ_SIZE, length - start)
+        out.write(reader.Raw(address + start, count))
+        written += count
+    return written
+
+  def DumpBuffer(self, position, var_name, path):
+    """Writes the contents of a variable of the selected frame to a file."""
+    value = self._LookupVar(position, var_name)
+    if value is None:
+      return self._NameError(var_name)
+    return self._DumpBuffer(value, path)
+
+  def HandleDumpBuffer(self, address, path):
+    """Writes the contents of the object at address to a file."""
+    return self._DumpBuffer(self._PyObjectAt(address), path)
+
+  def _NdArray(self, pyop, path):
+    """Writes the elements of a numpy array to a file, see inferior.NdArray."""
+    reader = _ObjectReader()
+    address = pyop.as_address()
+    located = reader.NdArray(address, reader.TypeOf(address))
+    if located is None:
+      return {'error': 'TypeError',
+              'message': '%s objects are not numpy arrays' % (
+                  pyop.safe_tp_name())}
+    if located.structured or located.kind not in _NUMPY_KINDS:
+      return {'error': 'TypeError',
+              'message': 'cannot transfer numpy arrays of %s' % (
+                  'structured dtypes' if located.structured else
+                  "dtype kind '%s'" % located.kind)}
+    byteorder = located.byteorder
+    if byteorder == '=':
+      byteorder = '<' if sys.byteorder == 'little' else '>'
+    # numpy counts the size of unicodes in (UCS4) characters.
+    dtype = '%s%s%d' % (byteorder, located.kind,
+                        located.itemsize // 4 if located.kind == 'U'
+                        else located.itemsize)
+    # The elements of a view needn't be contiguous, or in order. What gets
+    # written is the memory from the lowest to the highest of them.
+    low = high = located.data
+    if 0 not in located.shape:
+      for count, stride in zip(located.shape, located.strides):
+        low += min(0, (count - 1) * stride)
+        high += max(0, (count - 1) * stride)
+      high += located.itemsize
+    return {'address': address,
+            'type': pyop.safe_tp_name(),
+            'dtype': dtype,
+            'shape': located.shape,
+            'strides': located.strides,
+            'offset': located.data - low,
+            'path': path,
+            'bytes': self._WriteMemory(reader, low, high - low, path),
+            'length': high - low}
+
+  def NdArray(self, position, var_name, path):
+    """Writes the elements of a numpy array in the selected frame to a file."""
+    value = self._LookupVar(position, var_name)
+    if value is None:
+      return self._NameError(var_name)
+    return self._NdArray(value, path)
+
+  def HandleNdArray(self, address, path):
+    """Writes the elements of the numpy array at address to a file."""
+    return self._NdArray(self._PyObjectAt(address), path)
 
 if __name__ == '__main__':
 
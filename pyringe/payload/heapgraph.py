@@ -0,0 +1,498 @@
+#! /usr/bin/env python
+#
+# Copyright 2014 Google Inc.  All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""The graph of references between the objects of a heap, and heap dumps.
+
+This module doesn't depend on gdb, so that the heap dumps gdb_service.py
+writes can be analyzed offline by the same code that analyzes the live heap.
+
+A heap dump is a file starting with a header of MAGIC, the format version and
+the number of sections, followed by a table of (name, offset, length) of every
+section. All integers are little-endian and 64 bits wide. The sections are:
+* 'info': 'key\\tvalue' lines, e.g. the pid and time of the dump.
+* 'addresses', 'types', 'sizes': Per object, ordered by address: its address,
+  the index of its type in the type table and how many bytes it takes up.
+* 'reference_start', 'references', 'referrer_start', 'referrers': The
+  references between the objects as in Graph, by object index.
+* 'type_addresses', 'type_names': The type table, the names one per line.
+* 'root_ids', 'root_names': The roots, see Graph.Dominators.
+* 'payload_ids', 'payload_start', 'payloads': The contents of some objects
+  (strings, for instance), those of the object payload_ids[j] are at
+  payload_start[j]:payload_start[j + 1] of payloads.
+Dump maps the file into memory, and reads only what it's asked for.
+"""
+
+import array
+import bisect
+import heapq
+import itertools
+import mmap
+import struct
+import sys
+
+MAGIC = 'PYRINGE-HEAPDUMP'
+VERSION = 1
+_HEADER = struct.Struct('<16sII')
+_SECTION = struct.Struct('<16sQQ')
+# How many integers are converted to or from bytes at a time.
+_CHUNK_SIZE = 1 << 16
+_SECTIONS = ('info', 'addresses', 'types', 'sizes', 'reference_start',
+             'references', 'referrer_start', 'referrers', 'type_addresses',
+             'type_names', 'root_ids', 'root_names', 'payloads', 'payload_ids',
+             'payload_start')
+# Whether arrays of type 'l' already have the layout of the dump's integers.
+_NATIVE = array.array('l').itemsize == 8 and sys.byteorder == 'little'
+
+
+def Csr(keys, values, count):
+  """Groups values by key, in arrays.
+
+  Args:
+    keys: array of ints in range(count).
+    values: array of the same length.
+    count: The number of keys.
+  Returns:
+    (start, grouped): The values with key k are grouped[start[k]:start[k+1]].
+  """
+  start = array.array('l', [0]) * (count + 1)
+  for key in keys:
+    start[key + 1] += 1
+  for i in xrange(count):
+    start[i + 1] += start[i]
+  position = array.array('l', start)
+  grouped = array.array(values.typecode, [0]) * len(values)
+  for key, value in itertools.izip(keys, values):
+    grouped[position[key]] = value
+    position[key] += 1
+  return start, grouped
+
+
+class Graph(object):
+  """Who refers to whom among the objects of a heap, in arrays.
+
+  The objects are numbered by their place in the sorted array of their
+  addresses. The references of object i are references[reference_start[i]:
+  reference_start[i + 1]], and its referrers are likewise in referrers.
+
+  Attributes:
+    addresses: array of the addresses of the objects, sorted.
+    types: array of the addresses of the objects' types.
+    sizes: array of the bytes each object takes up.
+    complete: False if the graph lacks objects or references.
+  """
+
+  def __init__(self):
+    self.addresses = self.types = self.sizes = array.array('L')
+    self.reference_start = self.referrer_start = array.array('l', [0])
+    self.references = self.referrers = array.array('l')
+    self.complete = True
+
+  def Build(self, addresses, objects, sources, targets):
+    """Fills in the graph's arrays.
+
+    Args:
+      addresses: The addresses of all objects, in any order.
+      objects: Iterable of (address, type address, size), of all objects or
+        just some of them. The others are given a type and size of 0.
+      sources: array of the addresses of referring objects.
+      targets: array of the addresses they refer to, in the same order.
+    """
+    self.addresses = array.array('L', sorted(addresses))
+    count = len(self.addresses)
+    self.types = array.array('L', [0]) * count
+    self.sizes = array.array('L', [0]) * count
+    for address, type_address, size in objects:
+      i = self.Id(address)
+      self.types[i] = type_address
+      self.sizes[i] = size
+    source_ids = array.array('l', (self.Id(source) for source in sources))
+    target_ids = array.array('l', (self.Id(target) for target in targets))
+    self.reference_start, self.references = Csr(source_ids, target_ids, count)
+    self.referrer_start, self.referrers = Csr(target_ids, source_ids, count)
+
+  def __len__(self):
+    return len(self.addresses)
+
+  def Id(self, address):
+    """Returns the number of the object at address, or None."""
+    i = bisect.bisect_left(self.addresses, address)
+    if i < len(self.addresses) and self.addresses[i] == address:
+      return i
+    return None
+
+  def References(self, i):
+    return self.references[self.reference_start[i]:self.reference_start[i + 1]]
+
+  def Referrers(self, i):
+    return self.referrers[self.referrer_start[i]:self.referrer_start[i + 1]]
+
+  def Dominators(self, roots, should_stop):
+    """Computes the dominator tree of the objects reachable from roots.
+
+    An object dominates another if every chain of references from the roots
+    to the other goes through it, so the other would be freed with it. This
+    is the iterative algorithm of Cooper, Harvey and Kennedy, over the objects
+    in breadth-first order, in which every object comes after its dominators.
+    Args:
+      roots: The numbers of the root objects.
+      should_stop: Called once per object and pass, returns True to settle
+        for the dominators found so far.
+    Returns:
+      (order, parent, idom, complete): order is an array of the numbers of
+      the reachable objects in breadth-first order, preceded by -1 for a
+      virtual root referring to all roots. For the object at order[k],
+      parent[k] is the place in order of the object it was reached from, and
+      idom[k] that of its immediate dominator. complete is False if the
+      computation was cut short, in which case idom is only an approximation.
+    """
+    place = array.array('l', [-1]) * len(self)
+    order = array.array('l', [-1])
+    parent = array.array('l', [0])
+    for i in roots:
+      if place[i] < 0:
+        place[i] = len(order)
+        order.append(i)
+        parent.append(0)
+    k = 1
+    while k < len(order):
+      for i in self.References(order[k]):
+        if place[i] < 0:
+          place[i] = len(order)
+          order.append(i)
+          parent.append(k)
+      k += 1
+    # The path to an object in the breadth-first tree goes through all its
+    # dominators, which makes it a fine starting point.
+    idom = array.array('l', parent)
+    changed = True
+    while changed:
+      changed = False
+      for k in xrange(1, len(order)):
+        if should_stop():
+          return order, parent, idom, False
+        if not parent[k]:
+          continue
+        dominator = parent[k]
+        for i in self.Referrers(order[k]):
+          other = place[i]
+          if other < 0:
+            continue
+          while other != dominator:
+            while other > dominator:
+              other = idom[other]
+            while dominator > other:
+              dominator = idom[dominator]
+        if idom[k] != dominator:
+          idom[k] = dominator
+          changed = True
+    return order, parent, idom, True
+
+  def Retained(self, order, idom):
+    """Returns the retained sizes of the objects, see Dominators.
+
+    Returns:
+      An array of the bytes taken up by the object at order[k] and all
+      objects it dominates, at k. At 0, that of all reachable objects.
+    """
+    retained = array.array('L', (self.sizes[i] if i >= 0 else 0
+                                 for i in order))
+    for k in xrange(len(order) - 1, 0, -1):
+      retained[idom[k]] += retained[k]
+    return retained
+
+  def Largest(self, retained, top):
+    """Returns the places in order of the objects retaining the most bytes."""
+    return heapq.nlargest(top, xrange(1, len(retained)),
+                          key=retained.__getitem__)
+
+
+def _WriteInts(out, values, signed=True):
+  """Writes an array of ints as 64-bit little-endian integers."""
+  code = 'l' if signed else 'L'
+  for start in xrange(0, len(values), _CHUNK_SIZE):
+    chunk = values[start:start + _CHUNK_SIZE]
+    if _NATIVE:
+      out.write(array.array(code, chunk).tostring())
+    else:
+      out.write(struct.pack('<%d%s' % (len(chunk), 'q' if signed else 'Q'),
+                            *chunk))
+
+
+def WriteDump(out, graph, type_names, roots, info, payloads=()):
+  """Writes a heap dump.
+
+  Args:
+    out: The file to write to, opened for writing in binary mode.
+    graph: The Graph of the heap.
+    type_names: {type address: name} of every type in graph.types.
+    roots: {address: description} of the roots, see Graph.Dominators.
+    info: A dict of further information about the dump.
+    payloads: Iterable of (object number, iterable of strs) of the objects
+      whose contents to include, in order of their numbers. The strs are
+      written as they come.
+  """
+  sections = []
+
+  def Section(name, writer, *args):
+    while out.tell() % 8:
+      out.write('\0')
+    offset = out.tell()
+    writer(out, *args)
+    sections.append((name, offset, out.tell() - offset))
+
+  def Write(out, data):
+    out.write(data)
+
+  payload_ids = array.array('l')
+  payload_start = array.array('l', [0])
+
+  def WritePayloads(out):
+    offset = out.tell()
+    for i, chunks in payloads:
+      for chunk in chunks:
+        out.write(chunk)
+      payload_ids.append(i)
+      payload_start.append(out.tell() - offset)
+
+  out.write(_HEADER.pack(MAGIC, VERSION, len(_SECTIONS)))
+  out.write(_SECTION.size * len(_SECTIONS) * '\0')
+  Section('info', Write, ''.join(
+      '%s\t%s\n' % (key, value) for key, value in sorted(info.iteritems())))
+  type_addresses = sorted(type_names)
+  type_ids = dict((address, i) for i, address in enumerate(type_addresses))
+  Section('addresses', _WriteInts, graph.addresses, False)
+  Section('types', _WriteInts, array.array('l', (
+      type_ids.get(type_address, -1) for type_address in graph.types)))
+  Section('sizes', _WriteInts, graph.sizes, False)
+  Section('reference_start', _WriteInts, graph.reference_start)
+  Section('references', _WriteInts, graph.references)
+  Section('referrer_start', _WriteInts, graph.referrer_start)
+  Section('referrers', _WriteInts, graph.referrers)
+  Section('type_addresses', _WriteInts, type_addresses, False)
+  Section('type_names', Write, '\n'.join(type_names[address]
+                                         for address in type_addresses))
+  root_ids = [graph.Id(address) for address in sorted(roots)]
+  Section('root_ids', _WriteInts,
+          [i for i in root_ids if i is not None])
+  Section('root_names', Write, '\n'.join(
+      roots[address].replace('\n', ' ') for address, i
+      in zip(sorted(roots), root_ids) if i is not None))
+  Section('payloads', WritePayloads)
+  Section('payload_ids', _WriteInts, payload_ids)
+  Section('payload_start', _WriteInts, payload_start)
+  assert [name for name, _, _ in sections] == list(_SECTIONS)
+  out.seek(_HEADER.size)
+  for name, offset, length in sections:
+    out.write(_SECTION.pack(name, offset, length))
+  out.seek(0, 2)
+
+
+class _MappedInts(object):
+  """A read-only sequence of the 64-bit integers in a part of a mapped file.
+
+  Items are converted when they are accessed, so looking at a few of them
+  costs next to nothing, however many there are.
+  """
+
+  def __init__(self, data, offset, length, signed=True):
+    self._data = data
+    self._offset = offset
+    self._count = length // 8
+    self._code = 'q' if signed else 'Q'
+
+  def __len__(self):
+    return self._count
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      start, stop, _ = index.indices(self._count)
+      stop = max(start, stop)
+      return struct.unpack_from('<%d%s' % (stop - start, self._code),
+                                self._data, self._offset + 8 * start)
+    if index < 0:
+      index += self._count
+    if not 0 <= index < self._count:
+      raise IndexError(index)
+    return struct.unpack_from('<' + self._code, self._data,
+                              self._offset + 8 * index)[0]
+
+  def __iter__(self):
+    for start in xrange(0, self._count, _CHUNK_SIZE):
+      for value in self[start:start + _CHUNK_SIZE]:
+        yield value
+
+
+class Dump(Graph):
+  """A heap dump written by WriteDump, mapped into memory.
+
+  All of Graph's arrays are _MappedInts reading straight from the file.
+
+  Attributes:
+    info: The dict of further information written along with the dump.
+    type_addresses: The addresses of the types, sorted.
+    type_names: The names of the types, in the same order.
+    roots: {object number: description} of the roots.
+  """
+
+  def __init__(self, path):
+    super(Dump, self).__init__()
+    self._file = open(path, 'rb')
+    self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, count = _HEADER.unpack_from(self._data, 0)
+    if magic != MAGIC:
+      raise ValueError('%s is not a heap dump' % path)
+    if version != VERSION:
+      raise ValueError('%s is a version %d heap dump, not %d' % (
+          path, version, VERSION))
+    self._sections = {}
+    for i in xrange(count):
+      name, offset, length = _SECTION.unpack_from(
+          self._data, _HEADER.size + i * _SECTION.size)
+      self._sections[name.rstrip('\0')] = (offset, length)
+    self.info = dict(line.split('\t', 1) for line
+                     in self._Bytes('info').splitlines())
+    self.complete = self.info.get('complete') == 'True'
+    self.addresses = self._Ints('addresses', signed=False)
+    self.types = self._Ints('types')
+    self.sizes = self._Ints('sizes', signed=False)
+    self.reference_start = self._Ints('reference_start')
+    self.references = self._Ints('references')
+    self.referrer_start = self._Ints('referrer_start')
+    self.referrers = self._Ints('referrers')
+    self.type_addresses = list(self._Ints('type_addresses', signed=False))
+    self.type_names = self._Bytes('type_names').split('\n')
+    self.roots = dict(zip(self._Ints('root_ids'),
+                          self._Bytes('root_names').split('\n')))
+    self._payload_ids = self._Ints('payload_ids')
+    self._payload_start = self._Ints('payload_start')
+
+  def _Bytes(self, name):
+    offset, length = self._sections[name]
+    return self._data[offset:offset + length]
+
+  def _Ints(self, name, signed=True):
+    offset, length = self._sections[name]
+    return _MappedInts(self._data, offset, length, signed)
+
+  def Close(self):
+    self._data.close()
+    self._file.close()
+
+  def __repr__(self):
+    return '<heap dump of %d objects, %d references%s>' % (
+        len(self), len(self.references), '' if self.complete else ' (partial)')
+
+  def TypeName(self, i):
+    """Returns the name of the type of object i."""
+    type_id = self.types[i]
+    return self.type_names[type_id] if type_id >= 0 else '?'
+
+  def Payload(self, i):
+    """Returns the contents of object i as a str, or None if not dumped."""
+    j = bisect.bisect_left(self._payload_ids, i)
+    if j == len(self._payload_ids) or self._payload_ids[j] != i:
+      return None
+    offset = self._sections['payloads'][0]
+    return self._data[offset + self._payload_start[j]:
+                      offset + self._payload_start[j + 1]]
+
+  def _Describe(self, i):
+    entry = {'address': self.addresses[i], 'type': self.TypeName(i)}
+    if i in self.roots:
+      entry['root'] = self.roots[i]
+    return entry
+
+  def HeapCensus(self, top=None, sort='bytes'):
+    """Like Inferior.HeapCensus(contents=True), but of the dump."""
+    counts = {}
+    for type_id, size in itertools.izip(self.types, self.sizes):
+      count = counts.get(type_id)
+      if count is None:
+        count = counts[type_id] = [0, 0]
+      count[0] += 1
+      count[1] += size
+    index = 3 if sort == 'bytes' else 2
+    types = sorted(([self.type_addresses[type_id] if type_id >= 0 else 0,
+                     self.type_names[type_id] if type_id >= 0 else '?']
+                    + count for type_id, count in counts.iteritems()),
+                   key=lambda entry: -entry[index])
+    return {'objects': len(self),
+            'bytes': sum(size for _, size in counts.itervalues()),
+            'types': types[:top] if top else types}
+
+  def FindReferrers(self, address, limit=50):
+    """Like Inferior.Referrers, but of the dump and without labels."""
+    i = self.Id(address)
+    referrers = sorted(set(self.Referrers(i))) if i is not None else []
+    return {'address': address,
+            'referrers': [self._Describe(j) for j in referrers[:limit]],
+            'count': len(referrers),
+            'complete': self.complete}
+
+  def PathToRoot(self, address):
+    """Like Inferior.PathToRoot, but of the dump and without labels."""
+    start = self.Id(address)
+    parents = {start: None}
+    pending = [start] if start is not None else []
+    root = None
+    # Breadth-first over the referrers, so the path found is a shortest one.
+    for i in pending:
+      if i in self.roots:
+        root = i
+        break
+      for referrer in self.Referrers(i):
+        if referrer not in parents:
+          parents[referrer] = i
+          pending.append(referrer)
+    path = []
+    if root is not None:
+      i = parents[root]
+      while i is not None:
+        path.append(self._Describe(i))
+        i = parents[i]
+    return {'address': address,
+            'root': self.roots[root] if root is not None else None,
+            'root_address': self.addresses[root] if root is not None else None,
+            'path': path,
+            'complete': self.complete}
+
+  def RetainedSizes(self, top=20):
+    """Like Inferior.RetainedSizes, but of the dump.
+
+    The paths are of type names, such as 'sys.modules -> dict -> Cache'.
+    """
+    order, parent, idom, _ = self.Dominators(sorted(self.roots),
+                                             lambda: False)
+    retained = self.Retained(order, idom)
+    largest = []
+    for k in self.Largest(retained, top):
+      steps = []
+      j = k
+      while parent[j]:
+        steps.append(self.TypeName(order[j]))
+        j = parent[j]
+      steps.append(self.roots[order[j]])
+      entry = self._Describe(order[k])
+      entry.update({'size': self.sizes[order[k]],
+                    'retained': retained[k],
+                    'path': ' -> '.join(reversed(steps))})
+      largest.append(entry)
+    total = sum(self.sizes)
+    return {'objects': len(order) - 1,
+            'bytes': retained[0],
+            'unreachable': len(self) - len(order) + 1,
+            'unreachable_bytes': total - retained[0],
+            'largest': largest,
+            'complete': self.complete}
@@ -0,0 +1,361 @@
+#! /usr/bin/env python
+#
+# Copyright 2014 Google Inc.  All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Commands for finding out what the inferior's memory is taken up by."""
+
+from pyringe import handles
+from pyringe import heap
+from pyringe.plugins import mod_base
+
+
+def FormatSize(size):
+  """Formats a number of bytes for humans."""
+  for unit in ('B', 'KiB', 'MiB', 'GiB'):
+    if size < 1024 or unit == 'GiB':
+      break
+    size /= 1024.0
+  if unit == 'B':
+    return '%d B' % size
+  return '%.1f %s' % (size, unit)
+
+
+def _Address(target):
+  """Returns the address of a handle, or an address as is."""
+  if isinstance(target, handles.RemoteHandle):
+    return target.address
+  return target
+
+
+def _FormatDelta(size):
+  return '%s%s' % ('-' if size < 0 else '+', FormatSize(abs(size)))
+
+
+def _FormatHistogram(histogram, total):
+  return ', '.join('%s %d (%.0f%%)' % (name, count, 100.0 * count / total)
+                   for name, count in histogram)
+
+
+class MemoryPlugin(mod_base.DebuggingPlugin):
+  """Inspection of the inferior's memory use, done within gdb."""
+
+  def __init__(self, inferior, name='memory'):
+    super(MemoryPlugin, self).__init__(inferior, name)
+    self.baseline = None
+
+  @property
+  def commands(self):
+    return (super(MemoryPlugin, self).commands +
+            [('summary', self.Summary),
+             ('dicthealth', self.DictHealth),
+             ('heapstats', self.HeapStats),
+             ('heapsnapshot', self.HeapSnapshot),
+             ('heapdiff', self.HeapDiff),
+             ('referrers', self.Referrers),
+             ('path_to_root', self.PathToRoot),
+             ('retained', self.Retained),
+             ('dupstrings', self.DuplicateStrings),
+             ('dumpheap', self.DumpHeap),
+             ('dumpbuf', self.DumpBuffer),
+             ('ndarray', self.inferior.NdArray),
+             ('ndstats', self.NdArrayStats),
+             ('loaddump', heap.LoadDump)])
+
+  def Summary(self, target, preview=5, budget=None):
+    """Print the length, item types and size of a container.
+
+    Unlike p(), this doesn't retrieve the container, so it's cheap even for
+    huge ones. Shared items count once per reference.
+    Args:
+      target: The name of a variable in the current frame, a handle as
+        returned by p(..., lazy=True), or an address.
+      preview: How many items to show.
+      budget: Seconds after which to settle for looking at fewer items.
+    """
+    summary = self.inferior.Summary(target, preview=preview, budget=budget)
+    print '%s at remote 0x%x: %s' % (summary['type'], summary['address'],
+                                     FormatSize(summary['size']))
+    if 'len' not in summary:
+      print '  %r' % (summary['preview'],)
+      return
+    scanned = summary['scanned']
+    print '  %d items%s, taking up %s' % (
+        summary['len'],
+        ' (%d scanned)' % scanned if scanned < summary['len'] else '',
+        FormatSize(summary['items_size']))
+    if scanned:
+      if 'key_types' in summary:
+        print '  keys:   %s' % _FormatHistogram(summary['key_types'], scanned)
+      print '  items:  %s' % _FormatHistogram(summary['types'], scanned)
+    for item in summary['preview']:
+      if 'key_types' in summary:
+        print '  %r: %r' % tuple(item)
+      else:
+        print '  %r' % (item,)
+
+  def DictHealth(self, target, collisions=10, budget=None):
+    """Print how well the keys of a dict are spread over its hash table.
+
+    Many colliding hashes and long probe sequences make dict lookups slow.
+    Args:
+      target: The name of a variable in the current frame, a handle as
+        returned by p(..., lazy=True), or an address.
+      collisions: How many of the most common colliding hashes to show.
+      budget: Seconds after which to settle for looking at fewer entries.
+    """
+    health = self.inferior.DictHealth(target, collisions=collisions,
+                                      budget=budget)
+    print 'dict at remote 0x%x: %s' % (health['address'],
+                                      FormatSize(health['table_size']))
+    print '  %d used, %d dummies, %d slots, %.0f%% full' % (
+        health['used'], health['dummies'], health['mask'] + 1,
+        100 * health['load'])
+    if health['scanned'] < health['used']:
+      print '  (only %d entries scanned)' % health['scanned']
+    print '  probes: mean %.2f, max %d' % (health['probe_mean'],
+                                           health['probe_max'])
+    histogram = health['probe_histogram']
+    for probes, count in histogram:
+      # The last bucket also counts all longer probe sequences.
+      more = probes == histogram[-1][0] and probes < health['probe_max']
+      print '    %3d%s %d' % (probes, '+' if more else ' ', count)
+    print '  %d distinct hashes' % health['distinct_hashes']
+    for collision in health['collisions']:
+      print '    hash %d: %d keys, e.g. %s' % (
+          collision['hash'], collision['count'],
+          ', '.join(repr(key) for key in collision['keys']))
+
+  def HeapStats(self, top=20, contents=False, sort='bytes', budget=None,
+                dump=None):
+    """Print which types of objects take up the most memory.
+
+    Only objects tracked by the gc (containers, instances, frames, ...) are
+    counted, unless contents is set.
+    Args:
+      top: How many types to show.
+      contents: Also count objects the gc doesn't track, like strs and ints,
+        as far as containers and instances refer to them. This is slower.
+      sort: 'bytes' or 'count', what to rank the types by.
+      budget: Seconds after which to settle for a partial census.
+      dump: A heap dump returned by loaddump, to look at instead of the
+        inferior. All its objects are counted.
+    """
+    if dump is not None:
+      census = dump.HeapCensus(top=top, sort=sort)
+    else:
+      census = self.inferior.HeapCensus(contents=contents, top=top,
+                                        sort=sort, budget=budget)
+    if hasattr(census, 'reason'):
+      print 'Partial census (%s).' % census.reason
+    print '%d objects, %s' % (census['objects'], FormatSize(census['bytes']))
+    print '%12s %12s  %s' % ('count', 'bytes', 'type')
+    for _, name, count, size in census['types']:
+      print '%12d %12s  %s' % (count, FormatSize(size), name)
+
+  def HeapSnapshot(self, contents=False, budget=None):
+    """Take a census of the heap by type, to pass to heapdiff later.
+
+    Args:
+      contents: As for heapstats.
+      budget: Seconds after which to settle for a partial census.
+    Returns:
+      The snapshot.
+    """
+    return self.inferior.HeapSnapshot(contents=contents, budget=budget)
+
+  def HeapDiff(self, before=None, after=None, top=20, contents=False,
+               budget=None):
+    """Print which types of objects grew between two heap snapshots.
+
+    To look for a leak, call heapdiff() once to take a baseline, and again
+    some time later to see what grew since. Alternatively, pass snapshots
+    taken by heapsnapshot.
+    Args:
+      before: The earlier snapshot. Defaults to the baseline, which the first
+        call without one takes (and returns).
+      after: The later snapshot. Defaults to taking one now.
+      top: How many of the fastest-growing types to show.
+      contents: As for heapstats, when taking snapshots.
+      budget: Seconds after which to settle for a partial census, when taking
+        snapshots.
+    """
+    if before is None:
+      if self.baseline is None:
+        self.baseline = self.HeapSnapshot(contents=contents, budget=budget)
+        print 'Took a baseline snapshot, call heapdiff() again to compare.'
+        return self.baseline
+      before = self.baseline
+    if after is None:
+      after = self.HeapSnapshot(contents=contents, budget=budget)
+    for snapshot in (before, after):
+      if snapshot.reason:
+        print 'Partial snapshot (%s): %r' % (snapshot.reason, snapshot)
+    print '%+d objects, %s in %ds' % (after.objects - before.objects,
+                                      _FormatDelta(after.bytes - before.bytes),
+                                      after.time - before.time)
+    print '%12s %12s %12s  %s' % ('count', '+count', '+bytes', 'type')
+    for delta in heap.Diff(before, after)[:top]:
+      if delta.size_delta <= 0 and delta.count_delta <= 0:
+        break
+      print '%12d %+12d %12s  %s' % (delta.count, delta.count_delta,
+                                     _FormatDelta(delta.size_delta),
+                                     delta.name)
+
+  def Referrers(self, target, limit=50, budget=None, dump=None):
+    """Print the objects referring to an object.
+
+    The first call after the inferior stopped scans the whole heap, later
+    ones (and path_to_root) reuse that scan until it runs again.
+    Args:
+      target: The name of a variable in the current frame, a handle as
+        returned by p(..., lazy=True), or an address.
+      limit: How many referrers to show.
+      budget: Seconds after which to settle for a partial scan of the heap.
+      dump: A heap dump returned by loaddump, to look at instead of the
+        inferior. target must be an address or handle then.
+    """
+    if dump is not None:
+      result = dump.FindReferrers(_Address(target), limit=limit)
+    else:
+      result = self.inferior.Referrers(target, limit=limit, budget=budget)
+    if not result['complete']:
+      print 'Partial scan of the heap, there may be more referrers.'
+    print '%d referrers of remote 0x%x' % (result['count'], result['address'])
+    for referrer in result['referrers']:
+      print '  %s at remote 0x%x%s%s' % (
+          referrer['type'], referrer['address'],
+          ' (%s)' % referrer['root'] if 'root' in referrer else '',
+          ': ' + referrer['label'] if referrer.get('label') else '')
+
+  def PathToRoot(self, target, budget=None, dump=None):
+    """Print a shortest chain of references keeping an object alive.
+
+    Args:
+      target: As for referrers.
+      budget: As for referrers.
+      dump: As for referrers.
+    """
+    if dump is not None:
+      result = dump.PathToRoot(_Address(target))
+    else:
+      result = self.inferior.PathToRoot(target, budget=budget)
+    if result['root'] is None:
+      print 'No root refers to remote 0x%x%s.' % (
+          result['address'],
+          '' if result['complete'] else ' (partial scan of the heap)')
+      return
+    print '%s at remote 0x%x' % (result['root'], result['root_address'])
+    for step in result['path']:
+      label = step.get('label')
+      print '  %s-> %s at remote 0x%x' % (label + ' ' if label else '',
+                                         step['type'], step['address'])
+
+  def Retained(self, top=20, budget=None, dump=None):
+    """Print the objects whose freeing would free the most memory.
+
+    Shares the scan of the heap with referrers and path_to_root.
+    Args:
+      top: How many objects to show.
+      budget: Seconds after which to settle for approximate sizes.
+      dump: A heap dump returned by loaddump, to look at instead of the
+        inferior.
+    """
+    if dump is not None:
+      result = dump.RetainedSizes(top=top)
+    else:
+      result = self.inferior.RetainedSizes(top=top, budget=budget)
+    if not result['complete']:
+      print 'Partial scan of the heap, retained sizes are approximations.'
+    print '%d objects reachable, %s; %d unreachable, %s' % (
+        result['objects'], FormatSize(result['bytes']),
+        result['unreachable'], FormatSize(result['unreachable_bytes']))
+    print '%12s %12s  %s' % ('retained', 'size', 'type and path')
+    for largest in result['largest']:
+      print '%12s %12s  %s at remote 0x%x' % (
+          FormatSize(largest['retained']), FormatSize(largest['size']),
+          largest['type'], largest['address'])
+      print '%27s%s' % ('', largest['path'])
+
+  def DuplicateStrings(self, top=20, budget=None):
+    """Print the strings that take up the most memory with equal copies.
+
+    Shares the scan of the heap with referrers. Values with an interned copy
+    could simply be intern()ed everywhere.
+    Args:
+      top: How many values to show.
+      budget: Seconds after which to settle for looking at fewer strings.
+    """
+    result = self.inferior.DuplicateStrings(top=top, budget=budget)
+    if not result['complete']:
+      print 'Partial scan of the heap.'
+    print '%d strings, %s, %d distinct; %s in duplicates' % (
+        result['strings'], FormatSize(result['bytes']), result['distinct'],
+        FormatSize(result['wasted']))
+    print '%12s %8s %10s  %s' % ('wasted', 'copies', 'each', 'value')
+    for duplicate in result['duplicates']:
+      print '%12s %8d %10s  %r%s' % (
+          FormatSize(duplicate['wasted']), duplicate['count'],
+          FormatSize(duplicate['size']), duplicate['value'],
+          ' (interned)' if duplicate['interned'] else '')
+
+  def DumpHeap(self, path, payloads=False, budget=None):
+    """Save the heap's objects and references to a file.
+
+    The file can be analyzed later, on any machine, by passing what
+    loaddump(path) returns as the dump argument of heapstats, referrers,
+    path_to_root and retained.
+    Args:
+      path: The file to write.
+      payloads: Also save the characters of all strs and unicodes.
+      budget: Seconds after which to settle for a partial dump.
+    """
+    result = self.inferior.DumpHeap(path, payloads=payloads, budget=budget)
+    print 'Wrote %d objects and %d references to %s (%s)%s.' % (
+        result['objects'], result['references'], result['path'],
+        FormatSize(result['bytes']),
+        '' if result['complete'] else ', a partial dump')
+
+  def DumpBuffer(self, target, path, budget=None):
+    """Save the raw contents of a str, bytearray, array or buffer to a file.
+
+    Args:
+      target: The name of a variable in the current frame, a handle as
+        returned by p(..., lazy=True), or an address.
+      path: The file to write.
+      budget: Seconds after which to settle for writing only the beginning.
+    """
+    result = self.inferior.DumpBuffer(target, path, budget=budget)
+    print 'Wrote %s of %s at remote 0x%x to %s%s.' % (
+        FormatSize(result['bytes']), result['type'], result['address'],
+        result['path'],
+        '' if result['bytes'] == result['length']
+        else ' (%s left out)' % FormatSize(result['length'] - result['bytes']))
+    if result['typecode'] != 'c':
+      print "Read it with array.array('%s').fromfile()." % result['typecode']
+
+  def NdArrayStats(self, target, budget=None):
+    """Print the shape, dtype, range, mean and NaN count of a numpy array.
+
+    The array is copied over in bulk (see ndarray), not element by element.
+    Args:
+      target: The name of a variable in the current frame, a handle as
+        returned by p(..., lazy=True), or an address.
+      budget: Seconds after which to give up.
+    """
+    summary = self.inferior.NdArraySummary(target, budget=budget)
+    print '%s array of shape %s' % (summary['dtype'], summary['shape'])
+    if summary['mean'] is not None:
+      print 'min %r, max %r, mean %r' % (summary['min'], summary['max'],
+                                         summary['mean'])
+    print '%d NaNs' % summary['nans']
@@ -0,0 +1,133 @@
+#! /usr/bin/env python
+#
+# Copyright 2014 Google Inc.  All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Commands for finding out where the inferior and the debugger spend time."""
+
+import base64
+
+from pyringe.plugins import mod_base
+
+
+class PerfPlugin(mod_base.DebuggingPlugin):
+  """Performance introspection of the inferior and of the debugger itself."""
+
+  def __init__(self, inferior, name='perf'):
+    super(PerfPlugin, self).__init__(inferior, name)
+
+  @property
+  def commands(self):
+    return (super(PerfPlugin, self).commands +
+            [('rpcstats', self.RpcStats),
+             ('svcprofile', self.ServiceProfile),
+             ('top', self.Top),
+             ('gil', self.Gil),
+             ('gilstats', self.GilStats)])
+
+  def RpcStats(self, path=None, reset=False):
+    """Print per-function latency statistics of calls to gdb.
+
+    Every column shows the mean and the approximate 90th percentile in
+    milliseconds. See the rpcstats module for what the columns mean.
+    Args:
+      path: If given, additionally write the full statistics (including the
+        histograms) there as JSON.
+      reset: Whether to start over with empty statistics afterwards.
+    """
+    stats = self.inferior.rpc_stats
+    print stats.Format()
+    if path:
+      with open(path, 'w') as dump_file:
+        stats.Dump(dump_file)
+    if reset:
+      stats.Reset()
+
+  def ServiceProfile(self, action='stats', sort='cumulative', limit=40,
+                     path=None):
+    """Profile the RPC handling inside gdb.
+
+    Use svcprofile('start'), run the slow commands, then svcprofile() to see
+    where gdb spent its time. Restarting gdb discards the profile.
+    Args:
+      action: 'start' to start profiling (discarding earlier profiles), 'stop'
+        to stop it, or 'stats' to print the profile gathered so far.
+      sort: The pstats sort key to print the profile by.
+      limit: How many lines of the profile to print.
+      path: If given, additionally write the profile there, in the format
+        read by the pstats module.
+    """
+    gdb = self.inferior.gdb
+    if action == 'start':
+      gdb.Admin('StartProfiler')
+    elif action == 'stop':
+      gdb.Admin('StopProfiler')
+    elif action == 'stats':
+      print gdb.Admin('ProfilerStats', sort, limit)
+      if path:
+        with open(path, 'wb') as dump_file:
+          dump_file.write(base64.b64decode(gdb.Admin('ProfilerDump')))
+    else:
+      raise ValueError('Unknown action %r, expected one of start, stop or '
+                       'stats.' % action)
+
+  def Top(self, interval=1.0, limit=10):
+    """Print the threads of the inferior using the most CPU.
+
+    The inferior runs undisturbed for the measurement, then is stopped again
+    to find out which python thread each busy thread is and where it is.
+    Args:
+      interval: How many seconds to measure for.
+      limit: How many of the busiest threads to print.
+    """
+    threads = self.inferior.ThreadCpu(interval)
+    print '%8s %20s %6s  %s' % ('lwp', 'python tid', 'cpu', 'frame')
+    for thread in threads[:limit]:
+      print '%8d %20s %5.1f%%  %s' % (
+          thread['lwp'], '-' if thread['tid'] is None else thread['tid'],
+          thread['cpu'], thread['frame'] or '-')
+
+  def Gil(self):
+    """Print which thread holds the GIL, and what the other threads do."""
+    gil = self.inferior.GilState()
+    if gil['locked'] is None:
+      print 'There is no GIL, threads were never used.'
+    else:
+      print 'GIL %s, held by thread %s.' % (
+          'locked' if gil['locked'] else 'free',
+          '-' if gil['holder'] is None else gil['holder'])
+    print '%20s %8s %12s  %s' % ('python tid', 'lwp', 'state', 'function')
+    for thread in gil['threads']:
+      print '%20d %8s %12s  %s' % (
+          thread['tid'], '-' if thread['lwp'] is None else thread['lwp'],
+          thread['state'], thread['function'] or '?')
+
+  def GilStats(self, samples=10, interval=0.1):
+    """Print how much each thread waits for the GIL, over several samples.
+
+    The inferior runs undisturbed between samples.
+    Args:
+      samples: How many times to look at the GIL.
+      interval: How many seconds to let the inferior run in between.
+    """
+    stats = self.inferior.GilContention(samples, interval)
+    print 'Some thread was waiting for the GIL in %.0f%% of %d samples.' % (
+        stats['contended'], stats['samples'])
+    print '%20s %8s %8s %8s %8s %8s %11s' % (
+        'python tid', 'lwp', 'running', 'waiting', 'syscall', 'other',
+        'contention')
+    for thread in stats['threads']:
+      print '%20d %8s %8d %8d %8d %8d %10.0f%%' % (
+          thread['tid'], '-' if thread['lwp'] is None else thread['lwp'],
+          thread['running'], thread['waiting-gil'], thread['syscall'],
+          thread['other'] + thread['unknown'], thread['contention'])
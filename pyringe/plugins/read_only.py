@@ -16,8 +16,10 @@
 """Read-only python thread inspection mode."""
 
 import logging
+import sys
 
 import gdb_shell
+from pyringe import inferior
 
 
 class ReadonlyPlugin(gdb_shell.GdbPlugin):
@@ -67,21 +69,92 @@ class ReadonlyPlugin(gdb_shell.GdbPlugin):
     """Move one frame down in the call stack."""
     return self.inferior.Down()
 
-  def InferiorLocals(self):
-    """Print the inferior's local identifiers in the current context."""
-    return self.inferior.InferiorLocals()
-
-  def InferiorGlobals(self):
-    """Print the inferior's global identifiers in the current context."""
-    return self.inferior.InferiorGlobals()
-
-  def InferiorBuiltins(self):
-    """Print the inferior's builtins in the current context."""
-    return self.inferior.InferiorBuiltins()
-
-  def Lookup(self, var_name):
-    """Look up a value in the current context."""
-    return self.inferior.Lookup(var_name)
+  def InferiorLocals(self, budget=None, graph=False, depth=None, items=None,
+                     string=None, total=None):
+    """Print the inferior's local identifiers in the current context.
+
+    Args:
+      budget: Seconds after which to settle for a partial result. Progress is
+        reported while waiting.
+      graph: Retrieve objects referenced more than once only once, keeping
+        them shared (and cycles intact) in the result.
+      depth, items, string, total: Limit how deeply nested values, how many
+        items per container, how many characters per string and roughly how
+        many bytes in total to retrieve. Whatever is cut short is marked.
+    """
+    if graph:
+      return self.inferior.InferiorLocalsGraph(budget=budget,
+                                               progress=self._Progress(budget))
+    return self.inferior.InferiorLocals(
+        budget=budget, progress=self._Progress(budget),
+        limits=inferior.Limits(depth, items, string, total))
+
+  def InferiorGlobals(self, budget=None, depth=None, items=None, string=None,
+                      total=None):
+    """Print the inferior's global identifiers in the current context.
+
+    Args:
+      budget: Seconds after which to settle for a partial result. Progress is
+        reported while waiting.
+      depth, items, string, total: Limit how deeply nested values, how many
+        items per container, how many characters per string and roughly how
+        many bytes in total to retrieve. Whatever is cut short is marked.
+    """
+    return self.inferior.InferiorGlobals(
+        budget=budget, progress=self._Progress(budget),
+        limits=inferior.Limits(depth, items, string, total))
+
+  def InferiorBuiltins(self, budget=None, depth=None, items=None, string=None,
+                       total=None):
+    """Print the inferior's builtins in the current context.
+
+    Args:
+      budget: Seconds after which to settle for a partial result. Progress is
+        reported while waiting.
+      depth, items, string, total: Limit how deeply nested values, how many
+        items per container, how many characters per string and roughly how
+        many bytes in total to retrieve. Whatever is cut short is marked.
+    """
+    return self.inferior.InferiorBuiltins(
+        budget=budget, progress=self._Progress(budget),
+        limits=inferior.Limits(depth, items, string, total))
+
+  def Lookup(self, var_name, budget=None, lazy=False, graph=False, depth=None,
+             items=None, string=None, total=None):
+    """Look up a value in the current context.
+
+    Args:
+      var_name: The name of the value.
+      budget: Seconds after which to settle for a partial result. Progress is
+        reported while waiting.
+      lazy: Return a handle that retrieves the value piece by piece as its
+        attributes, items or length are accessed, instead of all of it.
+      graph: Retrieve objects referenced more than once only once, keeping
+        them shared (and cycles intact) in the result.
+      depth, items, string, total: Limit how deeply nested values, how many
+        items per container, how many characters per string and roughly how
+        many bytes in total to retrieve. Whatever is cut short is marked.
+    """
+    if lazy:
+      return self.inferior.LookupHandle(var_name)
+    if graph:
+      return self.inferior.LookupGraph(var_name, budget=budget,
+                                       progress=self._Progress(budget))
+    return self.inferior.Lookup(var_name, budget=budget,
+                                progress=self._Progress(budget),
+                                limits=inferior.Limits(depth, items, string,
+                                                       total))
+
+  @staticmethod
+  def _Progress(budget):
+    """Returns a callback printing progress reports, if a budget is set."""
+    if budget is None:
+      return None
+    def Report(progress):
+      sys.stderr.write('\r%d items, %d bytes, %.1f of %.1fs' % (
+          progress['items'], progress['bytes'], progress['elapsed'], budget))
+      sys.stderr.flush()
+    return Report
 
   def ListThreads(self):
     """List the currently running python threads.
@@ -112,9 +185,16 @@ class ReadonlyPlugin(gdb_shell.GdbPlugin):
     if self.inferior.is_running:
       return self.inferior.current_thread
 
-  def Cancel(self):
-    """Cancel a running command that has timeouted."""
-    return self.inferior.Cancel()
+  def Cancel(self, partial=False):
+    """Cancel a running command that has timeouted.
+
+    Args:
+      partial: If set, return whatever the command gathered until it was
+        cancelled instead of discarding it.
+    Returns:
+      The partial result of the command, if requested.
+    """
+    return self.inferior.Cancel(partial)
 
   def Continue(self):
     """Continue execution of the inferior."""
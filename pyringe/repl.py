@@ -26,6 +26,8 @@ import rlcompleter  # pylint: disable=unused-import
 import sys
 import inferior
 from plugins import inject
+from plugins import memory
+from plugins import perf
 
 
 # Optionally support colorama
@@ -68,8 +70,14 @@ class DebuggingConsole(code.InteractiveConsole):
     inferior: The pid of the inferior process
   """
 
-  def __init__(self):
-    self.inferior = inferior.Inferior(None)
+  def __init__(self, target=None):
+    """Sets up the console.
+
+    Args:
+      target: The inferior.Inferior to debug, e.g. a replay.ReplayInferior.
+        By default, a fresh Inferior is created which isn't attached yet.
+    """
+    self.inferior = target or inferior.Inferior(None)
     self.commands = {'help': self.ListCommands,
                      'pyhelp': help,  # we shouldn't completely hide this
                      'attach': self.Attach,
@@ -79,7 +87,9 @@ class DebuggingConsole(code.InteractiveConsole):
                      'loadplugin': self.LoadCommandPlugin,
                      'quit': self.Quit,
                     }
-    self.plugins = [inject.InjectPlugin(self.inferior)]
+    self.plugins = [inject.InjectPlugin(self.inferior),
+                    memory.MemoryPlugin(self.inferior),
+                    perf.PerfPlugin(self.inferior)]
     readline.parse_and_bind('tab: complete')
     colorama.init()
 
@@ -93,7 +103,8 @@ class DebuggingConsole(code.InteractiveConsole):
     locals_dir.update(self.commands)
     code.InteractiveConsole.__init__(self)
     self.locals = locals_dir
-    self.LoadCommandPlugin(inject.InjectPlugin(self.inferior))
+    for plugin in self.plugins:
+      self.LoadCommandPlugin(plugin)
 
   def LoadCommandPlugin(self, plugin):
     """Load a command plugin."""
@@ -188,7 +199,7 @@ class DebuggingConsole(code.InteractiveConsole):
     try:
       exec co in self.locals  # pylint: disable=exec-used
     except SystemExit:
-      self.inferior.Cancel()
+      self.inferior.ShutDownGdb()
       raise
     except KeyboardInterrupt:
       raise
@@ -0,0 +1,197 @@
+#! /usr/bin/env python
+#
+# Copyright 2014 Google Inc.  All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Playing back recorded gdb sessions without gdb or an inferior.
+
+With inferior.RECORD_PATH set, every gdb session's traffic is written to a
+log (see inferior.TrafficRecorder). ReplayGdbProxy serves one of these
+sessions in place of a real gdb, answering each request with the recorded
+replies after the recorded (optionally scaled) delay. ReplayInferior starts a
+new ReplayGdbProxy for the next recorded session whenever Inferior would
+start gdb, so the debugger can be run against a recording:
+
+  log = replay.ReplayLog('/tmp/session.log')
+  console = repl.DebuggingConsole(replay.ReplayInferior(None, log=log))
+  console.interact()
+
+Requests have to be issued in the recorded order; only the function names are
+checked, so e.g. differing symbol file paths don't matter.
+"""
+
+import collections
+import gzip
+import json
+import logging
+import re
+import time
+
+import inferior
+
+
+# The id in a reply. The service writes the keys of a reply's envelope before
+# its result, so the first match is the envelope's.
+_REPLY_ID = re.compile(r'"id": (\d+)')
+
+
+class ReplayError(inferior.Error):
+  """Raised when the client deviates from the recording."""
+
+
+def LoadSessions(path):
+  """Reads a traffic log.
+
+  Args:
+    path: The log file, compressed if its name ends in '.gz'.
+  Returns:
+    A list of sessions, each a list of (time, kind, data) events.
+  """
+  opener = gzip.open if path.endswith('.gz') else open
+  sessions = []
+  with opener(path, 'rb') as log_file:
+    for line in log_file:
+      if not line.strip():
+        continue
+      elapsed, kind, data = json.loads(line)
+      if kind == 'session':
+        sessions.append([])
+      elif not sessions:
+        raise ReplayError('%s does not start with a session.' % path)
+      else:
+        sessions[-1].append((elapsed, kind, data))
+  return sessions
+
+
+class ReplayLog(object):
+  """The recorded sessions of a log, handed out in order."""
+
+  def __init__(self, path):
+    self.path = path
+    self._sessions = collections.deque(LoadSessions(path))
+
+  def NextSession(self):
+    if not self._sessions:
+      raise ReplayError('No more recorded gdb sessions in %s.' % self.path)
+    return self._sessions.popleft()
+
+
+class ReplayGdbProxy(inferior.GdbProxy):
+  """Stand-in for GdbProxy serving a recorded session.
+
+  Every request sent takes the next recorded request's place; the events
+  recorded after that (up to the next request) are then delivered in order,
+  each at the same delay after the request as in the recording, multiplied by
+  `scale`.
+  """
+
+  def __init__(self, session, scale=1.0, stats=None):
+    # Not calling GdbProxy.__init__, there is no process to start.
+    # pylint: disable=super-init-not-called
+    self._InitRpcState(stats)
+    self._events = collections.deque(session)
+    self._scale = scale
+    # (due time, kind, data) of events ready for delivery.
+    self._due = collections.deque()
+    # Maps the ids of recorded requests to those of the replayed ones.
+    self._id_map = {}
+    self._running = True
+
+  @property
+  def is_running(self):
+    return self._running
+
+  def Kill(self):
+    try:
+      if self.is_running:
+        self.Detach()
+      self._Execute('__kill__')
+    except (inferior.TimeoutError, inferior.ProxyError, ReplayError):
+      logging.debug('Replayed session did not end cleanly.')
+    self._running = False
+
+  def _Send(self, string):
+    with self._send_lock:
+      now = time.time()
+      if not self._events:
+        raise ReplayError('Recording ended before request %s' % string)
+      sent, kind, recorded = self._events.popleft()
+      if kind != 's':
+        raise ReplayError('Recording out of sync, expected a request.')
+      request = json.loads(string)
+      recorded_request = json.loads(recorded)
+      if request.get('func') != recorded_request.get('func'):
+        raise ReplayError('Expected a call to %s, got %s.' % (
+            recorded_request.get('func'), request.get('func')))
+      if 'id' in recorded_request:
+        self._id_map[recorded_request['id']] = request.get('id')
+      while self._events and self._events[0][1] != 's':
+        elapsed, kind, data = self._events.popleft()
+        self._due.append((now + (elapsed - sent) * self._scale, kind, data))
+
+  def _Recv(self, timeout):
+    if not self._due:
+      # Nothing was recorded in answer, so this timed out when recorded too.
+      if timeout is inferior.TIMEOUT_FOREVER:
+        raise ReplayError('Waiting for a reply that never came.')
+      time.sleep(timeout)
+      raise inferior.TimeoutError()
+    due, kind, data = self._due[0]
+    wait = due - time.time()
+    if timeout is not inferior.TIMEOUT_FOREVER and wait > timeout:
+      time.sleep(timeout)
+      raise inferior.TimeoutError()
+    if wait > 0:
+      time.sleep(wait)
+    self._due.popleft()
+    if kind == 'e':
+      raise self._ProxyErrorFromStderr(data)
+    return self._MapIds(data)
+
+  def _MapIds(self, line):
+    """Rewrites a recorded reply to carry the id of the replayed request.
+
+    This works on the text, so replies aren't decoded twice during replay.
+    """
+    match = _REPLY_ID.search(line)
+    if not match:
+      return line
+    recorded_id = int(match.group(1))
+    replay_id = self._id_map.get(recorded_id, recorded_id)
+    if replay_id is None or replay_id == recorded_id:
+      return line
+    return '%s%d%s' % (line[:match.start(1)], replay_id, line[match.end(1):])
+
+
+class ReplayInferior(inferior.Inferior):
+  """Inferior whose gdb sessions are played back from a ReplayLog.
+
+  The process is considered running whenever a pid is set.
+  """
+
+  def __init__(self, pid, auto_symfile_loading=True,
+               architecture='i386:x86-64', log=None, scale=1.0):
+    # Reinit calls __init__ again without the replay arguments.
+    if log is not None:
+      self.log = log
+      self.scale = scale
+    super(ReplayInferior, self).__init__(pid, auto_symfile_loading,
+                                         architecture)
+
+  def _NewGdbProxy(self):
+    return ReplayGdbProxy(self.log.NextSession(), self.scale,
+                          stats=self.rpc_stats)
+
+  @property
+  def is_running(self):
+    return bool(self.position.pid)
@@ -0,0 +1,197 @@
+#! /usr/bin/env python
+#
+# Copyright 2014 Google Inc.  All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Per-function latency and size statistics for RPCs to the gdb service.
+
+Every RPC is broken down into the phases it spends its time in:
+* 'round_trip': From sending the request to having decoded the reply.
+* 'compute':    Running the function within gdb.
+* 'read':       Retrieving inferior data through libpython while encoding the
+                result (most values are only read from the inferior then).
+* 'encode':     JSON encoding the result, not counting 'read'.
+* 'decode':     JSON decoding the reply in pyringe.
+* 'transport':  Whatever is left of the round trip, i.e. time spent in pipes,
+                temporary files and gdb's own scheduling.
+The first and 'decode' are measured by pyringe, the others are reported by
+the gdb service alongside each reply. Additionally, the size of the encoded
+result is recorded as 'bytes'.
+"""
+
+import json
+import threading
+
+
+PHASES = ('round_trip', 'compute', 'read', 'encode', 'transport', 'decode')
+
+
+class Histogram(object):
+  """Counts values in power-of-two buckets.
+
+  Bucket n holds values v with 2**(n-1) <= v * scale < 2**n, bucket 0 holds
+  everything below 1 / scale.
+  """
+
+  def __init__(self, scale=1):
+    self.scale = scale
+    self.buckets = []
+    self.count = 0
+    self.total = 0
+    self.min = None
+    self.max = None
+
+  def Add(self, value):
+    self.count += 1
+    self.total += value
+    if self.min is None or value < self.min:
+      self.min = value
+    if self.max is None or value > self.max:
+      self.max = value
+    index = int(value * self.scale).bit_length() if value > 0 else 0
+    if index >= len(self.buckets):
+      self.buckets.extend([0] * (index + 1 - len(self.buckets)))
+    self.buckets[index] += 1
+
+  @property
+  def mean(self):
+    return self.total / float(self.count) if self.count else 0
+
+  def Percentile(self, percent):
+    """Estimates a percentile as the upper bound of the bucket it falls in."""
+    if not self.count:
+      return 0
+    rank = self.count * percent / 100.0
+    seen = 0
+    for index, bucket_count in enumerate(self.buckets):
+      seen += bucket_count
+      if seen >= rank:
+        return min(float(2 ** index) / self.scale, self.max)
+    return self.max
+
+  def AsDict(self):
+    return {'count': self.count,
+            'total': self.total,
+            'min': self.min,
+            'max': self.max,
+            'scale': self.scale,
+            'buckets': list(self.buckets)}
+
+
+class FunctionStats(object):
+  """Statistics for all calls to one RPC function.
+
+  Attributes:
+    calls: The number of calls that got a reply.
+    failures: The number of calls that raised, timed out or were cancelled.
+    phases: Maps the names in PHASES to histograms of seconds.
+    bytes: Histogram of encoded result sizes.
+  """
+
+  def __init__(self):
+    self.calls = 0
+    self.failures = 0
+    self.phases = dict((phase, Histogram(scale=1e6)) for phase in PHASES)
+    self.bytes = Histogram()
+
+  def AsDict(self):
+    phases = dict((phase, histogram.AsDict())
+                  for phase, histogram in self.phases.iteritems())
+    return {'calls': self.calls,
+            'failures': self.failures,
+            'phases': phases,
+            'bytes': self.bytes.AsDict()}
+
+
+class RpcStats(object):
+  """Collects FunctionStats for all RPCs of a gdb session.
+
+  Safe to use from several threads.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.functions = {}
+
+  def Record(self, funcname, round_trip, decode=0, service=None):
+    """Records a completed call.
+
+    Args:
+      funcname: The name of the RPC function.
+      round_trip: Seconds from sending the request to having decoded the reply.
+      decode: Seconds spent decoding the reply.
+      service: The 'stats' dict the gdb service sent along with the reply, if
+        any, with the keys 'compute', 'read', 'encode' and 'bytes'.
+    """
+    with self._lock:
+      stats = self._Get(funcname)
+      stats.calls += 1
+      stats.phases['round_trip'].Add(round_trip)
+      stats.phases['decode'].Add(decode)
+      if service:
+        spent = decode
+        for phase in ('compute', 'read', 'encode'):
+          stats.phases[phase].Add(service.get(phase, 0))
+          spent += service.get(phase, 0)
+        stats.phases['transport'].Add(max(round_trip - spent, 0))
+        stats.bytes.Add(service.get('bytes', 0))
+
+  def RecordFailure(self, funcname):
+    with self._lock:
+      self._Get(funcname).failures += 1
+
+  def _Get(self, funcname):
+    if funcname not in self.functions:
+      self.functions[funcname] = FunctionStats()
+    return self.functions[funcname]
+
+  def Reset(self):
+    with self._lock:
+      self.functions = {}
+
+  def AsDict(self):
+    """Returns all statistics as a JSON-serializable dict."""
+    with self._lock:
+      return dict((funcname, stats.AsDict())
+                  for funcname, stats in self.functions.iteritems())
+
+  def Dump(self, fileobj):
+    """Writes the statistics to a file object as JSON."""
+    json.dump(self.AsDict(), fileobj, indent=1, sort_keys=True)
+    fileobj.write('\n')
+
+  def Format(self):
+    """Renders the statistics as a human-readable table.
+
+    Every phase shows the mean and (estimated) 90th percentile in
+    milliseconds.
+
+    Returns:
+      The table as a string.
+    """
+    header = '%-22s %6s %5s' % ('function', 'calls', 'fail')
+    for phase in PHASES:
+      header += ' %15s' % phase
+    header += ' %10s' % 'bytes/call'
+    lines = [header]
+    with self._lock:
+      for funcname in sorted(self.functions):
+        stats = self.functions[funcname]
+        line = '%-22s %6d %5d' % (funcname[:22], stats.calls, stats.failures)
+        for phase in PHASES:
+          histogram = stats.phases[phase]
+          line += ' %7.1f/%7.1f' % (1000 * histogram.mean,
+                                    1000 * histogram.Percentile(90))
+        line += ' %10d' % stats.bytes.mean
+        lines.append(line)
+    return '\n'.join(lines)
@@ -0,0 +1,337 @@
+#! /usr/bin/env python
+#
+# Copyright 2014 Google Inc.  All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Sharing one gdb session between several concurrent clients.
+
+A gdb service can only ever handle one request at a time, and attaching a
+second gdb to the same process isn't possible. RequestScheduler owns the
+Inferior that is attached to the process and runs all RPCs on a single worker
+thread, picking the most urgent request first. Clients get their own
+SharedInferior, which behaves like a regular Inferior (including having its
+own selected thread and frame) but routes everything through the scheduler.
+
+Usage:
+  sched = scheduler.RequestScheduler(inferior.Inferior(pid))
+  repl_view = sched.Client(scheduler.PRIORITY_INTERACTIVE)
+  sampler_view = sched.Client(scheduler.PRIORITY_BACKGROUND)
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import sys
+import threading
+
+import handles
+import inferior
+
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 5
+PRIORITY_BACKGROUND = 10
+
+
+class Error(inferior.Error):
+  pass
+
+
+class SchedulerClosedError(Error):
+  """Raised when submitting requests to a scheduler that has been closed."""
+
+
+class _Request(object):
+  """A pending RPC, possibly shared between several identical submissions."""
+
+  def __init__(self, key, funcname, args, kwargs, priority):
+    self.key = key
+    self.funcname = funcname
+    self.args = args
+    self.kwargs = kwargs
+    self.priority = priority
+    self.epoch = None
+    self._done = threading.Event()
+    self._result = None
+    self._exc_info = None
+
+  @property
+  def done(self):
+    return self._done.is_set()
+
+  def SetResult(self, result):
+    self._result = result
+    self._done.set()
+
+  def SetException(self, exc_info):
+    self._exc_info = exc_info
+    self._done.set()
+
+  def Wait(self, timeout=None):
+    """Waits for the request to be run and returns its result.
+
+    Args:
+      timeout: Seconds to wait for the request to be run, None meaning
+        forever. Note that this is the time spent in the queue plus the time
+        spent in gdb.
+    Raises:
+      inferior.TimeoutError: if the request wasn't completed in time.
+      Anything the RPC itself raised.
+    Returns:
+      The result of the RPC.
+    """
+    if not self._done.wait(timeout):
+      raise inferior.TimeoutError()
+    if self._exc_info:
+      raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+    return self._result
+
+
+class RequestScheduler(object):
+  """Serializes RPCs from several clients onto one attached gdb.
+
+  Requests are run in order of priority (lower values first), and in order of
+  submission within one priority. Identical read-only requests (see
+  inferior.READ_ONLY_RPCS) are only run once per stop epoch: a request that is
+  already queued is shared with later submitters, and a completed one is
+  answered from cache until the inferior is allowed to change again.
+
+  Attributes:
+    inferior: The Inferior all requests are run against.
+  """
+
+  def __init__(self, owner):
+    self.inferior = owner
+    # Held while the worker runs a request, and while clients start, stop or
+    # reconfigure the underlying gdb.
+    self.lock = threading.RLock()
+    self._cond = threading.Condition(threading.Lock())
+    self._queue = []
+    self._counter = itertools.count()
+    self._pending = {}
+    self._results = {}
+    self._results_epoch = None
+    self._closed = False
+    self._worker = threading.Thread(target=self._Run,
+                                    name='pyringe-scheduler')
+    self._worker.daemon = True
+    self._worker.start()
+
+  def Client(self, priority=PRIORITY_DEFAULT):
+    """Returns a new Inferior-like view running its RPCs at `priority`."""
+    return SharedInferior(self, priority)
+
+  def Close(self):
+    """Stops the worker thread. Queued requests fail with SchedulerClosedError."""
+    with self._cond:
+      self._closed = True
+      self._cond.notify()
+    self._worker.join()
+
+  def _Epoch(self):
+    gdb = self.inferior._gdb  # pylint: disable=protected-access
+    if not gdb:
+      return None
+    return (id(gdb), gdb.stop_epoch)
+
+  def _Key(self, funcname, args):
+    if funcname not in inferior.READ_ONLY_RPCS:
+      return None
+    try:
+      return funcname, json.dumps(args, sort_keys=True)
+    except (TypeError, ValueError):
+      return None
+
+  def Submit(self, funcname, args, kwargs=None, priority=PRIORITY_DEFAULT):
+    """Queues an RPC to the gdb service.
+
+    Args:
+      funcname: The name of the GdbService function to call.
+      args: A list of positional arguments for the function.
+      kwargs: Keyword arguments for GdbProxy._Execute.
+      priority: Requests with lower values are run first.
+    Raises:
+      SchedulerClosedError: if the scheduler has been closed.
+    Returns:
+      A request object whose Wait method returns the RPC's result.
+    """
+    kwargs = kwargs or {}
+    key = self._Key(funcname, args)
+    if any(value is not None for value in kwargs.itervalues()):
+      # Budgets, progress callbacks etc. make sharing results surprising.
+      key = None
+    with self._cond:
+      if self._closed:
+        raise SchedulerClosedError('Scheduler has been closed.')
+      if key:
+        epoch = self._Epoch()
+        if self._results_epoch == epoch and key in self._results:
+          request = _Request(key, funcname, args, kwargs, priority)
+          request.SetResult(self._results[key])
+          return request
+        request = self._pending.get(key)
+        if request:
+          if priority < request.priority:
+            # Somebody more impatient is waiting for this now, queue it again
+            # at the better priority. The worker skips the stale entry.
+            request.priority = priority
+            self._Push(request)
+          return request
+      request = _Request(key, funcname, args, kwargs, priority)
+      if key:
+        self._pending[key] = request
+      self._Push(request)
+      return request
+
+  def Call(self, funcname, args, kwargs=None, priority=PRIORITY_DEFAULT):
+    """Like Submit, but blocks until the RPC has completed."""
+    return self.Submit(funcname, args, kwargs, priority).Wait()
+
+  def _Push(self, request):
+    heapq.heappush(self._queue,
+                   (request.priority, next(self._counter), request))
+    self._cond.notify()
+
+  def _Pop(self):
+    with self._cond:
+      while True:
+        while not self._queue and not self._closed:
+          self._cond.wait()
+        if self._closed:
+          for _, _, request in self._queue:
+            if not request.done:
+              request.SetException((SchedulerClosedError,
+                                    SchedulerClosedError('Scheduler closed.'),
+                                    None))
+          self._queue = []
+          return None
+        priority, _, request = heapq.heappop(self._queue)
+        if request.done or priority != request.priority:
+          # Already run from an entry with better priority.
+          continue
+        return request
+
+  def _Run(self):
+    while True:
+      request = self._Pop()
+      if not request:
+        return
+      with self.lock:
+        epoch = self._Epoch()
+        try:
+          result = self.inferior.gdb._Execute(  # pylint: disable=protected-access
+              request.funcname, *request.args, **request.kwargs)
+        except Exception:  # pylint: disable=broad-except
+          logging.debug('Scheduled %s failed', request.funcname)
+          with self._cond:
+            self._pending.pop(request.key, None)
+          request.SetException(sys.exc_info())
+          continue
+      with self._cond:
+        self._pending.pop(request.key, None)
+        if request.key and self._Epoch() == epoch:
+          if self._results_epoch != epoch:
+            self._results = {}
+            self._results_epoch = epoch
+          self._results[request.key] = result
+      request.SetResult(result)
+
+
+class _SchedulingProxy(object):
+  """Stand-in for GdbProxy that submits every RPC to a RequestScheduler."""
+
+  def __init__(self, sched, priority):
+    self._scheduler = sched
+    self._priority = priority
+
+  def __getattr__(self, name):
+    return lambda *args, **kwargs: self._Execute(name, *args, **kwargs)
+
+  def _Execute(self, funcname, *args, **kwargs):
+    return self._scheduler.Call(funcname, list(args), kwargs, self._priority)
+
+  def Admin(self, name, *args, **kwargs):
+    """Calls `name` in the service's admin namespace, see GdbProxy.Admin."""
+    return self._Execute(inferior.ADMIN_PREFIX + name, *args, **kwargs)
+
+  @property
+  def is_running(self):
+    gdb = self._scheduler.inferior._gdb  # pylint: disable=protected-access
+    return bool(gdb and gdb.is_running)
+
+  def RebuildGraph(self, result):
+    """Rebuilds a graph with the shared GdbProxy's class table.
+
+    This is no RPC, but it may make some to retrieve class dicts, so it runs
+    while the worker is idle.
+    """
+    with self._scheduler.lock:
+      return self._scheduler.inferior.gdb.RebuildGraph(result)
+
+  @property
+  def stop_epoch(self):
+    """The stop epoch of the shared GdbProxy, see GdbProxy.stop_epoch."""
+    return self._scheduler.inferior.gdb.stop_epoch
+
+
+class SharedInferior(inferior.Inferior):
+  """An Inferior whose gdb session is shared through a RequestScheduler.
+
+  Every client keeps its own position (thread and frame), so a background
+  sampler walking through all threads doesn't move the REPL's selection.
+  Starting and stopping gdb affects all clients.
+  """
+
+  def __init__(self, sched, priority):
+    # Deliberately not calling Inferior.__init__, the scheduler's inferior
+    # owns the gdb session.
+    owner = sched.inferior
+    self._scheduler = sched
+    self._priority = priority
+    self.position = self._Position(pid=owner.position.pid, tid=None,
+                                   frame_depth=-1)
+    self.arch = owner.arch
+    self.auto_symfile_loading = owner.auto_symfile_loading
+    self.handle_cache = handles.HandleCache()
+    # A single proxy, as the handle cache starts over whenever gdb changes.
+    self._proxy = _SchedulingProxy(sched, priority)
+
+  @property
+  def gdb(self):
+    return self._proxy
+
+  @property
+  def _gdb(self):
+    return self._scheduler.inferior._gdb  # pylint: disable=protected-access
+
+  @property
+  def rpc_stats(self):
+    return self._scheduler.inferior.rpc_stats
+
+  def StartGdb(self):
+    with self._scheduler.lock:
+      self._scheduler.inferior.StartGdb()
+
+  def ShutDownGdb(self):
+    with self._scheduler.lock:
+      self._scheduler.inferior.ShutDownGdb()
+
+  def LoadSymbolFile(self, path=None):
+    with self._scheduler.lock:
+      self._scheduler.inferior.LoadSymbolFile(path)
+
+  def Reinit(self, pid, auto_symfile_loading=True):
+    with self._scheduler.lock:
+      self._scheduler.inferior.Reinit(pid, auto_symfile_loading)
+    self.position = self._Position(pid=pid, tid=None, frame_depth=-1)